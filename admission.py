@@ -0,0 +1,149 @@
+"""Admission control for chat generations.
+
+`AdmissionController` decides when a `/chat` request may start generating:
+
+- turns of the same session run one at a time, so concurrent requests never
+  interleave their reads and appends to one history;
+- at most `max_in_flight` generations run at once across all sessions;
+- requests beyond that wait in a queue of at most `max_queue` entries, and
+  free slots are handed out round-robin across sessions so one busy client
+  cannot starve the others;
+- when the queue is full, `acquire` fails immediately with `QueueFullError`
+  carrying a Retry-After estimate.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    """The request cannot be admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted (or waiting) request; call `release()` when it is done."""
+
+    __slots__ = ("session_id", "enqueued", "admitted", "granted", "_controller", "_released")
+
+    def __init__(self, controller, session_id):
+        self._controller = controller
+        self.session_id = session_id
+        self.enqueued = time.monotonic()
+        self.admitted = None
+        self.granted = False
+        self._released = False
+
+    def release(self):
+        self._controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=32, max_queue=256, queue_timeout=30.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._active_sessions = set()
+        self._waiting = OrderedDict()  # session_id -> deque of tickets
+        self._queued = 0
+        self._wait_times = deque(maxlen=1024)
+        self._durations = deque(maxlen=256)
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    def acquire(self, session_id: str) -> Ticket:
+        """Wait for a generation slot for `session_id` and return its ticket."""
+        with self._cond:
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise QueueFullError("admission queue is full", self._retry_after())
+            ticket = Ticket(self, session_id)
+            self._waiting.setdefault(session_id, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+
+            deadline = ticket.enqueued + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove_waiting(ticket)
+                    self._stats["timed_out"] += 1
+                    raise QueueFullError("timed out waiting for admission", self._retry_after())
+                self._cond.wait(remaining)
+            return ticket
+
+    def is_active(self, session_id: str) -> bool:
+        """True while a turn of `session_id` holds a generation slot."""
+        with self._cond:
+            return session_id in self._active_sessions
+
+    def _dispatch(self):
+        # Hand free slots to waiting sessions in round-robin order, skipping
+        # sessions that already have a turn in flight.
+        for session_id in list(self._waiting):
+            if self._in_flight >= self.max_in_flight:
+                break
+            if session_id in self._active_sessions:
+                continue
+            tickets = self._waiting.pop(session_id)
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting[session_id] = tickets  # re-queue at the back
+            self._queued -= 1
+            self._in_flight += 1
+            self._active_sessions.add(session_id)
+            ticket.granted = True
+            ticket.admitted = time.monotonic()
+            self._wait_times.append(ticket.admitted - ticket.enqueued)
+            self._stats["admitted"] += 1
+        self._cond.notify_all()
+
+    def _remove_waiting(self, ticket):
+        tickets = self._waiting.get(ticket.session_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self._queued -= 1
+            if not tickets:
+                del self._waiting[ticket.session_id]
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket._released or not ticket.granted:
+                return
+            ticket._released = True
+            self._in_flight -= 1
+            self._active_sessions.discard(ticket.session_id)
+            self._durations.append(time.monotonic() - ticket.admitted)
+            self._dispatch()
+
+    def _retry_after(self):
+        # Roughly how long until the current queue drains, in whole seconds
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        waves = (self._queued + self._in_flight) / max(1, self.max_in_flight)
+        return max(1, math.ceil(average * waves))
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._wait_times)
+            pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else 0.0
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "queue_depth": self._queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "wait_ms_p50": pick(0.50),
+                "wait_ms_p95": pick(0.95),
+                "wait_ms_max": pick(1.0),
+            }
@@ -1,24 +1,29 @@
 import os
+import contextvars
+import inspect
+import json
 import logging
-from dotenv import load_dotenv
-from flask import Flask, request, Response, stream_with_context
+import queue
+import threading
+import uuid
+from flask import Flask, request, Response, jsonify, stream_with_context
 from flask_cors import CORS, cross_origin
-from langchain_core.messages import HumanMessage
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import trim_messages
-from operator import itemgetter
-from langchain_core.runnables import RunnablePassthrough
-
-
-# Set up logging
-logging.basicConfig(filename='chatbot_errors.log', level=logging.ERROR, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from admission import QueueFullError
+from cancellation import TurnGuard
+from chat_service import (
+    admission, breakers, cancellations, chat_models, compactor, get_session_history,
+    keep_partial_on_disconnect, memory, metrics, models, profiles, resilience_enabled,
+    resilience_stats, response_cache, route_turn, router, store,
+)
+from log_setup import request_id_var, session_id_var, upstream_log
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, InstrumentedModel, route_label
+from request_context import turn_guard_var
+from resilience import served_model
+from resumable import ResumeError, StreamRegistry, plain_body, sse_body
+from streaming import plain_stream, sse_stream
 
-# Load environment variables
-load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -26,89 +31,368 @@ CORS(app)  # Allow requests from Svelte dev server
 
 app.config['CORS_HEADERS'] = 'Content-Type'
 
-# Initialize the model
-try:
-    model = ChatOpenAI(model="gpt-3.5-turbo")
-except Exception as e:
-    logging.error(f"Failed to initialize ChatOpenAI model: {str(e)}")
-    print("An error occurred while initializing the chatbot. Please check the log file.")
-    exit(1)
-
-# Create a store for chat histories
-store = {}
-
-def get_session_history(session_id: str):
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    return store[session_id]
-
-# Create a more customizable prompt template
-prompt = ChatPromptTemplate.from_messages([
-    (
-        "system",
-        "You are a helpful assistant. Answer all questions to the best of your ability "
-        "in {language}. Speak at a {speaking_level} level with a {tone} tone. "
-        "Try to incorporate these words or phrases if relevant: {specific_words}. "
-        "Additional instructions: {additional_instructions}"
-    ),
-    MessagesPlaceholder(variable_name="messages"),
-])
-
-# Create the message trimmer
-trimmer = trim_messages(
-    max_tokens=65,
-    strategy="last",
-    token_counter=model,
-    include_system=True,
-    allow_partial=False,
-    start_on="human",
-)
+# Merge streamed chunks into writes of up to this many bytes or milliseconds
+coalesce_bytes = int(os.getenv('STREAM_COALESCE_BYTES', '256'))
+coalesce_delay = float(os.getenv('STREAM_COALESCE_MS', '20')) / 1000
+sse_heartbeat = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
 
-# Create the chain
-chain = (
-    RunnablePassthrough.assign(messages=itemgetter("messages") | trimmer)
-    | prompt
-    | model
-)
+# RESUMABLE_STREAMS=1 keeps each /chat answer in a short-lived, sequence-numbered log,
+# so a client that lost its connection fetches the rest from /chat/resume/<response_id>
+# instead of sending the message again
+streams = None
+if os.getenv('RESUMABLE_STREAMS', '0') == '1':
+    streams = StreamRegistry(
+        ttl=float(os.getenv('RESUME_TTL_SECONDS', '60')),
+        max_responses=int(os.getenv('RESUME_MAX_RESPONSES', '1000')),
+        max_chunks=int(os.getenv('RESUME_MAX_CHUNKS', '1024')),
+        detached_grace=float(os.getenv('RESUME_GRACE_SECONDS', '30')),
+    )
 
-# Set up the chain with message history
-with_message_history = RunnableWithMessageHistory(
-    chain,
-    get_session_history,
-    input_messages_key="messages",
-)
+def log_response(log, last_event_id=0, offset=None):
+    # Read a resumable response log as SSE or plain text, from the given position
+    seq, skip = log.position(last_event_id, offset)
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = Response(sse_body(log, seq, skip, heartbeat=sse_heartbeat), content_type='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    else:
+        response = Response(plain_body(log, seq, skip), content_type='text/plain')
+    response.headers['X-Response-ID'] = log.response_id
+    return response
 
 @app.route('/chat', methods=['POST', 'OPTIONS'])
-@cross_origin()
+@cross_origin(expose_headers=['Retry-After', 'X-Request-ID', 'X-Response-ID'])
 def chat():
     if request.method == 'OPTIONS':
         # Handle preflight request
         response = app.make_default_options_response()
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Session-ID'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Session-ID, X-Request-ID'
         return response
 
     data = request.json
     user_input = data.get('message', '')
     settings = data.get('settings', {})
-    session_id = request.headers.get('X-Session-ID', 'default_session')
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    # Requests without a session get one of their own, so anonymous clients
+    # neither share a history nor wait for each other's turns
+    session_id = request.headers.get('X-Session-ID') or f"anonymous-{request_id}"
+
+    # Admit the turn before routing it: routing reads the session's history,
+    # which must not change under a turn of the same session still running
+    try:
+        ticket = admission.acquire(session_id)
+    except QueueFullError as e:
+        response = jsonify({"error": "The server is busy. Please try again shortly."})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
 
-    config = {"configurable": {"session_id": session_id}}
+    turn_guard = TurnGuard()
+    config = {"configurable": {"session_id": session_id, "turn_guard": turn_guard}}
 
     def generate():
+        parts = []
+        route_label.set('/chat')
+        session_id_var.set(session_id)
+        request_id_var.set(request_id)
+        # Upstream responses opened from here on can be aborted by turn_guard.cancel()
+        turn_guard_var.set(turn_guard)
+
+        def record_cancelled():
+            cancellations.record_cancelled(len(parts))
+            if keep_partial_on_disconnect and parts:
+                get_session_history(session_id).add_messages([
+                    HumanMessage(content=user_input),
+                    AIMessage(content="".join(parts)),
+                ])
+
+        timer = metrics.turn_timer(decision.model)
+        stream = with_message_history.stream(
+            {"messages": [HumanMessage(content=user_input)]},
+            config=config
+        )
+        served = decision.model
         try:
-            for chunk in with_message_history.stream(
-                {
-                    "messages": [HumanMessage(content=user_input)],
-                    **settings
-                },
-                config=config
-            ):
-                yield chunk.content
+            for chunk in stream:
+                timer.chunk(chunk)
+                served = served_model(chunk, served)
+                if chunk.content:
+                    parts.append(chunk.content)
+                yield chunk
+            # A fallback model may have served the turn instead of the routed one
+            router.record_latency(served, timer.ttft, timer.finish())
+            cancellations.record_completed(len(parts))
+        except GeneratorExit:
+            # Closed between chunks after the client disconnected
+            turn_guard.cancel()
+            stream.close()
+            record_cancelled()
+            raise
         except Exception as e:
-            logging.error(f"Error during chat interaction: {str(e)}")
-            yield "I'm sorry, but I encountered an error. Please try again."
+            if turn_guard.cancelled:
+                # The client disconnected and its upstream read was aborted
+                record_cancelled()
+                return
+            upstream_log.error(f"Error during chat interaction: {str(e)}")
+            yield AIMessageChunk(content="I'm sorry, but I encountered an error. Please try again.")
+        finally:
+            # Only now has the turn stopped generating and writing history
+            ticket.release()
+        if compactor is not None:
+            compactor.schedule(session_id)
+
+    try:
+        decision = route_turn(session_id, user_input, settings)
+        with_message_history = profiles.chain_for(settings, decision.model)
+        if streams is not None:
+            # The generation runs on its own thread and outlives this response; it
+            # releases the admission slot when it finishes. Only anonymous clients
+            # resume without a session, so they own the response as ''
+            log = streams.start(uuid.uuid4().hex, request.headers.get('X-Session-ID', ''), generate(),
+                                coalesce_bytes, coalesce_delay)
+        elif 'text/event-stream' in request.headers.get('Accept', ''):
+            # Clients that accept text/event-stream get SSE framing; others get plain text.
+            # Closing the body before the answer is done (client gone) cancels the turn:
+            # its upstream read is aborted and generate() unwinds on the pump thread
+            body = sse_stream(generate(), coalesce_bytes, coalesce_delay, heartbeat=sse_heartbeat,
+                              on_cancel=turn_guard.cancel)
+            response = Response(stream_with_context(body), content_type='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        else:
+            body = plain_stream(generate(), coalesce_bytes, coalesce_delay, on_cancel=turn_guard.cancel)
+            response = Response(stream_with_context(body), content_type='text/plain')
+    except BaseException:
+        # generate() has not started, so nothing else would free the slot
+        ticket.release()
+        raise
+
+    if streams is not None:
+        response = log_response(log)
+        response.headers['X-Request-ID'] = request_id
+        return response
+
+    response.headers['X-Request-ID'] = request_id
+
+    def release_unstarted():
+        # A body closed before it was ever read never ran generate(), so
+        # nothing else will free the slot
+        if inspect.getgeneratorstate(body) == inspect.GEN_CREATED:
+            ticket.release()
+
+    response.call_on_close(release_unstarted)
+    return response
+
+@app.route('/chat/resume/<response_id>', methods=['GET', 'OPTIONS'])
+@cross_origin(expose_headers=['X-Response-ID'])
+def chat_resume(response_id):
+    if request.method == 'OPTIONS':
+        # Handle preflight request
+        response = app.make_default_options_response()
+        response.headers['Access-Control-Allow-Headers'] = 'X-Session-ID, Last-Event-ID'
+        return response
+
+    log = streams.resume(response_id, request.headers.get('X-Session-ID', '')) if streams is not None else None
+    if log is None:
+        return jsonify({"error": "Unknown or expired response."}), 404
+    try:
+        # SSE clients resume from Last-Event-ID, plain-text clients from ?offset=
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', 0))
+        offset = int(request.args['offset']) if 'offset' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID and offset must be integers."}), 400
+    try:
+        return log_response(log, last_event_id, offset)
+    except ResumeError as e:
+        return jsonify({"error": f"Cannot resume: {str(e)}. Please send the message again."}), 410
+
+# /chat/batch runs up to BATCH_MAX_CONCURRENCY items at a time
+batch_max_concurrency = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+batch_max_items = int(os.getenv('BATCH_MAX_ITEMS', '10000'))
+# Seconds between checks that the batch runner is still alive while no line is ready
+batch_result_poll = 1.0
+
+# Items without a session skip the history and go straight to the model
+batch_models = {name: InstrumentedModel(chat_models[name], metrics, name) for name in models}
+
+def run_batch_item(index, item, turn_guard):
+    # One item's turn; returns its result line
+    try:
+        if item["session_id"]:
+            decision = route_turn(item["session_id"], item["message"], item["settings"])
+            config = {"configurable": {"session_id": item["session_id"], "turn_guard": turn_guard}}
+            message = profiles.chain_for(item["settings"], decision.model).invoke(
+                {"messages": [HumanMessage(content=item["message"])]}, config=config
+            )
+        else:
+            decision = router.route(item["message"], item["settings"])
+            prompt_value = profiles.prompt_for(item["settings"]).invoke(
+                {"messages": [HumanMessage(content=item["message"])]}
+            )
+            message = batch_models[decision.model].invoke(prompt_value)
+        return {"index": index, "model": decision.model, "response": message.content}
+    except Exception as e:
+        if turn_guard.cancelled:
+            # The client went away and the item's upstream read was aborted
+            return {"index": index, "error": "cancelled"}
+        upstream_log.error(f"Error in batch item {index}: {str(e)}")
+        return {"index": index, "error": str(e)}
+
+def run_batch_unit(unit):
+    # A unit is one item without a session, or all items of one session run in
+    # order so their turns append to the history in order. Each result is
+    # passed to `emit` as soon as its item finishes. Once the batch's
+    # `turn_guard` is cancelled (client gone), no further item is started.
+    session_id, items, emit, turn_guard = unit["session_id"], unit["items"], unit["emit"], unit["turn_guard"]
+    session_id_var.set(session_id or "")
+    # Upstream responses opened from here on can be aborted by turn_guard.cancel()
+    turn_guard_var.set(turn_guard)
+    if turn_guard.cancelled:
+        return
+    pending = list(items)
+    try:
+        with admission.acquire(session_id or f"batch-{uuid.uuid4().hex}"):
+            while pending and not turn_guard.cancelled:
+                index, item = pending[0]
+                emit(run_batch_item(index, item, turn_guard))
+                pending.pop(0)
+    except Exception as e:
+        # QueueFullError or anything else: every unfinished item still gets its line
+        if not isinstance(e, QueueFullError):
+            logging.error(f"Error in batch unit: {str(e)}")
+        for index, _ in pending:
+            emit({"index": index, "error": str(e)})
+        return
+    if session_id and compactor is not None:
+        compactor.schedule(session_id)
+
+run_batch = RunnableLambda(run_batch_unit)
+
+def parse_batch(data):
+    # Returns (items, max_concurrency); raises ValueError with a message for the client
+    if not isinstance(data, dict):
+        raise ValueError("The body must be a JSON object.")
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("'items' must be a non-empty list.")
+    default_settings = data.get('settings') or {}
+    if not isinstance(default_settings, dict):
+        raise ValueError("'settings' must be an object.")
+    try:
+        max_concurrency = int(data.get('max_concurrency', batch_max_concurrency))
+    except (TypeError, ValueError):
+        raise ValueError("'max_concurrency' must be an integer.")
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {index} must be an object.")
+        message, settings, session_id = item.get('message', ''), item.get('settings'), item.get('session_id')
+        if not isinstance(message, str):
+            raise ValueError(f"Item {index}: 'message' must be a string.")
+        if settings is not None and not isinstance(settings, dict):
+            raise ValueError(f"Item {index}: 'settings' must be an object.")
+        if session_id is not None and not isinstance(session_id, str):
+            raise ValueError(f"Item {index}: 'session_id' must be a string.")
+        parsed.append({"message": message, "settings": settings or default_settings, "session_id": session_id})
+    return parsed, max(1, min(max_concurrency, batch_max_concurrency))
+
+@app.route('/chat/batch', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def chat_batch():
+    if request.method == 'OPTIONS':
+        # Handle preflight request
+        response = app.make_default_options_response()
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('items'), list) and len(data['items']) > batch_max_items:
+        return jsonify({"error": f"At most {batch_max_items} items per batch."}), 413
+    try:
+        items, max_concurrency = parse_batch(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    # Items of one session form one unit; items without a session_id are a unit each.
+    # The whole batch shares one guard, cancelled when the client goes away
+    turn_guard = TurnGuard()
+    results = queue.Queue()
+    units, sessions = [], {}
+    for index, item in enumerate(items):
+        unit = sessions.get(item["session_id"]) if item["session_id"] else None
+        if unit is None:
+            unit = {"session_id": item["session_id"], "items": [], "emit": results.put,
+                    "turn_guard": turn_guard}
+            units.append(unit)
+            if item["session_id"]:
+                sessions[item["session_id"]] = unit
+        unit["items"].append((index, item))
+
+    def run_all():
+        route_label.set('/chat/batch')
+        request_id_var.set(request_id)
+        for position, error in run_batch.batch_as_completed(
+            units, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        ):
+            if isinstance(error, Exception):
+                logging.error(f"Error in batch unit {position}: {str(error)}")
+
+    # Units run on a background thread; each line is written as its item finishes
+    runner = threading.Thread(target=contextvars.copy_context().run, args=(run_all,), daemon=True)
+    runner.start()
+    finished = threading.Event()
+
+    def generate():
+        written = set()
+        while len(written) < len(items):
+            try:
+                result = results.get(timeout=batch_result_poll)
+            except queue.Empty:
+                if runner.is_alive() or not results.empty():
+                    continue
+                # The runner is gone without a line for some items; do not wait forever
+                for index in range(len(items)):
+                    if index not in written:
+                        yield json.dumps({"index": index, "error": "not run"}) + "\n"
+                break
+            written.add(result["index"])
+            yield json.dumps(result) + "\n"
+        finished.set()
+
+    def cancel_unfinished():
+        # The client went away before every line was written: start no more
+        # items and abort the upstream reads of those in flight
+        if not finished.is_set():
+            turn_guard.cancel()
+
+    response = Response(stream_with_context(generate()), content_type='application/x-ndjson',
+                        headers={'X-Request-ID': request_id})
+    response.call_on_close(cancel_unfinished)
+    return response
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    stats = {
+        "sessions": store.stats(),
+        "profiles": profiles.stats(),
+        "admission": admission.stats(),
+        "cancellations": cancellations.stats(),
+        "routing": router.stats(),
+    }
+    if resilience_enabled:
+        stats["resilience"] = resilience_stats.stats(breakers)
+    if compactor is not None:
+        stats["compaction"] = compactor.stats()
+    if memory is not None:
+        stats["memory"] = memory.stats()
+    if streams is not None:
+        stats["streams"] = streams.stats()
+    if response_cache is not None:
+        stats["response_cache"] = response_cache.stats()
+    return jsonify(stats)
 
-    return Response(stream_with_context(generate()), content_type='text/plain')
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 if __name__ == '__main__':
+    # Development server only; see backend_asgi.py for running under an ASGI server
     app.run(debug=True)
@@ -0,0 +1,135 @@
+"""Asyncio (ASGI) serving mode for the /chat endpoint.
+
+Same route, `X-Session-ID` header and `settings` body as backend.py, but the
+chain is driven through `astream`, so an open LLM stream holds a coroutine
+instead of a worker thread and one process can keep thousands of slow
+upstream streams open at once.
+
+Run it under a production ASGI server instead of `app.run(debug=True)`:
+
+    hypercorn backend_asgi:app --bind 0.0.0.0:5000 --workers 4
+    uvicorn backend_asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+Each worker is a separate process with its own in-memory chat history store;
+set HISTORY_BACKEND=sqlite to share histories between them. The models,
+chains, router and `AdmissionController` come from chat_service.py, as they
+do for backend.py, without building the Flask app. History reads that may
+hit SQLite run on a worker thread rather than on the event loop.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from quart import Quart, request, Response, jsonify
+from quart_cors import cors
+from langchain_core.messages import HumanMessage
+
+from admission import QueueFullError
+from chat_service import admission, compactor, metrics, model, profiles, route_turn, router
+from cancellation import TurnGuard
+from log_setup import request_id_var, session_id_var, upstream_log
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, route_label
+from model_factory import awarm_up
+from resilience import served_model
+
+
+# Initialize Quart app
+app = Quart(__name__)
+app = cors(app, allow_origin="*", allow_headers=["Content-Type", "X-Session-ID", "X-Request-ID"],
+           expose_headers=["Retry-After", "X-Request-ID"])
+
+@app.before_serving
+async def warm_connections():
+    # Open async upstream connections before the first request (OPENAI_WARMUP=n)
+    connections = int(os.getenv('OPENAI_WARMUP', '0'))
+    if connections > 0:
+        await awarm_up(model, connections)
+
+async def acquire_ticket(session_id):
+    # Admission blocks, so it waits on a worker thread; if this request is
+    # cancelled meanwhile, a ticket granted afterwards is released at once
+    acquiring = asyncio.ensure_future(asyncio.to_thread(admission.acquire, session_id))
+    try:
+        return await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(
+            lambda done: done.cancelled() or done.exception() or done.result().release())
+        raise
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    data = await request.get_json()
+    user_input = data.get('message', '')
+    settings = data.get('settings', {})
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    # Requests without a session get one of their own, so anonymous clients
+    # neither share a history nor wait for each other's turns
+    session_id = request.headers.get('X-Session-ID') or f"anonymous-{request_id}"
+
+    # Admit the turn before routing it: routing reads the session's history,
+    # which must not change under a turn of the same session still running
+    try:
+        ticket = await acquire_ticket(session_id)
+    except QueueFullError as e:
+        response = jsonify({"error": "The server is busy. Please try again shortly."})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    turn_guard = TurnGuard()
+    config = {"configurable": {"session_id": session_id, "turn_guard": turn_guard}}
+    try:
+        # Routing reads the history, which may be SQLite; keep it off the event loop
+        decision = await asyncio.to_thread(route_turn, session_id, user_input, settings)
+        with_message_history = profiles.chain_for(settings, decision.model)
+    except BaseException:
+        ticket.release()
+        raise
+    started = False
+
+    async def generate():
+        nonlocal started
+        started = True
+        route_label.set('/chat')
+        session_id_var.set(session_id)
+        request_id_var.set(request_id)
+        timer = metrics.turn_timer(decision.model)
+        served = decision.model
+        try:
+            async for chunk in with_message_history.astream(
+                {"messages": [HumanMessage(content=user_input)]},
+                config=config
+            ):
+                timer.chunk(chunk)
+                served = served_model(chunk, served)
+                yield chunk.content
+            # A fallback model may have served the turn instead of the routed one
+            router.record_latency(served, timer.ttft, timer.finish())
+            if compactor is not None:
+                compactor.schedule(session_id)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected; the upstream stream is closed on the way
+            # out and the partial answer is not recorded
+            turn_guard.cancel()
+            raise
+        except Exception as e:
+            upstream_log.error(f"Error during chat interaction: {str(e)}")
+            yield "I'm sorry, but I encountered an error. Please try again."
+        finally:
+            # Only now has the turn stopped generating and writing history
+            ticket.release()
+
+    def release_unstarted(task):
+        # The request task also streams the body; if it ends before the body
+        # started, generate() never ran and nothing else will free the slot
+        if not started:
+            ticket.release()
+
+    asyncio.current_task().add_done_callback(release_unstarted)
+    return Response(generate(), content_type='text/plain', headers={'X-Request-ID': request_id})
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,258 @@
+"""Offline throughput and latency benchmarks against a local fake OpenAI server.
+
+Starts `fake_openai_server.py` in a child process with the given token rate,
+first-token delay and error rate, then drives one or more targets at a fixed
+concurrency:
+
+    backend        POST /chat on backend.py, served by werkzeug in a child process
+    stream         the chain behind stream.py's chat loop
+    stream_custom  the chain behind stream_custom.py's chat loop
+
+Each target runs in its own process so its CPU time and peak RSS can be read
+back from the kernel once it exits. Injected upstream errors that the openai
+client's own retries absorb show up as latency rather than as errors. Results are printed as a table, and
+`--json results.json` writes them in a machine-readable form for comparing
+runs:
+
+    python benchmark.py --target all --concurrency 32 --requests 256 --json run.json
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN_RE = re.compile(r"\s*\S+")
+SETTINGS = {
+    "language": "English",
+    "speaking_level": "intermediate",
+    "tone": "friendly",
+    "specific_words": "None",
+    "additional_instructions": "None",
+}
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def summarize(results, wall_time, usage):
+    """Aggregate per-request results and child-process usage into one report."""
+    ok = [r for r in results if not r["error"]]
+    ttfb = [r["ttfb"] * 1000 for r in ok if r["ttfb"] is not None]
+    latency = [r["total"] * 1000 for r in ok]
+    rates = [r["tokens"] / (r["total"] - r["ttfb"]) for r in ok
+             if r["ttfb"] is not None and r["total"] > r["ttfb"]]
+    report = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_time_s": round(wall_time, 3),
+        "tokens_total": sum(r["tokens"] for r in ok),
+        "tokens_per_s_aggregate": round(sum(r["tokens"] for r in ok) / wall_time, 1) if wall_time else None,
+        "tokens_per_s_per_stream": round(sum(rates) / len(rates), 1) if rates else None,
+    }
+    for name, samples in (("ttfb_ms", ttfb), ("latency_ms", latency)):
+        for q in (50, 95, 99):
+            value = percentile(samples, q / 100)
+            report[f"{name}_p{q}"] = None if value is None else round(value, 1)
+    if usage is not None:
+        cpu = usage.ru_utime + usage.ru_stime
+        report["cpu_s"] = round(cpu, 3)
+        report["cpu_ms_per_stream"] = round(cpu * 1000 / len(results), 2) if results else None
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        rss_kb = usage.ru_maxrss / 1024 if sys.platform == "darwin" else usage.ru_maxrss
+        report["max_rss_mb"] = round(rss_kb / 1024, 1)
+    return report
+
+
+def start_fake_server(args):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "fake_openai_server.py"), "--port", "0",
+         "--tokens-per-second", str(args.tokens_per_second),
+         "--first-token-delay", str(args.first_token_delay),
+         "--error-rate", str(args.error_rate),
+         "--response-words", str(args.response_words)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    line = process.stdout.readline()
+    return process, line.rsplit(" ", 1)[-1].strip()
+
+
+def child_env(base_url):
+    env = dict(os.environ)
+    env.update(
+        OPENAI_BASE_URL=base_url,
+        OPENAI_API_KEY="sk-benchmark",
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")])),
+    )
+    env.setdefault("MAX_IN_FLIGHT", "100000")
+    env.setdefault("MAX_QUEUE", "100000")
+    return env
+
+
+def wait_for_exit(process):
+    """Reap `process` and return its resource usage."""
+    _, _, usage = os.wait4(process.pid, 0)
+    process.returncode = 0
+    return usage
+
+
+def bench_backend(args, base_url, workdir):
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "_serve_backend"],
+        env=child_env(base_url), cwd=workdir, stdout=subprocess.PIPE, text=True,
+    )
+    port = int(server.stdout.readline())
+
+    def one_request(i):
+        result = {"ttfb": None, "total": 0.0, "tokens": 0, "error": None}
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            body = json.dumps({"message": f"Benchmark question {i}", "settings": SETTINGS})
+            conn.request("POST", "/chat", body, {
+                "Content-Type": "application/json",
+                "X-Session-ID": f"bench-{i}",
+            })
+            response = conn.getresponse()
+            if response.status != 200:
+                result["error"] = f"HTTP {response.status}"
+            parts = []
+            while True:
+                data = response.read1(65536)
+                if not data:
+                    break
+                if result["ttfb"] is None:
+                    result["ttfb"] = time.perf_counter() - start
+                parts.append(data)
+            text = b"".join(parts).decode("utf-8", "replace")
+            if text.startswith("I'm sorry"):
+                result["error"] = "upstream error"
+            result["tokens"] = len(TOKEN_RE.findall(text))
+            conn.close()
+        except Exception as e:
+            result["error"] = str(e)
+        result["total"] = time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(one_request, range(args.requests)))
+    wall_time = time.perf_counter() - start
+    server.send_signal(signal.SIGTERM)
+    return summarize(results, wall_time, wait_for_exit(server))
+
+
+def bench_cli(module, args, base_url, workdir):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "_drive_cli", module,
+         str(args.concurrency), str(args.requests)],
+        env=child_env(base_url), cwd=workdir, stdout=subprocess.PIPE, text=True,
+    )
+    output = process.stdout.read()
+    usage = wait_for_exit(process)
+    payload = json.loads(output.strip().splitlines()[-1])
+    return summarize(payload["results"], payload["wall_time"], usage)
+
+
+def _serve_backend():
+    from werkzeug.serving import make_server
+    import backend
+
+    server = make_server("127.0.0.1", 0, backend.app, threaded=True)
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+def _drive_cli(module_name, concurrency, requests):
+    import importlib
+    from langchain_core.messages import HumanMessage
+
+    module = importlib.import_module(module_name)
+
+    def one_request(i):
+        if hasattr(module, "profiles"):
+            chain = module.profiles.chain_for(SETTINGS)
+            payload = {"messages": [HumanMessage(content=f"Benchmark question {i}")]}
+        else:
+            chain = module.with_message_history
+            payload = {"messages": [HumanMessage(content=f"Benchmark question {i}")], "language": "English"}
+        config = {"configurable": {"session_id": f"bench-{i}"}}
+        result = {"ttfb": None, "total": 0.0, "tokens": 0, "error": None}
+        start = time.perf_counter()
+        try:
+            for chunk in chain.stream(payload, config=config):
+                if chunk.content:
+                    if result["ttfb"] is None:
+                        result["ttfb"] = time.perf_counter() - start
+                    result["tokens"] += 1
+        except Exception as e:
+            result["error"] = str(e)
+        result["total"] = time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one_request, range(requests)))
+    print(json.dumps({"results": results, "wall_time": time.perf_counter() - start}))
+
+
+def print_report(name, report):
+    print(f"\n{name}")
+    for key, value in report.items():
+        print(f"  {key:<24} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline chatbot benchmarks")
+    parser.add_argument("--target", choices=["backend", "stream", "stream_custom", "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-words", type=int, default=100)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    targets = ["backend", "stream", "stream_custom"] if args.target == "all" else [args.target]
+    fake_server, base_url = start_fake_server(args)
+    reports = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for target in targets:
+                if target == "backend":
+                    reports[target] = bench_backend(args, base_url, workdir)
+                else:
+                    reports[target] = bench_cli(target, args, base_url, workdir)
+                print_report(target, reports[target])
+    finally:
+        fake_server.terminate()
+        fake_server.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "timestamp": time.time(),
+                "config": vars(args),
+                "results": reports,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_serve_backend":
+        _serve_backend()
+    elif len(sys.argv) > 1 and sys.argv[1] == "_drive_cli":
+        _drive_cli(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,166 @@
+"""Abort upstream generations whose HTTP client has gone away.
+
+When the client of a streamed response disconnects, the WSGI server closes
+the response iterable. The chain is read on a pump thread (see streaming.py)
+that may be blocked waiting for the next upstream token, so closing the body
+calls `TurnGuard.cancel()`: every upstream HTTP response opened while the
+guard was current (registered by `track_upstream_response`, an httpx
+response hook) has its socket shut down, which ends the blocked read at
+once and unwinds the chain on its own thread.
+
+`RunnableWithMessageHistory` treats a closed stream as a finished run and
+would append the partial answer to the history. Each request therefore
+passes a `TurnGuard` in its config; the history handed to the chain is
+wrapped in `GuardedHistory`, which drops the turn's writes once the guard
+is cancelled.
+"""
+import socket
+import threading
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import ConfigurableFieldSpec
+
+from request_context import turn_guard_var
+
+
+class TurnGuard:
+    """Per-request switch that stops the turn from being written to history.
+
+    `cancel()` also aborts the upstream responses registered with `track`,
+    and may be called from any thread.
+    """
+
+    __slots__ = ("cancelled", "_responses", "_lock")
+
+    def __init__(self):
+        self.cancelled = False
+        self._responses = []
+        self._lock = threading.Lock()
+
+    def track(self, response):
+        with self._lock:
+            if not self.cancelled:
+                # A guard may outlive many responses (a batch); keep only open ones
+                self._responses = [r for r in self._responses if not r.is_closed]
+                self._responses.append(response)
+                return
+        abort_response(response)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            responses, self._responses = self._responses, []
+        for response in responses:
+            abort_response(response)
+
+
+def abort_response(response):
+    """Interrupt a read of the streamed httpx `response` that is blocked on another thread.
+
+    Shutting the socket down makes the blocked read fail right away; the
+    reading thread then closes the response and discards the connection.
+    HTTP/2 connections are shared by other requests and are left alone.
+    """
+    if response.is_closed or response.http_version == "HTTP/2":
+        return
+    stream = response.extensions.get("network_stream")
+    sock = stream.get_extra_info("socket") if stream is not None else None
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # already closed
+
+
+def track_upstream_response(response):
+    """httpx response hook registering `response` with the current turn's guard."""
+    guard = turn_guard_var.get()
+    if guard is not None:
+        guard.track(response)
+
+
+class GuardedHistory(BaseChatMessageHistory):
+    """A session history whose writes are dropped once `guard` is cancelled."""
+
+    def __init__(self, history, guard):
+        self.history = history
+        self.guard = guard
+
+    @property
+    def messages(self):
+        return self.history.messages
+
+    def add_messages(self, messages) -> None:
+        if not self.guard.cancelled:
+            self.history.add_messages(messages)
+
+    def clear(self) -> None:
+        self.history.clear()
+
+
+def guarded_history_factory(get_session_history):
+    """Wrap `get_session_history` to accept an optional `turn_guard`."""
+    def get_history(session_id: str, turn_guard=None):
+        history = get_session_history(session_id)
+        return history if turn_guard is None else GuardedHistory(history, turn_guard)
+    return get_history
+
+
+# history_factory_config for RunnableWithMessageHistory with a guarded factory
+GUARDED_HISTORY_CONFIG = [
+    ConfigurableFieldSpec(
+        id="session_id",
+        annotation=str,
+        name="Session ID",
+        description="Unique identifier for a session.",
+        default="",
+        is_shared=True,
+    ),
+    ConfigurableFieldSpec(
+        id="turn_guard",
+        annotation=TurnGuard,
+        name="Turn guard",
+        description="Cancelled when the client disconnects mid-answer.",
+        default=None,
+        is_shared=True,
+    ),
+]
+
+
+class CancellationStats:
+    """Counts cancelled generations and estimates the tokens they saved.
+
+    A streamed chunk is roughly one token, so tokens saved is estimated as the
+    running average length of completed answers minus what had already been
+    streamed when the client left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.completed_tokens = 0
+        self.cancelled = 0
+        self.tokens_streamed_before_cancel = 0
+        self.tokens_saved_estimate = 0
+
+    def record_completed(self, tokens):
+        with self._lock:
+            self.completed += 1
+            self.completed_tokens += tokens
+
+    def record_cancelled(self, tokens_streamed):
+        with self._lock:
+            self.cancelled += 1
+            self.tokens_streamed_before_cancel += tokens_streamed
+            if self.completed:
+                average = self.completed_tokens / self.completed
+                self.tokens_saved_estimate += max(0, round(average - tokens_streamed))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cancelled_generations": self.cancelled,
+                "tokens_streamed_before_cancel": self.tokens_streamed_before_cancel,
+                "tokens_saved_estimate": self.tokens_saved_estimate,
+            }
@@ -0,0 +1,254 @@
+"""Chat setup shared by the Flask (backend.py) and ASGI (backend_asgi.py) frontends.
+
+Importing this module loads the environment, sets up logging and builds
+everything a turn needs that does not depend on the web framework: the
+models and their resilience and caching wrappers, the session history
+backend, the per-profile chains, the router, the admission controller and
+the history compactor. Each frontend adds only its app, its routes and
+the way it streams a turn to the client.
+"""
+import os
+import logging
+from functools import partial
+from dotenv import load_dotenv
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from operator import itemgetter
+from langchain_core.runnables import RunnablePassthrough
+from admission import AdmissionController
+from cancellation import GUARDED_HISTORY_CONFIG, CancellationStats, guarded_history_factory
+from compact_history import CompactChatMessageHistory
+from compaction import HistoryCompactor, summary_budget
+from log_setup import setup_logging
+from metrics import ChatMetrics, InstrumentedModel, TimedStage
+from model_factory import create_model_from_env, warm_up_from_env
+from model_router import ModelRouter
+from prompt_cache import ProfileCache
+from resilience import CircuitBreaker, ResilienceStats, ResilientChatModel
+from response_cache import CachedChatModel, ResponseCache
+from session_store import SessionStore
+from token_counting import TokenCounter, trim_last_messages
+from sqlite_history import SQLiteChatMessageHistory
+
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging (LOG_MODE=queue writes from a background thread; see log_setup.py)
+setup_logging()
+
+# Models the router picks from per request
+fast_model_name = os.getenv('ROUTER_FAST_MODEL', 'gpt-3.5-turbo')
+strong_model_name = os.getenv('ROUTER_STRONG_MODEL', 'gpt-4o')
+
+# RESILIENCE=1 wraps upstream calls in a first-token deadline, hedging, jittered
+# retries, circuit breakers and fallback to the other model (see resilience.py);
+# the openai client's own retries are then turned off
+resilience_enabled = os.getenv('RESILIENCE', '0') == '1'
+
+# Initialize the models (deferred unless STARTUP_MODE=eager)
+try:
+    models = {
+        name: create_model_from_env(name, stream_usage=True,
+                                    **({"max_retries": 0} if resilience_enabled else {}))
+        for name in (fast_model_name, strong_model_name)
+    }
+    model = models[fast_model_name]
+except Exception as e:
+    logging.error(f"Failed to initialize ChatOpenAI model: {str(e)}")
+    print("An error occurred while initializing the chatbot. Please check the log file.")
+    exit(1)
+
+# Open upstream connections before the first request (OPENAI_WARMUP=n)
+warm_up_from_env(model)
+
+resilience_stats = ResilienceStats()
+breakers = {}
+chat_models = dict(models)
+if resilience_enabled:
+    for name in models:
+        breakers[name] = CircuitBreaker(
+            failure_threshold=int(os.getenv('BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('BREAKER_RESET_SECONDS', '30')),
+        )
+    chat_models = {
+        name: ResilientChatModel(
+            models[name],
+            fallback=next((other for other_name, other in models.items() if other_name != name), None),
+            breakers=breakers,
+            stats=resilience_stats,
+            ttft_deadline=float(os.getenv('TTFT_DEADLINE_MS', '3000')) / 1000,
+            hedge=os.getenv('HEDGE_REQUESTS', '1') == '1',
+            max_retries=int(os.getenv('RETRY_MAX', '2')),
+            backoff_base=float(os.getenv('RETRY_BASE_MS', '200')) / 1000,
+            backoff_max=float(os.getenv('RETRY_MAX_BACKOFF_MS', '2000')) / 1000,
+        )
+        for name in models
+    }
+
+# Optionally serve repeated prompts from a response cache (RESPONSE_CACHE=1)
+response_cache = None
+if os.getenv('RESPONSE_CACHE', '0') == '1':
+    response_cache = ResponseCache(
+        max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+        disk_dir=os.getenv('RESPONSE_CACHE_DIR', '.response_cache') or None,
+        disk_max_bytes=int(os.getenv('RESPONSE_CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024))),
+    )
+    chat_models = {
+        name: CachedChatModel(
+            chat_models[name],
+            response_cache,
+            chunk_chars=int(os.getenv('RESPONSE_CACHE_CHUNK_CHARS', '16')),
+            chunk_delay=float(os.getenv('RESPONSE_CACHE_CHUNK_DELAY', '0.01')),
+        )
+        for name in models
+    }
+
+# HISTORY_BACKEND=sqlite shares histories between workers and across restarts;
+# HISTORY_BACKEND=compact keeps only role and content in memory, compressing old turns
+history_backend = os.getenv('HISTORY_BACKEND', 'memory')
+history_db_path = os.getenv('HISTORY_DB_PATH', 'chat_history.db')
+history_tail_limit = int(os.getenv('HISTORY_TAIL_MESSAGES', '20'))
+history_db_pool_size = int(os.getenv('HISTORY_DB_POOL_SIZE', '8'))
+
+# Create a bounded store for chat histories
+store = SessionStore(
+    max_sessions=int(os.getenv('SESSION_MAX_COUNT', '10000')),
+    max_bytes=int(os.getenv('SESSION_MAX_BYTES', str(256 * 1024 * 1024))),
+    ttl=float(os.getenv('SESSION_TTL_SECONDS', '3600')),
+    history_factory=(partial(CompactChatMessageHistory, tail_limit=history_tail_limit)
+                     if history_backend == 'compact' else InMemoryChatMessageHistory),
+)
+
+def get_session_history(session_id: str):
+    if history_backend == 'sqlite':
+        return SQLiteChatMessageHistory(session_id, history_db_path, history_tail_limit,
+                                        pool_size=history_db_pool_size)
+    return store.get(session_id)
+
+# The customizable system prompt, filled in from the request's `settings`
+system_template = (
+    "You are a helpful assistant. Answer all questions to the best of your ability "
+    "in {language}. Speak at a {speaking_level} level with a {tone} tone. "
+    "Try to incorporate these words or phrases if relevant: {specific_words}. "
+    "Additional instructions: {additional_instructions}"
+)
+
+# HISTORY_COMPACTION=1 folds turns that fall out of the trimmed window into a
+# running summary at the head of the session history (see compaction.py)
+compaction_enabled = os.getenv('HISTORY_COMPACTION', '0') == '1'
+summary_max_tokens = int(os.getenv('SUMMARY_MAX_TOKENS', '120'))
+token_counters = {name: TokenCounter(name) for name in models}
+
+# LONG_TERM_MEMORY=1 recalls the older turns most relevant to each new message
+# from a per-session vector index (see vector_memory.py, which needs NumPy)
+memory = None
+if os.getenv('LONG_TERM_MEMORY', '0') == '1':
+    from vector_memory import VectorMemory
+    memory = VectorMemory(
+        token_counters[fast_model_name],
+        k=int(os.getenv('RECALL_TOP_K', '4')),
+        min_score=float(os.getenv('RECALL_MIN_SCORE', '0.2')),
+        max_tokens=int(os.getenv('RECALL_MAX_TOKENS', '120')),
+        keep_tokens=65,
+        max_sessions=int(os.getenv('SESSION_MAX_COUNT', '10000')),
+    )
+    # An evicted session's recalled turns go with its history
+    store.on_evict = memory.drop
+
+def history_budget(name):
+    # The summary and recalled turns get their own budgets on top of the recent turns
+    budget = 65
+    if compaction_enabled:
+        budget += summary_budget(summary_max_tokens, token_counters[name])
+    if memory is not None:
+        budget += memory.budget
+    return budget
+
+# Create a message trimmer per model; token counts are cached per message
+trimmers = {
+    name: trim_last_messages(
+        max_tokens=history_budget(name),
+        token_counter=token_counters[name],
+        include_system=True,
+        start_on=HumanMessage,
+    )
+    for name in models
+}
+
+# Per-stage latency histograms, served at /metrics
+metrics = ChatMetrics()
+
+def build_chain(profile_prompt, model_name=fast_model_name):
+    # Create the chain around a pre-rendered prompt and set it up with message history
+    history = itemgetter("messages")
+    get_history = get_session_history
+    if memory is not None:
+        history = history | TimedStage(memory.recall_stage, metrics, "recall", model_name)
+        get_history = memory.history_factory(get_session_history)
+    chain = (
+        RunnablePassthrough.assign(messages=history | TimedStage(
+            trimmers[model_name], metrics, "trim", model_name, observe=metrics.observe_trim(model_name)))
+        | TimedStage(profile_prompt, metrics, "prompt", model_name)
+        | InstrumentedModel(chat_models[model_name], metrics, model_name)
+    )
+    return RunnableWithMessageHistory(
+        chain,
+        guarded_history_factory(metrics.timed_history_factory(get_history, model_name)),
+        input_messages_key="messages",
+        history_factory_config=GUARDED_HISTORY_CONFIG,
+    )
+
+# Serialize turns per session and cap concurrent upstream generations
+admission = AdmissionController(
+    max_in_flight=int(os.getenv('MAX_IN_FLIGHT', '32')),
+    max_queue=int(os.getenv('MAX_QUEUE', '256')),
+    queue_timeout=float(os.getenv('QUEUE_TIMEOUT_SECONDS', '30')),
+)
+# A session whose turn is in flight is never evicted from under it
+store.in_use = admission.is_active
+
+# Generations are aborted when the client disconnects; KEEP_PARTIAL_ON_DISCONNECT=1
+# still records the partial answer in the session history
+keep_partial_on_disconnect = os.getenv('KEEP_PARTIAL_ON_DISCONNECT', '0') == '1'
+cancellations = CancellationStats()
+
+# Summaries are written by the fast model after a turn has streamed, never before it;
+# the write-back takes the session's admission slot so it cannot race a turn
+compactor = None
+if compaction_enabled:
+    compactor = HistoryCompactor(
+        get_session_history,
+        models[fast_model_name],
+        token_counters[fast_model_name],
+        keep_tokens=65,
+        summary_tokens=summary_max_tokens,
+        lock=admission.acquire,
+        max_workers=int(os.getenv('COMPACTION_WORKERS', '2')),
+    )
+
+# Route trivial turns to the fast model and demanding ones to the strong model
+# (MODEL_ROUTING=1); settings["model"] picks a model explicitly either way
+router = ModelRouter(
+    fast_model_name,
+    strong_model_name,
+    enabled=os.getenv('MODEL_ROUTING', '0') == '1',
+    budgets={
+        fast_model_name: float(os.getenv('ROUTER_FAST_BUDGET_MS', '1500')) / 1000,
+        strong_model_name: float(os.getenv('ROUTER_STRONG_BUDGET_MS', '3000')) / 1000,
+    },
+    sample_ttl=float(os.getenv('ROUTER_SAMPLE_TTL_SECONDS', '300')),
+    probe_every=int(os.getenv('ROUTER_PROBE_EVERY', '20')),
+)
+
+def route_turn(session_id, message, settings):
+    history_depth = len(get_session_history(session_id).messages)
+    return router.route(message, settings, history_depth)
+
+# Cache the rendered prompt and chain for each settings profile and model
+profiles = ProfileCache(
+    system_template,
+    build_chain,
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '256')),
+)
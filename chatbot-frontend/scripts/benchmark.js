@@ -0,0 +1,190 @@
+// Headless frame-time benchmark for the chat view.
+//
+// Serves the built app from public/, stands in for the backend's /chat on
+// port 5000 with synthetic plain-text streams, and drives the app in
+// headless Chrome: it first plays `--turns` short exchanges to build up a
+// long conversation, then streams a `--tokens` token answer while recording
+// every animation frame. Puppeteer is not a dependency of the app; install
+// it just for the run:
+//
+//   npm install --no-save puppeteer
+//   npm run build
+//   node scripts/benchmark.js [--tokens 10000] [--turns 200] [--tokens-per-second 2000]
+
+import fs from 'fs';
+import http from 'http';
+import path from 'path';
+import { fileURLToPath } from 'url';
+
+const publicDir = path.join(path.dirname(fileURLToPath(import.meta.url)), '..', 'public');
+const apiPort = 5000;  // the port App.svelte posts to
+
+const WORDS = ('the quick brown fox jumps over the lazy dog while a streaming answer keeps ' +
+  'arriving one token at a time and the chat view has to keep up').split(' ');
+
+const TYPES = {
+  '.html': 'text/html',
+  '.js': 'text/javascript',
+  '.css': 'text/css',
+  '.png': 'image/png',
+  '.map': 'application/json'
+};
+
+const CORS = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'Content-Type, X-Session-ID',
+  'Access-Control-Allow-Methods': 'POST, OPTIONS'
+};
+
+function option(name, fallback) {
+  const index = process.argv.indexOf(`--${name}`);
+  return index === -1 ? fallback : Number(process.argv[index + 1]);
+}
+
+function listen(server, port) {
+  return new Promise(resolve => server.listen(port, '127.0.0.1', () => resolve(server.address().port)));
+}
+
+function staticServer() {
+  return http.createServer((req, res) => {
+    const name = decodeURIComponent(new URL(req.url, 'http://localhost').pathname);
+    const file = path.join(publicDir, name === '/' ? 'index.html' : name);
+    if (!file.startsWith(publicDir) || !fs.existsSync(file)) {
+      res.writeHead(404).end();
+      return;
+    }
+    res.writeHead(200, { 'Content-Type': TYPES[path.extname(file)] || 'application/octet-stream' });
+    fs.createReadStream(file).pipe(res);
+  });
+}
+
+// Writes `tokens` words at `rate` tokens per second; resolves when the answer is complete
+function streamAnswer(res, tokens, rate) {
+  return new Promise(resolve => {
+    const started = performance.now();
+    let sent = 0;
+    const timer = setInterval(() => {
+      const due = Math.min(tokens, Math.floor((performance.now() - started) * rate / 1000) + 1);
+      let text = '';
+      for (; sent < due; sent++) text += WORDS[sent % WORDS.length] + ' ';
+      if (text) res.write(text);
+      if (sent >= tokens) {
+        clearInterval(timer);
+        res.end();
+        resolve();
+      }
+    }, 1);
+  });
+}
+
+// The /chat stand-in: messages starting with "bench" get the long answer
+function apiServer(tokens, rate, onAnswer) {
+  return http.createServer((req, res) => {
+    if (req.method === 'OPTIONS') {
+      res.writeHead(204, CORS).end();
+      return;
+    }
+    let body = '';
+    req.on('data', chunk => { body += chunk; });
+    req.on('end', () => {
+      const { message } = JSON.parse(body);
+      res.writeHead(200, { ...CORS, 'Content-Type': 'text/plain; charset=utf-8' });
+      const long = message.startsWith('bench');
+      onAnswer(streamAnswer(res, long ? tokens : 40, long ? rate : 1e9));
+    });
+  });
+}
+
+function percentile(sorted, q) {
+  return sorted[Math.min(sorted.length - 1, Math.floor(q * sorted.length))];
+}
+
+async function main() {
+  const tokens = option('tokens', 10000);
+  const turns = option('turns', 200);
+  const rate = option('tokens-per-second', 2000);
+
+  if (!fs.existsSync(path.join(publicDir, 'build', 'bundle.js'))) {
+    console.error('public/build/bundle.js not found; run `npm run build` first.');
+    process.exit(1);
+  }
+  let puppeteer;
+  try {
+    puppeteer = (await import('puppeteer')).default;
+  } catch (error) {
+    console.error('puppeteer is not installed; run `npm install --no-save puppeteer` first.');
+    process.exit(1);
+  }
+
+  let answer = null;
+  const site = staticServer();
+  const api = apiServer(tokens, rate, promise => { answer = promise; });
+  const sitePort = await listen(site, 0);
+  await listen(api, apiPort);
+
+  const browser = await puppeteer.launch({ headless: true });
+  const page = await browser.newPage();
+  await page.setViewport({ width: 1000, height: 800 });
+  await page.goto(`http://127.0.0.1:${sitePort}/`);
+  await page.waitForSelector('.input-area input');
+
+  async function send(text) {
+    answer = null;
+    await page.$eval('.input-area input', (input, text) => {
+      input.value = text;
+      input.dispatchEvent(new Event('input'));
+    }, text);
+    await page.focus('.input-area input');
+    await page.keyboard.press('Enter');
+    while (answer === null) await new Promise(resolve => setTimeout(resolve, 1));
+    await answer;
+  }
+
+  const settle = () => page.evaluate(() => new Promise(resolve => setTimeout(resolve, 300)));
+
+  for (let i = 0; i < turns; i++) await send(`question ${i}`);
+  await settle();
+
+  // Record the gap between consecutive animation frames, and long tasks
+  await page.evaluate(() => {
+    window.__bench = { frames: [], longTasks: 0, recording: true };
+    new PerformanceObserver(list => { window.__bench.longTasks += list.getEntries().length; })
+      .observe({ entryTypes: ['longtask'] });
+    let last = performance.now();
+    requestAnimationFrame(function tick(now) {
+      window.__bench.frames.push(now - last);
+      last = now;
+      if (window.__bench.recording) requestAnimationFrame(tick);
+    });
+  });
+  const started = performance.now();
+  await send('bench: a very long answer please');
+  const streamed = performance.now() - started;
+  await settle();
+
+  const result = await page.evaluate(() => {
+    window.__bench.recording = false;
+    const messages = document.querySelectorAll('.message');
+    return {
+      frames: window.__bench.frames,
+      longTasks: window.__bench.longTasks,
+      renderedRows: messages.length,
+      lastLength: messages[messages.length - 1].querySelector('p').textContent.length
+    };
+  });
+  await browser.close();
+  site.close();
+  api.close();
+
+  const frames = result.frames.slice(1).sort((a, b) => a - b);
+  const over = budget => frames.filter(frame => frame > budget).length;
+  console.log(`${turns * 2} earlier messages, then a ${tokens}-token answer at ${rate} tokens/s ` +
+    `(streamed in ${(streamed / 1000).toFixed(1)}s)`);
+  console.log(`frames: ${frames.length}  p50=${percentile(frames, 0.5).toFixed(1)}ms ` +
+    `p95=${percentile(frames, 0.95).toFixed(1)}ms p99=${percentile(frames, 0.99).toFixed(1)}ms ` +
+    `max=${frames[frames.length - 1].toFixed(1)}ms  over 16.7ms: ${over(16.7)}  over 50ms: ${over(50)}`);
+  console.log(`long tasks: ${result.longTasks}  rendered rows: ${result.renderedRows} of ${turns * 2 + 2}  ` +
+    `final answer: ${result.lastLength} characters`);
+}
+
+main();
@@ -0,0 +1,21 @@
+// Coalesces calls into at most one `callback` per animation frame, so a
+// stream of tokens costs one view update per frame instead of one per token
+export function perFrame(callback) {
+  let frame = null;
+
+  function run() {
+    frame = null;
+    callback();
+  }
+
+  return {
+    schedule() {
+      if (frame === null) frame = requestAnimationFrame(run);
+    },
+    // Run now, e.g. when the stream ends, instead of waiting for the frame
+    flush() {
+      if (frame !== null) cancelAnimationFrame(frame);
+      run();
+    }
+  };
+}
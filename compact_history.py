@@ -0,0 +1,218 @@
+"""A memory-compact stand-in for `InMemoryChatMessageHistory`.
+
+`InMemoryChatMessageHistory` keeps every message object of a session, with
+its id, response metadata and usage dicts, although only the last few are
+ever sent to the model. `CompactChatMessageHistory` stores the role and
+content of each message and nothing else:
+
+- recent messages are slot-based `_Record`s holding an interned role string
+  and the content string;
+- once more than `hot_messages` messages sit behind the tail, the oldest
+  `block_size` of them are packed into a `_Block`: one zlib-compressed buffer
+  of their UTF-8 contents, plus their byte lengths and a one-character role
+  code per message;
+- a leading system message (the running summary written by
+  `HistoryCompactor`) is kept apart and never compressed.
+
+Like `SQLiteChatMessageHistory`, `messages` builds message objects only for
+the last `tail_limit` messages, which is all the trimmer ever keeps, plus the
+leading system message; pass `tail_limit=None` (or read `all_messages`) to
+rebuild everything.
+
+Run this module directly to compare memory per session with
+`InMemoryChatMessageHistory`:
+
+    python compact_history.py
+"""
+import json
+import sys
+import zlib
+from array import array
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+ROLE_CODES = {"human": "h", "ai": "a", "system": "s"}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+# Streamed replies arrive as AIMessageChunk; they are stored as plain AI messages
+_ROLE_ALIASES = {"AIMessageChunk": "ai", "HumanMessageChunk": "human", "SystemMessageChunk": "system"}
+
+# Bytes per record beyond its content: the object, its two slots and the list entry
+RECORD_OVERHEAD_BYTES = 64
+
+
+class _Record:
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+    @property
+    def nbytes(self):
+        return RECORD_OVERHEAD_BYTES + (sys.getsizeof(self.content) if isinstance(self.content, str)
+                                        else len(json.dumps(self.content)))
+
+    def to_message(self):
+        return MESSAGE_TYPES[self.role](content=self.content)
+
+
+class _Block:
+    """`count` consecutive messages, their contents compressed together."""
+
+    __slots__ = ("roles", "lengths", "data")
+
+    def __init__(self, records):
+        # Upper-case role codes mark contents stored as JSON (content blocks)
+        roles, texts = [], []
+        for record in records:
+            code = ROLE_CODES[record.role]
+            if isinstance(record.content, str):
+                texts.append(record.content.encode("utf-8"))
+            else:
+                code = code.upper()
+                texts.append(json.dumps(record.content).encode("utf-8"))
+            roles.append(code)
+        self.roles = "".join(roles)
+        self.lengths = array("I", (len(text) for text in texts))
+        self.data = zlib.compress(b"".join(texts))
+
+    def __len__(self):
+        return len(self.roles)
+
+    @property
+    def nbytes(self):
+        return (sys.getsizeof(self.roles) + sys.getsizeof(self.lengths) + sys.getsizeof(self.data)
+                + RECORD_OVERHEAD_BYTES)
+
+    def records(self):
+        data = zlib.decompress(self.data)
+        offset = 0
+        for code, length in zip(self.roles, self.lengths):
+            text = data[offset:offset + length].decode("utf-8")
+            offset += length
+            if code.isupper():
+                yield _Record(ROLES[code.lower()], json.loads(text))
+            else:
+                yield _Record(ROLES[code], text)
+
+
+def _role(message):
+    role = _ROLE_ALIASES.get(message.type, message.type)
+    if role not in ROLE_CODES:
+        raise ValueError(f"Unsupported message type for compact history: {message.type}")
+    return sys.intern(role)
+
+
+class CompactChatMessageHistory(BaseChatMessageHistory):
+    """Role-and-content chat history with compressed old turns and lazily built messages.
+
+    Message ids and metadata are not kept. Messages older than the newest
+    `hot_messages` are compressed in blocks of `block_size`.
+    """
+
+    def __init__(self, tail_limit=20, hot_messages=None, block_size=32):
+        self.tail_limit = tail_limit
+        self.hot_messages = max(hot_messages or 0, tail_limit or 0, block_size)
+        self.block_size = block_size
+        self._head = None  # leading system message
+        self._blocks = []
+        self._hot = []
+        self._count = 0
+        self._cold_bytes = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Approximate heap bytes held by this history's contents."""
+        head = self._head.nbytes if self._head is not None else 0
+        return head + self._cold_bytes + sum(record.nbytes for record in self._hot)
+
+    @property
+    def messages(self):
+        if self.tail_limit is None:
+            return self.all_messages
+        records = self._hot[-self.tail_limit:] if self.tail_limit else []
+        head = [self._head.to_message()] if self._head is not None else []
+        return head + [record.to_message() for record in records]
+
+    @property
+    def all_messages(self):
+        """Every message of the session, compressed blocks included, regardless of `tail_limit`."""
+        records = [record for block in self._blocks for record in block.records()] + self._hot
+        head = [self._head.to_message()] if self._head is not None else []
+        return head + [record.to_message() for record in records]
+
+    def add_messages(self, messages) -> None:
+        for message in messages:
+            record = _Record(_role(message), message.content)
+            if self._count == 0 and record.role == "system":
+                self._head = record
+            else:
+                self._hot.append(record)
+            self._count += 1
+        while len(self._hot) >= self.hot_messages + self.block_size:
+            block = _Block(self._hot[:self.block_size])
+            del self._hot[:self.block_size]
+            self._blocks.append(block)
+            self._cold_bytes += block.nbytes
+
+    def clear(self) -> None:
+        self._head = None
+        self._blocks = []
+        self._hot = []
+        self._count = 0
+        self._cold_bytes = 0
+
+
+def _turn(i):
+    from langchain_core.messages import AIMessageChunk
+
+    human = HumanMessage(content=f"Question {i}: could you suggest something to cook tonight with what I have?")
+    answer = (f"Answer {i}: how about a simple pasta with garlic, olive oil and chili flakes? "
+              "It takes about fifteen minutes and only needs a pot and a pan.")
+    # What RunnableWithMessageHistory stores after a streamed OpenAI reply
+    return [human, AIMessageChunk(
+        content=answer,
+        id=f"run-{i:08x}-0000-0000-0000-000000000000",
+        response_metadata={"finish_reason": "stop", "model_name": "gpt-3.5-turbo-0125",
+                           "system_fingerprint": None},
+        usage_metadata={"input_tokens": 61, "output_tokens": 38, "total_tokens": 99},
+    )]
+
+
+def _benchmark():
+    import time
+    import tracemalloc
+
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+
+    print(f"{'turns':>6} {'InMemoryChatMessageHistory':>27} {'compact':>10} {'ratio':>6} "
+          f"{'messages (in-memory)':>21} {'messages (compact)':>19}")
+    for turns in (10, 100, 1000, 5000):
+        results = []
+        for factory in (InMemoryChatMessageHistory, CompactChatMessageHistory):
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            history = factory()
+            for i in range(turns):
+                # Each turn arrives as fresh objects deserialized from the run
+                history.add_messages(_turn(i))
+            size = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for _ in range(100):
+                history.messages
+            read = (time.perf_counter() - start) / 100
+            results.append((size, read))
+        (full, full_read), (compact, compact_read) = results
+        print(f"{turns:6d} {full / 1024:25.1f}KiB {compact / 1024:8.1f}KiB {full / compact:5.1f}x "
+              f"{full_read * 1e6:19.1f}us {compact_read * 1e6:17.1f}us")
+
+
+if __name__ == "__main__":
+    _benchmark()
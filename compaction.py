@@ -0,0 +1,271 @@
+"""Background compaction of chat histories into a running summary.
+
+The trimmer only sends the newest few turns to the model, so anything older
+is forgotten. `HistoryCompactor` folds the turns that have fallen out of that
+window into a summary kept as a `SystemMessage` at the head of the session
+history, where `trim_last(include_system=True)` always keeps it:
+
+    [summary, human, ai, human, ai]  ->  [summary', human, ai]
+
+Compaction is scheduled after a turn has finished streaming and runs on a
+small thread pool, so the summarization call never sits in front of the
+next turn's first token. The summary is computed from a snapshot of the
+history and only written back, in one short critical section, if the history
+still starts with that snapshot; turns appended in the meantime are kept.
+The summary is capped at `summary_tokens`, so the prompt stays bounded no
+matter how long the conversation runs. Compaction reads the whole history
+(`all_messages` on backends whose `messages` only return a tail), so turns
+outside that tail are folded into the summary rather than dropped, a
+`fold_messages` chunk per summarization call.
+
+Run this module directly to compare prompt sizes with and without compaction:
+
+    python compaction.py
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from admission import QueueFullError
+from token_counting import trim_last
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the new messages into the existing summary. Keep names, preferences, facts and "
+    "open questions the user may refer back to; drop greetings and small talk. "
+    "Reply with the summary only, in at most {words} words."
+)
+
+# Streamed replies are stored as AIMessageChunk
+SPEAKERS = {"human": "User", "ai": "Assistant", "AIMessageChunk": "Assistant"}
+
+
+def is_summary(message) -> bool:
+    return isinstance(message, SystemMessage) and isinstance(message.content, str) \
+        and message.content.startswith(SUMMARY_PREFIX)
+
+
+def split_summary(messages):
+    """Return (summary message or None, the remaining messages)."""
+    if messages and is_summary(messages[0]):
+        return messages[0], list(messages[1:])
+    return None, list(messages)
+
+
+def all_messages(history):
+    """The whole history; SQLite and compact histories return only a tail from `messages`."""
+    messages = getattr(history, "all_messages", None)
+    return messages if messages is not None else history.messages
+
+
+def summary_budget(summary_tokens, token_counter) -> int:
+    """Tokens the summary message can take in the prompt, framing included."""
+    return summary_tokens + token_counter.count_message(SystemMessage(content=SUMMARY_PREFIX))
+
+
+class HistoryCompactor:
+    """Folds messages evicted from the trimmed window into a running summary.
+
+    `summarizer` is a chat model; `keep_tokens` must match the history budget
+    the chain's trimmer leaves for recent messages. `lock(session_id)`, if
+    given, returns a context manager held while the summary is written back
+    (e.g. `AdmissionController.acquire`, which serializes it with the
+    session's turns). If it raises `QueueFullError` the pass is dropped and
+    the session is scheduled again after the error's `retry_after`.
+    """
+
+    def __init__(self, get_session_history, summarizer, token_counter, keep_tokens=65,
+                 summary_tokens=120, min_messages=2, lock=None, max_workers=2, fold_messages=40):
+        self.get_session_history = get_session_history
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+        self.keep_tokens = keep_tokens
+        self.summary_tokens = summary_tokens
+        self.min_messages = min_messages
+        self.lock = lock
+        self.fold_messages = fold_messages
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compaction")
+        self._pending = set()  # queued or running
+        self._dirty = set()  # scheduled again while running
+        self._mutex = threading.Lock()
+        self._durations = deque(maxlen=256)
+        self._stats = {"scheduled": 0, "compactions": 0, "messages_folded": 0, "conflicts": 0, "deferred": 0,
+                       "errors": 0}
+
+    def schedule(self, session_id: str) -> bool:
+        """Compact `session_id` in the background; passes for one session never overlap."""
+        with self._mutex:
+            if self._closed:
+                return False
+            if session_id in self._pending:
+                self._dirty.add(session_id)
+                return False
+            self._pending.add(session_id)
+            self._stats["scheduled"] += 1
+        self._executor.submit(self._run, session_id)
+        return True
+
+    def _run(self, session_id):
+        while True:
+            try:
+                self.compact(session_id)
+            except Exception as e:
+                logging.error(f"History compaction failed for session {session_id}: {str(e)}")
+                with self._mutex:
+                    self._stats["errors"] += 1
+            with self._mutex:
+                # Run another pass if a turn finished while this one ran
+                if session_id not in self._dirty:
+                    self._pending.discard(session_id)
+                    return
+                self._dirty.discard(session_id)
+
+    def split(self, messages):
+        """Return (summary, messages to fold into it, messages to keep)."""
+        summary, body = split_summary(messages)
+        kept = trim_last(body, self.keep_tokens, self.token_counter, include_system=False)
+        return summary, body[:len(body) - len(kept)], kept
+
+    def compact(self, session_id: str) -> bool:
+        """Fold the evicted messages of `session_id` into its summary now."""
+        history = self.get_session_history(session_id)
+        messages = all_messages(history)
+        summary, evicted, kept = self.split(messages)
+        if len(evicted) < self.min_messages:
+            return False
+
+        start = time.perf_counter()
+        # A long backlog (e.g. compaction just enabled) is folded in several calls
+        for i in range(0, len(evicted), self.fold_messages):
+            chunk = evicted[i:i + self.fold_messages]
+            summary = SystemMessage(content=SUMMARY_PREFIX + self.summarize(summary, chunk))
+        try:
+            guard = self.lock(session_id) if self.lock is not None else nullcontext()
+        except QueueFullError as e:
+            # The session is busy; try again once it has had time to drain
+            with self._mutex:
+                self._stats["deferred"] += 1
+            timer = threading.Timer(e.retry_after, self.schedule, args=(session_id,))
+            timer.daemon = True
+            timer.start()
+            return False
+        with guard:
+            current = all_messages(history)
+            if current[:len(messages)] != messages:
+                # Rewritten by someone else since the snapshot; the next turn retries
+                with self._mutex:
+                    self._stats["conflicts"] += 1
+                return False
+            self._replace(history, [summary] + current[len(messages) - len(kept):])
+        with self._mutex:
+            self._stats["compactions"] += 1
+            self._stats["messages_folded"] += len(evicted)
+            self._durations.append(time.perf_counter() - start)
+        return True
+
+    def summarize(self, summary, messages) -> str:
+        previous = summary.content[len(SUMMARY_PREFIX):] if summary is not None else "(none)"
+        transcript = "\n".join(f"{SPEAKERS.get(m.type, m.type)}: {m.content}" for m in messages)
+        response = self.summarizer.invoke(
+            [
+                SystemMessage(content=SUMMARY_INSTRUCTIONS.format(words=self.summary_tokens * 3 // 4)),
+                HumanMessage(content=f"Existing summary:\n{previous}\n\nNew messages:\n{transcript}"),
+            ],
+            max_tokens=self.summary_tokens,
+        )
+        return self._truncate(response.content.strip())
+
+    def _truncate(self, text):
+        # The cap holds even for models that ignore max_tokens
+        words = text.split()
+        while words and self.token_counter.count_text(" ".join(words)) > self.summary_tokens:
+            words = words[:len(words) * 9 // 10]
+        return " ".join(words)
+
+    @staticmethod
+    def _replace(history, messages):
+        replace = getattr(history, "replace_messages", None)
+        if replace is not None:
+            replace(messages)
+        else:
+            history.clear()
+            history.add_messages(messages)
+
+    def stats(self):
+        with self._mutex:
+            durations = sorted(self._durations)
+            pick = lambda q: round(durations[min(len(durations) - 1, int(q * len(durations)))] * 1000, 1) if durations else None
+            return {
+                **self._stats,
+                "pending": len(self._pending),
+                "compaction_ms_p50": pick(0.50),
+                "compaction_ms_p95": pick(0.95),
+            }
+
+    def close(self):
+        with self._mutex:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+
+
+def _benchmark(turns=40, summary_delay=0.4):
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    from token_counting import TokenCounter
+
+    counter = TokenCounter()
+    keep_tokens = 65
+
+    def summarize(messages, **kwargs):
+        # Stands in for the model: keeps the user's sentences, after a delay
+        time.sleep(summary_delay)
+        text = messages[-1].content
+        previous = text.split("\n")[1]
+        said = [line[len("User: "):] for line in text.split("\n") if line.startswith("User: ")]
+        return AIMessage(content=" ".join(([] if previous == "(none)" else [previous]) + said))
+
+    histories = {"trim only": InMemoryChatMessageHistory(), "compaction": InMemoryChatMessageHistory()}
+    compactor = HistoryCompactor(histories.get, RunnableLambda(summarize), counter, keep_tokens=keep_tokens)
+    budget = keep_tokens + summary_budget(compactor.summary_tokens, counter)
+
+    print(f"{'turn':>5} {'full history':>13} {'trim only':>10} {'compaction':>11}  (prompt history tokens)")
+    schedule_times = []
+    for turn in range(turns):
+        question = "My name is Alice and I live in Lyon." if turn == 0 else f"Tell me fact number {turn} about cooking."
+        sizes = []
+        for name, history in histories.items():
+            messages = history.messages + [HumanMessage(content=question)]
+            window = trim_last(messages, budget if name == "compaction" else keep_tokens, counter)
+            sizes.append(counter(window))
+            history.add_messages([HumanMessage(content=question), AIMessage(content=f"Here is answer {turn}.")])
+        full = counter(histories["trim only"].messages)
+        start = time.perf_counter()
+        compactor.schedule("compaction")
+        schedule_times.append(time.perf_counter() - start)
+        if turn % 5 == 0 or turn == turns - 1:
+            print(f"{turn:5d} {full:13d} {sizes[0]:10d} {sizes[1]:11d}")
+        # The next message arrives while the previous compaction runs
+        time.sleep(summary_delay / 2)
+    compactor.close()
+
+    summary, _ = split_summary(histories["compaction"].messages)
+    remembered = summary is not None and "Alice" in summary.content
+    schedule_times.sort()
+    print(f"\nschedule() on the request path: {schedule_times[len(schedule_times) // 2] * 1e6:.0f}us p50; "
+          f"compaction off the path: {compactor.stats()['compaction_ms_p50']}ms p50")
+    print(f"first-turn fact kept in the summary: {remembered}")
+    print(compactor.stats())
+
+
+if __name__ == "__main__":
+    _benchmark()
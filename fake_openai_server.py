@@ -0,0 +1,222 @@
+"""Local OpenAI-compatible stub server for tests and benchmarks.
+
+Serves `POST /v1/chat/completions` (streaming and non-streaming) and
+`GET /v1/models` with a canned answer, so the chatbot can be exercised
+without the real API. Point the model at it with
+`OPENAI_BASE_URL=http://127.0.0.1:8001/v1` (any API key works).
+
+    python fake_openai_server.py --port 8001 --tokens-per-second 50
+
+`error_rate` is the fraction of completions answered with an HTTP 500
+instead of a response, and completions for a model in `fail_models` always
+fail that way. `stall_rate` is the fraction of streamed completions whose
+first token is held back an extra `stall_seconds`. `connect_delay` is slept once per new connection to stand in for the TCP and
+TLS setup a real provider costs, which is what connection warm-up saves.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = (
+    "Sure! Here is a short answer to your question. The quick brown fox jumps "
+    "over the lazy dog, and then it takes a well deserved nap in the sun."
+)
+
+
+def make_response_text(words):
+    """A canned answer exactly `words` tokens long."""
+    vocabulary = DEFAULT_RESPONSE.split()
+    return " ".join(vocabulary[i % len(vocabulary)] for i in range(words))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stats["connections"] += 1
+        if self.server.connect_delay:
+            time.sleep(self.server.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": "gpt-3.5-turbo", "object": "model", "owned_by": "fake"},
+                {"id": "gpt-4o", "object": "model", "owned_by": "fake"},
+            ]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        self.server.stats["requests"] += 1
+        if (body.get("model") in self.server.fail_models
+                or (self.server.error_rate and random.random() < self.server.error_rate)):
+            self.server.stats["errors"] += 1
+            self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+        if body.get("stream"):
+            self._stream_completion(body)
+        else:
+            self._send_json(200, self._completion(body))
+
+    def _tokens(self):
+        return re.findall(r"\s*\S+", self.server.response_text)
+
+    def _usage(self, body, completion_tokens):
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) + 3 for m in body.get("messages", []))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, body):
+        time.sleep(self.server.first_token_delay)
+        tokens = self._tokens()
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(body, len(tokens)),
+        }
+
+    def _stream_completion(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta=None, finish_reason=None, usage=None):
+            payload = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [] if usage else [
+                    {"index": 0, "delta": delta or {}, "finish_reason": finish_reason}
+                ],
+            }
+            if usage:
+                payload["usage"] = usage
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n")
+
+        tokens = self._tokens()
+        interval = 1.0 / self.server.tokens_per_second if self.server.tokens_per_second else 0
+        try:
+            time.sleep(self.server.first_token_delay)
+            if self.server.stall_rate and random.random() < self.server.stall_rate:
+                self.server.stats["stalls"] += 1
+                time.sleep(self.server.stall_seconds)
+            chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                chunk({"content": token})
+                self.server.stats["tokens_sent"] += 1
+                if interval:
+                    time.sleep(interval)
+            chunk(finish_reason="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk(usage=self._usage(body, len(tokens)))
+            self._write_chunk("data: [DONE]\n\n")
+            self._write_chunk("")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stats["disconnects"] += 1
+            self.close_connection = True
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, response_text=DEFAULT_RESPONSE, tokens_per_second=50.0,
+                 first_token_delay=0.2, connect_delay=0.0, error_rate=0.0,
+                 stall_rate=0.0, stall_seconds=5.0, fail_models=()):
+        super().__init__(address, FakeOpenAIHandler)
+        self.response_text = response_text
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.connect_delay = connect_delay
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.fail_models = set(fail_models)
+        self.stats = {"connections": 0, "requests": 0, "tokens_sent": 0, "disconnects": 0,
+                      "errors": 0, "stalls": 0}
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is routine, not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start a `FakeOpenAIServer` on a daemon thread and return it."""
+    server = FakeOpenAIServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--connect-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=5.0)
+    parser.add_argument("--fail-model", action="append", default=[],
+                        help="always fail completions for this model (repeatable)")
+    parser.add_argument("--response-words", type=int, default=0,
+                        help="answer with this many words instead of the default text")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        (args.host, args.port),
+        response_text=make_response_text(args.response_words) if args.response_words else DEFAULT_RESPONSE,
+        tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay,
+        connect_delay=args.connect_delay,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        fail_models=args.fail_model,
+    )
+    print(f"Fake OpenAI server listening on {server.base_url}", flush=True)
+    server.serve_forever()
@@ -1,35 +1,55 @@
 import os
 import logging
-import threading
-import pyttsx3
+import time
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import SystemMessage, trim_messages
+from langchain_core.messages import SystemMessage
 from operator import itemgetter
 from langchain_core.runnables import RunnablePassthrough
-from pynput import keyboard
-
-# Set up logging
-logging.basicConfig(filename='chatbot_errors.log', level=logging.ERROR, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from log_setup import setup_logging, upstream_log
+from model_factory import create_model_from_env, warm_up_from_env
+from speculative import TurnPreparer
+from startup import deferred, startup_mode
+from token_counting import TokenCounter, trim_last_messages
+from tts_cache import AudioCache
+from tts_pipeline import SpeechWorker, speak_stream
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the model
+# Set up logging (LOG_MODE=queue writes from a background thread; see log_setup.py)
+setup_logging()
+
+# Initialize the model (deferred unless STARTUP_MODE=eager)
 try:
-    model = ChatOpenAI(model="gpt-3.5-turbo")
+    model = create_model_from_env("gpt-3.5-turbo")
 except Exception as e:
     logging.error(f"Failed to initialize ChatOpenAI model: {str(e)}")
     print("An error occurred while initializing the chatbot. Please check the log file.")
     exit(1)
 
-# Initialize TTS engine
-engine = pyttsx3.init()
+# Open upstream connections before the first request (OPENAI_WARMUP=n)
+warm_up_from_env(model)
+
+def init_tts_engine():
+    import pyttsx3
+    return pyttsx3.init()
+
+def create_speech_worker():
+    # Cache synthesized audio on disk so replays and repeated sentences play immediately;
+    # TTS_CACHE_DIR= (empty) turns the cache off
+    tts_cache_dir = os.getenv('TTS_CACHE_DIR', '.tts_cache')
+    tts_cache = None
+    if tts_cache_dir:
+        tts_cache = AudioCache(tts_cache_dir, max_bytes=int(os.getenv('TTS_CACHE_MAX_BYTES', str(256 * 1024 * 1024))))
+    # The worker owns the TTS engine and speaks one sentence at a time
+    return SpeechWorker(init_tts_engine, max_queue=int(os.getenv('TTS_MAX_QUEUE', '32')), cache=tts_cache)
+
+# Initialize the speech worker (deferred unless STARTUP_MODE=eager)
+speech = deferred(create_speech_worker)
 
 # Global variables
 tts_enabled = False
@@ -49,14 +69,13 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="messages"),
 ])
 
-# Create the message trimmer
-trimmer = trim_messages(
+# Create the message trimmer; token counts are cached per message
+token_counter = TokenCounter(model.model_name)
+trimmer = trim_last_messages(
     max_tokens=65,
-    strategy="last",
-    token_counter=model,
+    token_counter=token_counter,
     include_system=True,
-    allow_partial=False,
-    start_on="human",
+    start_on=HumanMessage,
 )
 
 # Create the chain
@@ -73,18 +92,36 @@ with_message_history = RunnableWithMessageHistory(
     input_messages_key="messages",
 )
 
+# CLI_MODE=speculative prepares each turn while waiting for input (see speculative.py);
+# CLI_LATENCY=1 prints keystroke-to-first-token latency after each answer
+cli_mode = os.getenv('CLI_MODE', 'standard')
+report_latency = os.getenv('CLI_LATENCY', '0') == '1'
+
 def speak_text(text):
-    engine.say(text)
-    engine.runAndWait()
+    # Replace whatever is being spoken with `text`
+    speech.get().start_turn()
+    speech.get().speak(text)
 
 def on_press(key):
     global tts_enabled, last_response
+    from pynput import keyboard
+    if key == keyboard.Key.esc:
+        # Barge-in: stop speaking
+        if speech.ready:
+            speech.get().cancel()
+        return
     try:
         if key.char == 's':
-            threading.Thread(target=speak_text, args=(last_response,)).start()
+            speak_text(last_response)
     except AttributeError:
         pass
 
+def start_keyboard_listener():
+    from pynput import keyboard
+    listener = keyboard.Listener(on_press=on_press)
+    listener.start()
+    return listener
+
 def toggle_tts():
     global tts_enabled
     tts_enabled = not tts_enabled
@@ -96,14 +133,22 @@ def main():
     config = {"configurable": {"session_id": session_id}}
 
     print("Welcome to the chatbot!")
-    print("Type 'quit' to exit, 'toggle_tts' to enable/disable Text-to-Speech, or press 's' to speak the last response.")
+    print("Type 'quit' to exit, 'toggle_tts' to enable/disable Text-to-Speech, 'tts_stats' for TTS cache stats, or press 's' to speak the last response and Esc to stop speaking.")
     
-    # Start listening for key presses
-    listener = keyboard.Listener(on_press=on_press)
-    listener.start()
+    # Start listening for key presses; outside eager mode pynput loads in the background
+    listener = deferred(start_keyboard_listener, 'eager' if startup_mode() == 'eager' else 'background')
+
+    # Trim the history, render the prompt and keep the connection warm while the user types
+    preparer = None
+    if cli_mode == 'speculative':
+        preparer = TurnPreparer(get_session_history, session_id, {model.model_name: (model, token_counter)},
+                                max_tokens=65, keepalive=float(os.getenv('CLI_KEEPALIVE_SECONDS', '20')))
 
     while True:
+        if preparer:
+            preparer.prepare(prompt)
         user_input = input("You: ")
+        submitted = time.perf_counter()
         
         if user_input.lower() == 'quit':
             print("Goodbye!")
@@ -111,32 +156,58 @@ def main():
         elif user_input.lower() == 'toggle_tts':
             toggle_tts()
             continue
+        elif user_input.lower() == 'tts_stats':
+            print(f"TTS cache: {speech.get().cache.stats() if speech.get().cache else 'disabled'}")
+            continue
         
         print("Bot: ", end="", flush=True)
-        
+
+        # A new question interrupts the previous answer's speech
+        if tts_enabled or speech.ready:
+            speech.get().start_turn()
+
         try:
             full_response = ""
-            for chunk in with_message_history.stream(
-                {
-                    "messages": [HumanMessage(content=user_input)],
-                    "language": "English",
-                },
-                config=config
-            ):
+            if preparer:
+                stream = preparer.stream(user_input)
+            else:
+                stream = with_message_history.stream(
+                    {
+                        "messages": [HumanMessage(content=user_input)],
+                        "language": "English",
+                    },
+                    config=config
+                )
+            if tts_enabled:
+                # Speak each sentence as soon as it is complete
+                stream = speak_stream(stream, speech.get())
+            first_token = None
+            for chunk in stream:
+                if first_token is None and chunk.content:
+                    first_token = time.perf_counter() - submitted
                 print(chunk.content, end="", flush=True)
                 full_response += chunk.content
             print()  # New line after the complete response
-            
+
             last_response = full_response
-            
-            if tts_enabled:
-                threading.Thread(target=speak_text, args=(full_response,)).start()
+
+            if report_latency and first_token is not None:
+                print(f"(first token after {first_token * 1000:.0f} ms)")
+
+            first_audio = speech.get().turn_time_to_first_audio() if speech.ready else None
+            if tts_enabled and first_audio is not None:
+                print(f"(first audio after {first_audio * 1000:.0f} ms)")
 
         except Exception as e:
-            logging.error(f"Error during chat interaction: {str(e)}")
+            upstream_log.error(f"Error during chat interaction: {str(e)}")
             print("\nI'm sorry, but I encountered an error. Please try again.")
 
-    listener.stop()
+    if preparer:
+        preparer.stop()
+    if listener.ready:
+        listener.get().stop()
+    if speech.ready:
+        speech.get().close()
 
 if __name__ == "__main__":
     try:
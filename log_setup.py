@@ -0,0 +1,279 @@
+"""Logging setup for the entry points.
+
+LOG_MODE selects how records reach the log file:
+
+    sync    `logging.basicConfig` on chatbot_errors.log; every record is
+            written on the thread that logs it (default)
+    queue   records go through a `QueueHandler` into a bounded in-memory
+            queue, and a `QueueListener` thread writes them to a rotating
+            file, so a slow disk never stalls a request or a stream
+
+In queue mode:
+
+- LOG_ROTATE=size rotates at LOG_MAX_BYTES, LOG_ROTATE=time at LOG_ROTATE_WHEN
+  (e.g. "midnight"); LOG_BACKUP_COUNT old files are kept;
+- LOG_FORMAT=json writes one JSON object per line carrying the session ID,
+  request ID and route of the request that logged it;
+- repeated upstream errors (WARNING and above from the `upstream`, openai
+  and httpx loggers; same logger, level and message with digits masked) are
+  sampled: at most LOG_SAMPLE_BURST per LOG_SAMPLE_WINDOW seconds get
+  through, and the next one to pass reports how many were suppressed. Other
+  records are never sampled;
+- records are dropped and counted rather than blocking when the queue is full.
+
+Run this module directly to compare hot-path logging latency against a slow disk:
+
+    python log_setup.py
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from request_context import request_id_var, route_label, session_id_var
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_MODES = ("sync", "queue")
+
+# Third-party loggers whose DEBUG/INFO output (TLS setup, connection pool
+# chatter) is never wanted in the error log
+NOISY_LOGGERS = ("httpx", "httpcore", "openai", "urllib3", "hpack")
+
+# Loggers whose repeated warnings and errors are sampled; failed upstream
+# calls are logged to `upstream_log`
+UPSTREAM_LOGGERS = ("upstream", "openai", "httpx", "httpcore")
+upstream_log = logging.getLogger("upstream")
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the session ID, request ID and route of the logging context."""
+
+    def filter(self, record):
+        record.session_id = session_id_var.get()
+        record.request_id = request_id_var.get()
+        record.route = route_label.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lets at most `burst` records of each kind through per `window` seconds.
+
+    Only records at `level` or above from `loggers` (or their children) are
+    sampled; everything else passes.
+    """
+
+    def __init__(self, burst=10, window=60.0, max_keys=1024, loggers=UPSTREAM_LOGGERS,
+                 level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        self.loggers = loggers
+        self.level = level
+        self._buckets = OrderedDict()  # key -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.burst or record.levelno < self.level:
+            return True
+        if not any(record.name == name or record.name.startswith(name + ".") for name in self.loggers):
+            return True
+        key = (record.name, record.levelno, _DIGITS_RE.sub("#", str(record.msg))[:200])
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket is not None else 0
+                bucket = self._buckets[key] = [now, 0, suppressed]
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if bucket[1] >= self.burst:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[1] += 1
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "session_id": getattr(record, "session_id", ""),
+            "request_id": getattr(record, "request_id", ""),
+            "route": getattr(record, "route", ""),
+            "thread": record.threadName,
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" ({record.suppressed} similar messages suppressed)"
+        return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A `QueueHandler` that drops records when its bounded queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def file_handler_from_env(filename):
+    rotate = os.getenv("LOG_ROTATE", "size").lower()
+    backups = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    if rotate == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=os.getenv("LOG_ROTATE_WHEN", "midnight"), backupCount=backups, encoding="utf-8")
+    if rotate == "size":
+        return logging.handlers.RotatingFileHandler(
+            filename, maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=backups, encoding="utf-8")
+    return logging.FileHandler(filename, encoding="utf-8")
+
+
+def setup_queue_logging(handler, level=logging.ERROR, formatter=None, queue_size=10000,
+                        sample_burst=10, sample_window=60.0):
+    """Route the root logger through a queue to `handler`, written on a listener thread.
+
+    Returns the started `QueueListener`; it is stopped, flushing the queue, at exit.
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler.setFormatter(formatter or TextFormatter(TEXT_FORMAT))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(sample_burst, sample_window))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging(filename='chatbot_errors.log'):
+    """Configure logging for an entry point from LOG_MODE and related settings."""
+    mode = os.getenv("LOG_MODE", "sync").lower()
+    level = getattr(logging, os.getenv("LOG_LEVEL", "ERROR").upper(), logging.ERROR)
+    if mode != "queue":
+        logging.basicConfig(filename=filename, level=level, format=TEXT_FORMAT)
+        if mode not in LOG_MODES:
+            logging.getLogger(__name__).warning(f"Unknown LOG_MODE {mode!r}; using sync")
+        return None
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else None
+    return setup_queue_logging(
+        file_handler_from_env(filename),
+        level=level,
+        formatter=formatter,
+        queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        sample_burst=int(os.getenv("LOG_SAMPLE_BURST", "10")),
+        sample_window=float(os.getenv("LOG_SAMPLE_WINDOW", "60")),
+    )
+
+
+class _SlowDiskHandler(logging.StreamHandler):
+    """Writes to a throwaway file after `delay` seconds, like a saturated disk."""
+
+    def __init__(self, stream, delay):
+        super().__init__(stream)
+        self.delay = delay
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        super().emit(record)
+
+
+def _measure(logger, records, interval):
+    samples = []
+    for i in range(records):
+        start = time.perf_counter()
+        logger.error(f"Error during chat interaction: upstream returned 500 for attempt {i}")
+        samples.append(time.perf_counter() - start)
+        time.sleep(interval)
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return pick(0.50), pick(0.99), max(samples) * 1e6
+
+
+def _benchmark(records=200, interval=0.002):
+    import tempfile
+
+    print(f"{'handler':<28} {'disk':<12} {'p50':>9} {'p99':>10} {'max':>10}  (logging.error() on the caller)")
+    with tempfile.TemporaryDirectory() as workdir:
+        for delay in (0.0, 0.005, 0.05):
+            disk = "fast" if not delay else f"{delay * 1000:g}ms/write"
+            with open(os.path.join(workdir, f"sync-{delay}.log"), "w") as stream:
+                logger = logging.getLogger(f"bench.sync.{delay}")
+                logger.propagate = False
+                handler = _SlowDiskHandler(stream, delay)
+                handler.setFormatter(TextFormatter(TEXT_FORMAT))
+                logger.addHandler(handler)
+                p50, p99, worst = _measure(logger, records if not delay else 40, interval)
+                print(f"{'sync (basicConfig)':<28} {disk:<12} {p50:7.1f}us {p99:8.1f}us {worst:8.1f}us")
+
+            with open(os.path.join(workdir, f"queue-{delay}.log"), "w") as stream:
+                logger = logging.getLogger(f"bench.queue.{delay}")
+                logger.propagate = False
+                log_queue = queue.Queue(maxsize=10000)
+                queue_handler = DroppingQueueHandler(log_queue)
+                queue_handler.addFilter(ContextFilter())
+                queue_handler.addFilter(SamplingFilter(burst=0))
+                logger.addHandler(queue_handler)
+                handler = _SlowDiskHandler(stream, delay)
+                handler.setFormatter(JsonFormatter())
+                listener = logging.handlers.QueueListener(log_queue, handler)
+                listener.start()
+                p50, p99, worst = _measure(logger, records, interval)
+                print(f"{'queue + listener (json)':<28} {disk:<12} {p50:7.1f}us {p99:8.1f}us {worst:8.1f}us"
+                      f"  dropped={queue_handler.dropped}")
+                listener.stop()
+
+    sampler = SamplingFilter(burst=10, window=60)
+    logger = logging.getLogger("upstream.bench")
+    logger.propagate = False
+    logger.addFilter(sampler)
+    logger.addHandler(logging.NullHandler())
+    for i in range(1000):
+        logger.error(f"Upstream call failed: attempt {i} got HTTP 503")
+    print(f"\nsampling: 1000 repeated upstream errors -> {1000 - sampler.suppressed} written, "
+          f"{sampler.suppressed} suppressed")
+
+
+if __name__ == "__main__":
+    _benchmark()
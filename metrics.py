@@ -0,0 +1,251 @@
+"""Per-stage latency histograms for the chat chain, in Prometheus text format.
+
+`ChatMetrics` owns a small set of histograms labeled by model and route:
+
+    chat_stage_seconds{stage=...}   session_lookup, recall, trim, prompt, first_token
+                                    (model call to first chunk), streaming
+                                    (first chunk to last) and turn (the whole
+                                    RunnableWithMessageHistory stream)
+    chat_time_to_first_token_seconds  turn start to first content chunk
+    chat_generation_seconds         model call to last chunk
+    chat_tokens_in / chat_tokens_out  from the model's usage metadata
+    chat_trimmed_messages           messages dropped by the trimmer
+
+Chain stages are wrapped in `TimedStage` and the model in `InstrumentedModel`;
+both delegate straight to the wrapped runnable instead of adding runs of
+their own, so the cost per turn is a few clock reads and bucket increments.
+The route label comes from the `route_label` context variable, which the
+request handler sets before streaming and LangChain copies into its worker
+threads.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from langchain_core.runnables import Runnable
+
+from request_context import route_label
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_bound(bound) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class Histogram:
+    """A labeled histogram with fixed buckets.
+
+    Counts are stored per bucket and only made cumulative when rendered, so
+    `observe` is a bisect and three increments under a lock.
+    """
+
+    def __init__(self, name, help, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labelvalues))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_format_bound(bound)}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return lines
+
+
+class ChatMetrics:
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "chat_stage_seconds", "Time spent in each stage of a chat turn.",
+            ("stage", "model", "route"))
+        self.ttft_seconds = Histogram(
+            "chat_time_to_first_token_seconds", "Time from the start of a turn to its first content chunk.",
+            ("model", "route"))
+        self.generation_seconds = Histogram(
+            "chat_generation_seconds", "Time from the model call to its last chunk.",
+            ("model", "route"))
+        self.tokens_in = Histogram(
+            "chat_tokens_in", "Prompt tokens sent to the model per turn.",
+            ("model", "route"), TOKEN_BUCKETS)
+        self.tokens_out = Histogram(
+            "chat_tokens_out", "Completion tokens generated per turn.",
+            ("model", "route"), TOKEN_BUCKETS)
+        self.trimmed_messages = Histogram(
+            "chat_trimmed_messages", "History messages dropped by the trimmer per turn.",
+            ("model", "route"), COUNT_BUCKETS)
+        self._histograms = [self.stage_seconds, self.ttft_seconds, self.generation_seconds,
+                            self.tokens_in, self.tokens_out, self.trimmed_messages]
+
+    def observe_stage(self, stage, seconds, model):
+        self.stage_seconds.observe(seconds, stage, model, route_label.get())
+
+    def timed_history_factory(self, get_session_history, model):
+        """Wrap a session history factory to time the session lookup."""
+        def get_history(session_id: str):
+            start = time.perf_counter()
+            history = get_session_history(session_id)
+            self.observe_stage("session_lookup", time.perf_counter() - start, model)
+            return history
+        return get_history
+
+    def observe_trim(self, model):
+        """`TimedStage` hook recording how many messages the trimmer dropped."""
+        def observe(input, output):
+            self.trimmed_messages.observe(len(input) - len(output), model, route_label.get())
+        return observe
+
+    def turn_timer(self, model):
+        return TurnTimer(self, model, route_label.get())
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+class TurnTimer:
+    """Times one turn as seen by the request handler: first content chunk and total."""
+
+    __slots__ = ("metrics", "model", "route", "start", "first")
+
+    def __init__(self, metrics, model, route):
+        self.metrics = metrics
+        self.model = model
+        self.route = route
+        self.start = time.perf_counter()
+        self.first = None
+
+    def chunk(self, chunk):
+        if self.first is None and chunk.content:
+            self.first = time.perf_counter()
+            self.metrics.ttft_seconds.observe(self.first - self.start, self.model, self.route)
+
+    @property
+    def ttft(self):
+        return None if self.first is None else self.first - self.start
+
+    def finish(self):
+        """Record the turn's total time and return it in seconds."""
+        total = time.perf_counter() - self.start
+        self.metrics.stage_seconds.observe(total, "turn", self.model, self.route)
+        return total
+
+
+class TimedStage(Runnable):
+    """Times `runnable` as chain stage `stage`; `observe(input, output)` is called after it."""
+
+    def __init__(self, runnable, metrics, stage, model, observe=None):
+        self.runnable = runnable
+        self.metrics = metrics
+        self.stage = stage
+        self.model = model
+        self.observe = observe
+
+    def invoke(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        output = self.runnable.invoke(input, config, **kwargs)
+        self.metrics.observe_stage(self.stage, time.perf_counter() - start, self.model)
+        if self.observe is not None:
+            self.observe(input, output)
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        output = await self.runnable.ainvoke(input, config, **kwargs)
+        self.metrics.observe_stage(self.stage, time.perf_counter() - start, self.model)
+        if self.observe is not None:
+            self.observe(input, output)
+        return output
+
+
+class InstrumentedModel(Runnable):
+    """Chat model wrapper recording first-token, streaming and generation time and token usage."""
+
+    def __init__(self, model, metrics, model_name):
+        self.model = model
+        self.metrics = metrics
+        self.model_name = model_name
+
+    def invoke(self, input, config=None, **kwargs):
+        message = None
+        for chunk in self.stream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        message = None
+        async for chunk in self.astream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message
+
+    def _record(self, start, first, chunks, usage):
+        end = time.perf_counter()
+        route = route_label.get()
+        if first is not None:
+            self.metrics.stage_seconds.observe(first - start, "first_token", self.model_name, route)
+            self.metrics.stage_seconds.observe(end - first, "streaming", self.model_name, route)
+        self.metrics.generation_seconds.observe(end - start, self.model_name, route)
+        if usage:
+            self.metrics.tokens_in.observe(usage.get("input_tokens", 0), self.model_name, route)
+            self.metrics.tokens_out.observe(usage.get("output_tokens", 0), self.model_name, route)
+        else:
+            # No usage reported (e.g. a cached replay): count content chunks
+            self.metrics.tokens_out.observe(chunks, self.model_name, route)
+
+    def stream(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        usage = None
+        for chunk in self.model.stream(input, config, **kwargs):
+            if chunk.content:
+                chunks += 1
+                if first is None:
+                    first = time.perf_counter()
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+        self._record(start, first, chunks, usage)
+
+    async def astream(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        usage = None
+        async for chunk in self.model.astream(input, config, **kwargs):
+            if chunk.content:
+                chunks += 1
+                if first is None:
+                    first = time.perf_counter()
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk
+        self._record(start, first, chunks, usage)
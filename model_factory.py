@@ -0,0 +1,217 @@
+"""ChatOpenAI construction with a shared, explicitly configured HTTP pool.
+
+Every model built by `create_model` in a process shares one sync and one
+async httpx client. Their pool size, keep-alive, HTTP/2 and timeouts come
+from the environment:
+
+    OPENAI_POOL_SIZE          max open connections (default 100)
+    OPENAI_POOL_KEEPALIVE     idle connections kept alive (default 20)
+    OPENAI_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 120)
+    OPENAI_HTTP2              1 to negotiate HTTP/2, needs the `h2` package
+    OPENAI_CONNECT_TIMEOUT    seconds (default 5)
+    OPENAI_READ_TIMEOUT       seconds between streamed bytes (default 60)
+    OPENAI_WARMUP             connections to open at startup (default 0)
+
+`warm_up` opens connections before traffic arrives so the first user
+request does not pay for TCP and TLS setup. `create_model_from_env` honours
+STARTUP_MODE (see startup.py): outside eager mode it returns a `LazyModel`
+that imports `langchain_openai` and builds the model on first use or in the
+background. Run this module directly to
+measure first-request latency with and without warm-up against the local
+stub server:
+
+    python model_factory.py
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from langchain_core.runnables import Runnable
+
+from cancellation import track_upstream_response
+from startup import deferred, startup_mode
+
+_shared_clients = None
+_shared_lock = threading.Lock()
+
+
+def pool_settings_from_env():
+    return {
+        "pool_size": int(os.getenv("OPENAI_POOL_SIZE", "100")),
+        "keepalive": int(os.getenv("OPENAI_POOL_KEEPALIVE", "20")),
+        "keepalive_expiry": float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120")),
+        "http2": os.getenv("OPENAI_HTTP2", "0") == "1",
+        "connect_timeout": float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("OPENAI_READ_TIMEOUT", "60")),
+    }
+
+
+def create_http_clients(pool_size=100, keepalive=20, keepalive_expiry=120.0, http2=False,
+                        connect_timeout=5.0, read_timeout=60.0):
+    """Return a new (sync, async) pair of httpx clients with these pool settings."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    # Lets a disconnecting client abort the sync reads of its turn (see cancellation.py)
+    hooks = {"response": [track_upstream_response]}
+    try:
+        return (
+            httpx.Client(limits=limits, timeout=timeout, http2=http2, event_hooks=hooks),
+            httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2),
+        )
+    except ImportError:
+        logging.warning("OPENAI_HTTP2 is set but the h2 package is missing; using HTTP/1.1")
+        return (
+            httpx.Client(limits=limits, timeout=timeout, event_hooks=hooks),
+            httpx.AsyncClient(limits=limits, timeout=timeout),
+        )
+
+
+def shared_http_clients():
+    global _shared_clients
+    with _shared_lock:
+        if _shared_clients is None:
+            _shared_clients = create_http_clients(**pool_settings_from_env())
+        return _shared_clients
+
+
+def create_model(model_name, http_clients=None, **kwargs):
+    """Build a ChatOpenAI that uses the shared (or the given) HTTP clients."""
+    from langchain_openai import ChatOpenAI
+
+    http_client, http_async_client = http_clients or shared_http_clients()
+    return ChatOpenAI(
+        model=model_name,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        **kwargs,
+    )
+
+
+class LazyModel(Runnable):
+    """Stands in for a chat model until it is built; attribute access builds it."""
+
+    def __init__(self, model_name, value):
+        self.model_name = model_name
+        self._value = value
+
+    @property
+    def model(self):
+        return self._value.get()
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_value":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.model.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.model.ainvoke(input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self.model.stream(input, config, **kwargs)
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.model.astream(input, config, **kwargs):
+            yield chunk
+
+
+def create_model_from_env(model_name, **kwargs):
+    """`create_model` now in eager STARTUP_MODE, otherwise a `LazyModel` built later."""
+    mode = startup_mode()
+    if mode == "eager":
+        return create_model(model_name, **kwargs)
+    return LazyModel(model_name, deferred(lambda: create_model(model_name, **kwargs), mode))
+
+
+def _warm_up_request(model):
+    # The openai client has already resolved base_url/OPENAI_BASE_URL and the key
+    client = model.root_client
+    url = f"{str(client.base_url).rstrip('/')}/models"
+    return url, {"Authorization": f"Bearer {client.api_key}"}
+
+
+def warm_up(model, connections=1):
+    """Open `connections` pooled connections to the model's API host.
+
+    Each connection is opened by a cheap `GET /models`; failures are logged
+    and otherwise ignored, since warm-up is only an optimization.
+    """
+    url, headers = _warm_up_request(model)
+    client = model.http_client
+
+    def ping():
+        try:
+            client.get(url, headers=headers).read()
+        except Exception as e:
+            logging.error(f"Connection warm-up failed: {str(e)}")
+
+    threads = [threading.Thread(target=ping) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+async def awarm_up(model, connections=1):
+    """Async counterpart of `warm_up`, for the async client."""
+    url, headers = _warm_up_request(model)
+    client = model.http_async_client
+
+    async def ping():
+        try:
+            response = await client.get(url, headers=headers)
+            await response.aread()
+        except Exception as e:
+            logging.error(f"Connection warm-up failed: {str(e)}")
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+
+def warm_up_from_env(model):
+    """Warm up OPENAI_WARMUP connections in the background, if configured."""
+    connections = int(os.getenv("OPENAI_WARMUP", "0"))
+    if connections > 0:
+        threading.Thread(target=warm_up, args=(model, connections), daemon=True).start()
+
+
+def _benchmark(connect_delay=0.15, runs=5):
+    from langchain_core.messages import HumanMessage
+    from fake_openai_server import start_server
+
+    server = start_server(connect_delay=connect_delay, first_token_delay=0.05,
+                          tokens_per_second=0)
+    print(f"Stub server at {server.base_url}, {connect_delay * 1000:.0f}ms per new connection")
+
+    def first_token_latency(warm):
+        model = create_model(
+            "gpt-3.5-turbo",
+            http_clients=create_http_clients(),
+            base_url=server.base_url,
+            api_key="sk-fake",
+        )
+        if warm:
+            warm_up(model)
+        start = time.perf_counter()
+        for _ in model.stream([HumanMessage(content="hello")]):
+            break
+        return (time.perf_counter() - start) * 1000
+
+    for warm in (False, True):
+        samples = [first_token_latency(warm) for _ in range(runs)]
+        label = "with warm-up" if warm else "cold"
+        print(f"{label:>13}: first token after {sum(samples) / runs:7.1f}ms (mean of {runs})")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,152 @@
+"""Per-request choice between a fast and a strong chat model.
+
+`ModelRouter.route` looks at the new message, the profile settings and the
+history depth and sends trivial turns to the fast model and demanding ones
+to the strong model:
+
+- a `model` entry in the request's settings naming one of the two models
+  always wins;
+- long messages, messages that ask for explanation, comparison, code or
+  multi-step work, advanced speaking levels or extra instructions, and deep
+  histories go to the strong model;
+- everything else goes to the fast model.
+
+Each model has a latency budget for the 95th percentile time to first
+token. When the chosen model's recent p95 is over budget and the other
+model is within its own, the request goes to the other model instead.
+Samples older than `sample_ttl` seconds are dropped, and every
+`probe_every`-th rerouted turn still goes to the over-budget model as a
+probe, so a model whose provider recovers gets fresh samples and comes back.
+"""
+import re
+import threading
+import time
+from collections import Counter, deque
+
+COMPLEX_PATTERN = re.compile(
+    r"\b(why|explain|compare|difference|analy[sz]e|prove|derive|step[- ]by[- ]step|"
+    r"code|debug|implement|essay|summari[sz]e|plan|pros and cons)\b",
+    re.IGNORECASE,
+)
+
+
+class RoutingDecision:
+    __slots__ = ("model", "reason")
+
+    def __init__(self, model, reason):
+        self.model = model
+        self.reason = reason
+
+    def __repr__(self):
+        return f"RoutingDecision(model={self.model!r}, reason={self.reason!r})"
+
+
+def _p95(samples):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+class ModelRouter:
+    """Routes each turn to `fast_model` or `strong_model`.
+
+    With `enabled=False` every turn goes to `default_model` unless the
+    settings override it. `budgets` maps model name to a p95
+    time-to-first-token budget in seconds.
+    """
+
+    def __init__(self, fast_model, strong_model, default_model=None, enabled=True,
+                 budgets=None, long_words=40, deep_history=12, window=200, sample_ttl=300.0,
+                 probe_every=20):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.default_model = default_model or fast_model
+        self.enabled = enabled
+        self.budgets = budgets or {}
+        self.long_words = long_words
+        self.deep_history = deep_history
+        self.sample_ttl = sample_ttl
+        self.probe_every = probe_every
+        # (time recorded, seconds) per model
+        self._ttft = {fast_model: deque(maxlen=window), strong_model: deque(maxlen=window)}
+        self._total = {fast_model: deque(maxlen=window), strong_model: deque(maxlen=window)}
+        self._rerouted = Counter()
+        self._decisions = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def models(self):
+        return (self.fast_model, self.strong_model)
+
+    def _classify(self, message, settings, history_depth):
+        if len(message.split()) >= self.long_words:
+            return self.strong_model, "long_prompt"
+        if COMPLEX_PATTERN.search(message) or message.count("?") > 1 or "```" in message:
+            return self.strong_model, "complex_prompt"
+        if (str(settings.get("speaking_level", "")).lower() == "advanced"
+                or settings.get("additional_instructions") not in (None, "", "None")):
+            return self.strong_model, "demanding_settings"
+        if history_depth >= self.deep_history:
+            return self.strong_model, "deep_history"
+        return self.fast_model, "simple"
+
+    def _recent(self, samples):
+        cutoff = time.monotonic() - self.sample_ttl
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return [value for _, value in samples]
+
+    def _over_budget(self, model):
+        budget = self.budgets.get(model)
+        samples = self._recent(self._ttft[model]) if model in self._ttft else []
+        return bool(budget and len(samples) >= 10 and _p95(samples) > budget)
+
+    def route(self, message, settings, history_depth=0) -> RoutingDecision:
+        requested = settings.get("model")
+        if requested in self.models:
+            decision = RoutingDecision(requested, "override")
+        elif not self.enabled:
+            decision = RoutingDecision(self.default_model, "default")
+        else:
+            model, reason = self._classify(message, settings, history_depth)
+            other = self.strong_model if model == self.fast_model else self.fast_model
+            with self._lock:
+                if self._over_budget(model) and not self._over_budget(other):
+                    self._rerouted[model] += 1
+                    if self.probe_every and self._rerouted[model] % self.probe_every == 0:
+                        reason = "probe"
+                    else:
+                        model, reason = other, "over_budget"
+            decision = RoutingDecision(model, reason)
+        with self._lock:
+            self._decisions[(decision.model, decision.reason)] += 1
+        return decision
+
+    def record_latency(self, model, ttft, total):
+        """Record a finished turn; `ttft` may be None if nothing was streamed."""
+        with self._lock:
+            if model not in self._total:
+                return
+            now = time.monotonic()
+            if ttft is not None:
+                self._ttft[model].append((now, ttft))
+            self._total[model].append((now, total))
+
+    def stats(self):
+        with self._lock:
+            pick = lambda samples, q: (round(sorted(samples)[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1)
+                                       if samples else None)
+            ttft = {model: self._recent(self._ttft[model]) for model in self.models}
+            total = {model: self._recent(self._total[model]) for model in self.models}
+            latency = {
+                model: {
+                    "turns": len(total[model]),
+                    "ttft_ms_p50": pick(ttft[model], 0.50),
+                    "ttft_ms_p95": pick(ttft[model], 0.95),
+                    "total_ms_p50": pick(total[model], 0.50),
+                    "total_ms_p95": pick(total[model], 0.95),
+                    "ttft_budget_ms": round(self.budgets[model] * 1000) if self.budgets.get(model) else None,
+                }
+                for model in self.models
+            }
+            decisions = {f"{model}:{reason}": count for (model, reason), count in sorted(self._decisions.items())}
+            return {"enabled": self.enabled, "decisions": decisions, "latency": latency}
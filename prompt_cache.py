@@ -0,0 +1,69 @@
+"""Pre-rendered system prompts and bound chains per settings profile.
+
+The customizable system prompt only depends on the five `settings` fields,
+and most users never change them, so rendering it on every turn is wasted
+work. `ProfileCache` renders it once per distinct settings tuple into a
+`ChatPromptTemplate` whose only variable left is the `messages`
+placeholder, and keeps the chain built around that prompt, in a bounded
+LRU cache.
+"""
+from functools import lru_cache
+
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+SETTINGS_FIELDS = ("language", "speaking_level", "tone", "specific_words", "additional_instructions")
+
+DEFAULT_SETTINGS = {
+    "language": "English",
+    "speaking_level": "intermediate",
+    "tone": "friendly",
+    "specific_words": "None",
+    "additional_instructions": "None",
+}
+
+
+def settings_key(settings) -> tuple:
+    """Normalize a settings dict into a hashable profile key."""
+    return tuple(str(settings.get(field) or DEFAULT_SETTINGS[field]) for field in SETTINGS_FIELDS)
+
+
+class ProfileCache:
+    """LRU cache of rendered prompts and chains keyed by settings profile.
+
+    `system_template` is the system prompt with `{language}`-style fields and
+    `build_chain(prompt)` wraps a rendered prompt into the chain to run. When
+    a model name is passed to `chain_for`, chains are cached per profile and
+    model and built with `build_chain(prompt, model)`.
+    """
+
+    def __init__(self, system_template: str, build_chain, maxsize=256):
+        self.system_template = system_template
+        self.build_chain = build_chain
+        self._prompt = lru_cache(maxsize=maxsize)(self._build_prompt)
+        self._chain = lru_cache(maxsize=maxsize)(self._build_chain)
+
+    def _build_prompt(self, key):
+        system_message = SystemMessage(
+            content=self.system_template.format(**dict(zip(SETTINGS_FIELDS, key)))
+        )
+        return ChatPromptTemplate.from_messages([
+            system_message,
+            MessagesPlaceholder(variable_name="messages"),
+        ])
+
+    def _build_chain(self, key, model):
+        prompt = self._prompt(key)
+        return self.build_chain(prompt) if model is None else self.build_chain(prompt, model)
+
+    def prompt_for(self, settings):
+        return self._prompt(settings_key(settings))
+
+    def chain_for(self, settings, model=None):
+        return self._chain(settings_key(settings), model)
+
+    def stats(self):
+        prompts = self._prompt.cache_info()
+        chains = self._chain.cache_info()
+        return {"hits": chains.hits, "misses": chains.misses,
+                "profiles": prompts.currsize, "chains": chains.currsize, "maxsize": chains.maxsize}
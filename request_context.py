@@ -0,0 +1,13 @@
+"""Context variables describing the request being served.
+
+The request handlers set them; metrics reads the route label, logging
+stamps records with the first three and the HTTP client registers upstream
+responses with the turn guard. LangChain copies them into its worker
+threads. This module imports nothing else, so any layer can use it.
+"""
+import contextvars
+
+route_label = contextvars.ContextVar("route_label", default="")
+session_id_var = contextvars.ContextVar("session_id", default="")
+request_id_var = contextvars.ContextVar("request_id", default="")
+turn_guard_var = contextvars.ContextVar("turn_guard", default=None)
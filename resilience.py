@@ -0,0 +1,485 @@
+"""Deadlines, hedging, retries, circuit breaking and fallback for model calls.
+
+`ResilientChatModel` sits where the model sits in the chain and streams from
+the primary model with these rules:
+
+- if no content arrives within `ttft_deadline` seconds, a second, hedged
+  request is sent to the same model and whichever produces content first
+  is streamed; the other is abandoned;
+- a failure before the first token is retried after a jittered exponential
+  backoff, up to `max_retries` times; once content has been streamed a
+  failure is raised, since a retry would repeat text the user has seen;
+- each model has a `CircuitBreaker`; while it is open, calls skip that
+  model instead of waiting on an unhealthy provider;
+- when the primary model is exhausted or its breaker is open, the same
+  steps run against the `fallback` model.
+
+The first chunk of a turn carries the name of the model that served it in
+its response metadata (see `served_model`), so callers can attribute the
+turn's latency to that model rather than to the one they asked for.
+
+Run this module directly to exercise each rule against the local
+fault-injecting stub server:
+
+    python resilience.py
+"""
+import asyncio
+import contextvars
+import queue
+import random
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from request_context import turn_guard_var
+
+
+SERVED_MODEL_KEY = "served_model"
+
+
+def served_model(chunk, default=None):
+    """Name of the model that served the stream `chunk` came from, or `default` if unknown."""
+    return (getattr(chunk, "response_metadata", None) or {}).get(SERVED_MODEL_KEY, default)
+
+
+def _stamp(chunk, model):
+    metadata = {**chunk.response_metadata,
+                SERVED_MODEL_KEY: getattr(model, "model_name", repr(model))}
+    return chunk.copy(update={"response_metadata": metadata})
+
+
+def _turn_cancelled():
+    guard = turn_guard_var.get()
+    return guard is not None and guard.cancelled
+
+
+class CircuitOpenError(Exception):
+    """Every candidate model was skipped because its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open, `allow()` is False for `reset_timeout` seconds; then one
+    trial call is let through (half-open) and its outcome closes or re-opens
+    the breaker. `allow()` returns `TRIAL` for that call; if it ends without
+    an outcome (cancelled, client gone), `abandon_trial()` lets the next
+    call be the trial instead.
+    """
+
+    TRIAL = "trial"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return self.TRIAL
+
+    def abandon_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    self.times_opened += 1
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class ResilienceStats:
+    """Counters shared by the resilient wrappers of one process."""
+
+    FIELDS = ("calls", "attempts", "deadline_misses", "hedges", "hedge_wins", "retries",
+              "fallbacks", "short_circuits", "failures")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field, n=1):
+        with self._lock:
+            self._counts[field] += n
+
+    def stats(self, breakers=None):
+        with self._lock:
+            stats = dict(self._counts)
+        if breakers:
+            stats["breakers"] = {
+                name: {"state": breaker.state, "times_opened": breaker.times_opened}
+                for name, breaker in breakers.items()
+            }
+        return stats
+
+
+class _Attempt:
+    """One upstream stream read on its own thread into a shared queue."""
+
+    def __init__(self, index, chunks, events):
+        self.index = index
+        self.cancelled = False
+        self.pending = []  # empty chunks seen before the first content
+        self.failed = False
+        # The thread sees the caller's context variables (turn guard, request ID)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run, chunks, events), daemon=True).start()
+
+    def _run(self, chunks, events):
+        try:
+            for chunk in chunks:
+                if self.cancelled:
+                    break
+                events.put((self.index, "chunk", chunk))
+        except Exception as e:
+            events.put((self.index, "error", e))
+            return
+        finally:
+            chunks.close()
+        events.put((self.index, "done", None))
+
+
+class ResilientChatModel(Runnable):
+    """Chat model wrapper adding a first-token deadline, hedging, retries, breakers and fallback.
+
+    `breakers` maps model names to `CircuitBreaker`s and is shared between
+    wrappers so every route sees the same provider health.
+    """
+
+    def __init__(self, primary, fallback=None, breakers=None, stats=None, ttft_deadline=3.0,
+                 hedge=True, max_retries=2, backoff_base=0.2, backoff_max=2.0,
+                 breaker_factory=CircuitBreaker):
+        self.primary = primary
+        self.fallback = fallback
+        self.breakers = breakers if breakers is not None else {}
+        self.stats = stats or ResilienceStats()
+        self.ttft_deadline = ttft_deadline
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_factory = breaker_factory
+
+    @property
+    def model_name(self):
+        return self.primary.model_name
+
+    @property
+    def _identifying_params(self):
+        # Cache keys built in front of this wrapper describe the primary model
+        return self.primary._identifying_params
+
+    def _breaker(self, model):
+        name = getattr(model, "model_name", repr(model))
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers.setdefault(name, self.breaker_factory())
+        return breaker
+
+    def _backoff(self, retry):
+        # "Full jitter": uniform in [0, min(cap, base * 2^retry)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    def _candidates(self):
+        models = [self.primary] if self.fallback is None else [self.primary, self.fallback]
+        for position, model in enumerate(models):
+            breaker = self._breaker(model)
+            permit = breaker.allow()
+            if not permit:
+                self.stats.add("short_circuits")
+                continue
+            if position:
+                self.stats.add("fallbacks")
+            yield model, breaker, permit
+
+    def invoke(self, input, config=None, **kwargs):
+        message = None
+        for chunk in self.stream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message if message is not None else AIMessage(content="")
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        message = None
+        async for chunk in self.astream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message if message is not None else AIMessage(content="")
+
+    def stream(self, input, config=None, **kwargs):
+        self.stats.add("calls")
+        error = None
+        for model, breaker, permit in self._candidates():
+            for retry in range(self.max_retries + 1):
+                if retry:
+                    permit = breaker.allow()
+                    if not permit:
+                        break
+                    self.stats.add("retries")
+                settled = False
+                try:
+                    if retry:
+                        time.sleep(self._backoff(retry))
+                    for chunk in self._race(model, input, config, kwargs):
+                        if not settled:
+                            settled = True
+                            breaker.record_success()
+                            chunk = _stamp(chunk, model)
+                        yield chunk
+                    if not settled:
+                        settled = True
+                        breaker.record_success()
+                    return
+                except Exception as e:
+                    if _turn_cancelled():
+                        raise  # the client went away and the read was aborted; not the model's fault
+                    self.stats.add("failures")
+                    if settled:
+                        raise
+                    settled = True
+                    breaker.record_failure()
+                    error = e
+                finally:
+                    # A trial that ended without an outcome must not keep the breaker shut
+                    if not settled and permit is CircuitBreaker.TRIAL:
+                        breaker.abandon_trial()
+        raise error or CircuitOpenError("all models are unavailable")
+
+    def _race(self, model, input, config, kwargs):
+        # Streams from `model`, hedging with a second request if the first
+        # content misses the deadline. Raises if every attempt fails first.
+        events = queue.Queue()
+        attempts = [_Attempt(0, model.stream(input, config, **kwargs), events)]
+        self.stats.add("attempts")
+        deadline = time.monotonic() + self.ttft_deadline
+        winner = None
+        try:
+            while winner is None:
+                timeout = None
+                if self.hedge and len(attempts) == 1:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    index, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    self.stats.add("deadline_misses")
+                    self.stats.add("hedges")
+                    self.stats.add("attempts")
+                    attempts.append(_Attempt(1, model.stream(input, config, **kwargs), events))
+                    continue
+                attempt = attempts[index]
+                if kind == "chunk":
+                    if payload.content:
+                        winner = attempt
+                    else:
+                        attempt.pending.append(payload)
+                        continue
+                elif kind == "done":
+                    winner = attempt  # finished without content
+                else:
+                    attempt.failed = True
+                    if all(a.failed for a in attempts):
+                        raise payload
+                    continue
+            if winner.index:
+                self.stats.add("hedge_wins")
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancelled = True
+            yield from winner.pending
+            if kind == "done":
+                return
+            yield payload
+            while True:
+                index, kind, payload = events.get()
+                if index != winner.index:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise payload
+        finally:
+            for attempt in attempts:
+                attempt.cancelled = True
+
+    async def astream(self, input, config=None, **kwargs):
+        self.stats.add("calls")
+        error = None
+        for model, breaker, permit in self._candidates():
+            for retry in range(self.max_retries + 1):
+                if retry:
+                    permit = breaker.allow()
+                    if not permit:
+                        break
+                    self.stats.add("retries")
+                settled = False
+                try:
+                    if retry:
+                        await asyncio.sleep(self._backoff(retry))
+                    async for chunk in self._arace(model, input, config, kwargs):
+                        if not settled:
+                            settled = True
+                            breaker.record_success()
+                            chunk = _stamp(chunk, model)
+                        yield chunk
+                    if not settled:
+                        settled = True
+                        breaker.record_success()
+                    return
+                except Exception as e:
+                    self.stats.add("failures")
+                    if settled:
+                        raise
+                    settled = True
+                    breaker.record_failure()
+                    error = e
+                finally:
+                    # A trial that ended without an outcome must not keep the breaker shut
+                    if not settled and permit is CircuitBreaker.TRIAL:
+                        breaker.abandon_trial()
+        raise error or CircuitOpenError("all models are unavailable")
+
+    async def _arace(self, model, input, config, kwargs):
+        events = asyncio.Queue()
+
+        async def run(index):
+            try:
+                async for chunk in model.astream(input, config, **kwargs):
+                    await events.put((index, "chunk", chunk))
+            except Exception as e:
+                await events.put((index, "error", e))
+                return
+            await events.put((index, "done", None))
+
+        tasks = [asyncio.ensure_future(run(0))]
+        pending = {0: []}
+        failed = set()
+        self.stats.add("attempts")
+        deadline = time.monotonic() + self.ttft_deadline
+        winner = None
+        try:
+            while winner is None:
+                timeout = None
+                if self.hedge and len(tasks) == 1:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    index, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    self.stats.add("deadline_misses")
+                    self.stats.add("hedges")
+                    self.stats.add("attempts")
+                    tasks.append(asyncio.ensure_future(run(1)))
+                    pending[1] = []
+                    continue
+                if kind == "chunk":
+                    if payload.content:
+                        winner = index
+                    else:
+                        pending[index].append(payload)
+                        continue
+                elif kind == "done":
+                    winner = index
+                else:
+                    failed.add(index)
+                    if len(failed) == len(tasks):
+                        raise payload
+                    continue
+            if winner:
+                self.stats.add("hedge_wins")
+            for index, task in enumerate(tasks):
+                if index != winner:
+                    task.cancel()
+            for chunk in pending[winner]:
+                yield chunk
+            if kind == "done":
+                return
+            yield payload
+            while True:
+                index, kind, payload = await events.get()
+                if index != winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise payload
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def _benchmark():
+    from langchain_core.messages import HumanMessage
+    from fake_openai_server import start_server
+    from model_factory import create_http_clients, create_model
+
+    messages = [HumanMessage(content="hello")]
+
+    def make(server, name):
+        return create_model(name, http_clients=create_http_clients(), base_url=server.base_url,
+                            api_key="sk-fake", max_retries=0)
+
+    def run(label, server, runs=20, **options):
+        resilient = ResilientChatModel(make(server, "gpt-3.5-turbo"), make(server, "gpt-4o"),
+                                       ttft_deadline=0.3, backoff_base=0.05, **options)
+        latencies, errors = [], 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            try:
+                text = "".join(chunk.content for chunk in resilient.stream(messages))
+                assert text
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                errors += 1
+        latencies.sort()
+        mean = sum(latencies) / len(latencies) if latencies else float("nan")
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else float("nan")
+        print(f"{label:<30} ok={len(latencies):<3} errors={errors:<3} mean={mean:7.1f}ms p95={p95:7.1f}ms")
+        print(f"{'':<30} {resilient.stats.stats(resilient.breakers)}")
+
+    scenarios = [
+        ("20% stalls, no hedging", dict(stall_rate=0.2, stall_seconds=2.0), dict(hedge=False)),
+        ("20% stalls, hedged", dict(stall_rate=0.2, stall_seconds=2.0), dict()),
+        ("40% errors, no retries", dict(error_rate=0.4), dict(max_retries=0)),
+        ("40% errors, jittered retries", dict(error_rate=0.4), dict()),
+        ("primary down, fallback", dict(fail_models=["gpt-3.5-turbo"]), dict()),
+    ]
+    for label, server_options, options in scenarios:
+        random.seed(0)
+        server = start_server(tokens_per_second=0, first_token_delay=0.05, **server_options)
+        run(label, server, **options)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,353 @@
+"""Opt-in response cache in front of the chat model.
+
+`CachedChatModel` sits where the model sits in the chain
+(`... | prompt | CachedChatModel(model, cache)`), so its key is the fully
+rendered prompt after trimming plus the model's parameters. A hit is replayed
+as a stream of chunks at a configurable pace, so callers see the same
+streaming behaviour as a live generation. Identical requests that arrive
+while the first one is still generating follow that generation instead of
+starting their own. The generation runs on its own thread (or task) and
+every request, the first included, reads it as a follower, so it keeps
+going and fills the cache as long as anyone is still reading; it is
+cancelled once every reader has gone.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable
+
+from request_context import turn_guard_var
+
+
+def prompt_key(model, prompt_value) -> str:
+    """Hash of the model parameters and the rendered prompt messages."""
+    payload = {
+        "model": getattr(model, "_identifying_params", repr(model)),
+        "messages": [(m.type, m.content) for m in prompt_value.to_messages()],
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU of response texts with an optional on-disk tier.
+
+    The memory tier holds up to `max_bytes` of text. When `disk_dir` is set,
+    responses are also written there (one file per key) and the least
+    recently used files are removed once the directory exceeds
+    `disk_max_bytes`.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                       "shared": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(
+                entry.stat().st_size for entry in os.scandir(disk_dir) if entry.is_file()
+            )
+
+    def get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return text
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._store_memory(key, text)
+        return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._store_memory(key, text)
+        self._write_disk(key, text)
+
+    def record_shared(self):
+        with self._lock:
+            self._stats["shared"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _store_memory(self, key, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old.encode("utf-8"))
+        self._memory[key] = text
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.encode("utf-8"))
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # mtime doubles as the LRU timestamp
+            return text
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        with self._lock:
+            # Overwriting a key replaces its old file's bytes
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self._disk_bytes += os.path.getsize(path) - old_size
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+            entries = sorted(
+                (e for e in os.scandir(self.disk_dir) if e.name.endswith(".txt")),
+                key=lambda e: e.stat().st_mtime,
+            )
+            self._disk_bytes = sum(e.stat().st_size for e in entries)
+            for entry in entries:
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                self._disk_bytes -= size
+                self._stats["evictions"] += 1
+
+
+class _Flight:
+    """A generation in progress that identical requests can follow.
+
+    `readers` counts the requests following it; each joins under the
+    model's lock when it finds (or creates) the flight.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 1
+        self.cond = threading.Condition()
+
+    @property
+    def abandoned(self):
+        with self.cond:
+            return self.readers == 0
+
+    def follow(self):
+        index = 0
+        try:
+            while True:
+                with self.cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self.cond.wait()
+                    pending = self.chunks[index:]
+                    index += len(pending)
+                    done, error = self.done, self.error
+                yield from pending
+                if done and index >= len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self.cond:
+                self.readers -= 1
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 1
+        self.task = None
+        self.changed = asyncio.Event()
+
+    async def follow(self):
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                self.changed.clear()
+                await self.changed.wait()
+        finally:
+            self.readers -= 1
+            if not self.readers and not self.done:
+                self.task.cancel()
+
+    def notify(self):
+        self.changed.set()
+
+
+class CachedChatModel(Runnable):
+    """Chat model wrapper that serves repeated prompts from a `ResponseCache`.
+
+    Cached answers are replayed in `chunk_chars`-sized chunks with
+    `chunk_delay` seconds between them.
+    """
+
+    def __init__(self, model, cache, chunk_chars=16, chunk_delay=0.0):
+        self.model = model
+        self.cache = cache
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+
+    def invoke(self, input, config=None, **kwargs):
+        content = "".join(chunk.content for chunk in self.stream(input, config, **kwargs))
+        return AIMessage(content=content)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        chunks = [chunk.content async for chunk in self.astream(input, config, **kwargs)]
+        return AIMessage(content="".join(chunks))
+
+    def _replay_chunks(self, text):
+        for i in range(0, len(text), self.chunk_chars):
+            yield AIMessageChunk(content=text[i:i + self.chunk_chars])
+
+    def stream(self, input, config=None, **kwargs):
+        key = prompt_key(self.model, input)
+        text = self.cache.get(key)
+        if text is not None:
+            for i, chunk in enumerate(self._replay_chunks(text)):
+                if i and self.chunk_delay:
+                    time.sleep(self.chunk_delay)
+                yield chunk
+            return
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                # The producer sees the caller's context variables (route, request ID),
+                # but not its turn guard: other readers may follow this generation
+                context = contextvars.copy_context()
+                context.run(turn_guard_var.set, None)
+                threading.Thread(target=context.run, args=(self._produce, key, flight, input, config, kwargs),
+                                 daemon=True).start()
+            else:
+                with flight.cond:
+                    flight.readers += 1
+                self.cache.record_shared()
+        yield from flight.follow()
+
+    def _produce(self, key, flight, input, config, kwargs):
+        parts = []
+        chunks = self.model.stream(input, config, **kwargs)
+        try:
+            for chunk in chunks:
+                if flight.abandoned:
+                    flight.error = RuntimeError("generation cancelled")
+                    break
+                parts.append(chunk.content)
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+            else:
+                self.cache.put(key, "".join(parts))
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Closing the stream closes the upstream response of an abandoned generation
+            chunks.close()
+            with self._lock:
+                self._flights.pop(key, None)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    async def astream(self, input, config=None, **kwargs):
+        key = prompt_key(self.model, input)
+        text = self.cache.get(key)
+        if text is not None:
+            for i, chunk in enumerate(self._replay_chunks(text)):
+                if i and self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                yield chunk
+            return
+
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = self._async_flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(self._aproduce(key, flight, input, config, kwargs))
+        else:
+            flight.readers += 1
+            self.cache.record_shared()
+        follower = flight.follow()
+        try:
+            async for chunk in follower:
+                yield chunk
+        finally:
+            # Leave the flight now rather than when the follower is collected
+            await follower.aclose()
+
+    async def _aproduce(self, key, flight, input, config, kwargs):
+        parts = []
+        try:
+            async for chunk in self.model.astream(input, config, **kwargs):
+                parts.append(chunk.content)
+                flight.chunks.append(chunk)
+                flight.notify()
+            self.cache.put(key, "".join(parts))
+        except asyncio.CancelledError:
+            # Every reader has gone
+            flight.error = RuntimeError("generation cancelled")
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._async_flights.pop(key, None)
+            flight.done = True
+            flight.notify()
@@ -0,0 +1,225 @@
+"""Resumable streamed responses.
+
+Normally a /chat generation runs inside its HTTP response, so a dropped
+connection loses the rest of the answer and the client has to send the
+message again, paying for a second generation. With a `StreamRegistry`, a
+producer thread drives the generation through the coalescing stage into a
+`ResponseLog` instead: a bounded ring buffer of sequence-numbered writes,
+each stored with the character offset it starts at. The response that
+started the turn and any later `GET /chat/resume/<response_id>` are readers
+of that log:
+
+- SSE readers send each write with its sequence number as the event ID, so a
+  client resumes from the `Last-Event-ID` it last saw;
+- plain-text readers resume from `?offset=`, the number of characters
+  already received; a plain-text reader that falls behind the ring buffer
+  gets `RESUME_ERROR_MARKER` and the reason as the last line of its body;
+- a reader that catches up waits for new writes, so a resume attached while
+  the answer is still streaming gets the rest live.
+
+A client disconnect only detaches its reader; the generation keeps running
+and the turn is generated and recorded once. If no reader has been attached
+for `detached_grace` seconds it is cancelled as before. Finished logs are
+kept for `ttl` seconds and at most `max_responses` logs are kept at once.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from streaming import HEARTBEAT_EVENT, TICK, StreamStats, coalesce, sse_done_event, sse_event
+
+
+# Ends a plain-text body whose remaining writes have left the ring buffer
+RESUME_ERROR_MARKER = "\n[resume error] "
+
+
+class ResumeError(Exception):
+    """The requested position has already left the ring buffer."""
+
+
+class ResponseLog:
+    """Sequence-numbered writes of one streamed response, the newest `max_chunks` kept."""
+
+    def __init__(self, response_id, session_id, max_chunks=1024):
+        self.response_id = response_id
+        self.session_id = session_id
+        self.stats = StreamStats()
+        self.done = False
+        self.finished_at = None
+        self._entries = deque(maxlen=max_chunks)  # (seq, offset, text)
+        self._next_seq = 1
+        self._length = 0
+        self._readers = 0
+        self._detached_since = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+
+    def append(self, text):
+        with self._cond:
+            self._entries.append((self._next_seq, self._length, text))
+            self._next_seq += 1
+            self._length += len(text)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def detached_for(self):
+        """Seconds since the last reader went away; 0 while one is attached."""
+        with self._cond:
+            return 0.0 if self._readers else time.monotonic() - self._detached_since
+
+    def position(self, after_seq=0, offset=None):
+        """Return (seq, skip): the first write to send and how many of its characters to skip.
+
+        `offset` (characters already received) wins over `after_seq` (the
+        last event ID received). Raises `ResumeError` if that write is gone.
+        """
+        with self._cond:
+            first_seq, first_offset = (self._entries[0][:2] if self._entries
+                                       else (self._next_seq, self._length))
+            if offset is None:
+                seq = max(after_seq, 0) + 1
+                if seq < first_seq:
+                    raise ResumeError(f"events up to {first_seq - 1} are no longer available")
+                return seq, 0
+            if offset < first_offset:
+                raise ResumeError(f"the first {first_offset} characters are no longer available")
+            for seq, start, text in self._entries:
+                if offset < start + len(text):
+                    return seq, offset - start
+            return self._next_seq, 0
+
+    def follow(self, seq=1, skip=0, heartbeat=None):
+        """Yield (seq, text) from write `seq` on, waiting for new writes until the log is done.
+
+        Yields `TICK` whenever `heartbeat` seconds pass without a write.
+        """
+        with self._cond:
+            self._readers += 1
+        try:
+            while True:
+                with self._cond:
+                    if seq >= self._next_seq and not self.done:
+                        self._cond.wait(heartbeat)
+                    if seq < self._next_seq:
+                        first_seq = self._entries[0][0]
+                        if seq < first_seq:
+                            raise ResumeError(f"event {seq} is no longer available")
+                        text = self._entries[seq - first_seq][2]
+                    elif self.done:
+                        return
+                    else:
+                        text = None
+                if text is None:
+                    yield TICK
+                    continue
+                yield seq, text[skip:]
+                seq += 1
+                skip = 0
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._detached_since = time.monotonic()
+
+
+def sse_body(log, seq=1, skip=0, heartbeat=15.0):
+    """`text/event-stream` body reading `log` from write `seq`."""
+    try:
+        for item in log.follow(seq, skip, heartbeat or None):
+            if item is TICK:
+                yield HEARTBEAT_EVENT
+            else:
+                yield sse_event(*item)
+    except ResumeError:
+        # Fell behind the ring buffer; the client sees no done event and resumes
+        return
+    yield sse_done_event(log.last_seq + 1, log.stats)
+
+
+def plain_body(log, seq=1, skip=0):
+    """`text/plain` body reading `log` from write `seq`."""
+    try:
+        for item in log.follow(seq, skip):
+            yield item[1]
+    except ResumeError as e:
+        # Plain text has no events to leave out, so say so in the body
+        yield f"{RESUME_ERROR_MARKER}{str(e)}. Please send the message again.\n"
+
+
+class StreamRegistry:
+    """Response logs by response ID, and the producer threads that fill them."""
+
+    def __init__(self, ttl=60.0, max_responses=1000, max_chunks=1024, detached_grace=30.0):
+        self.ttl = ttl
+        self.max_responses = max_responses
+        self.max_chunks = max_chunks
+        self.detached_grace = detached_grace
+        self._logs = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "resumed": 0, "abandoned": 0, "expired": 0}
+
+    def start(self, response_id, session_id, chunks, max_bytes=256, max_delay=0.02):
+        """Start streaming message `chunks` into a new log on a producer thread."""
+        log = ResponseLog(response_id, session_id, self.max_chunks)
+        with self._lock:
+            self._expire()
+            self._logs[response_id] = log
+            self._stats["started"] += 1
+        # The producer sees the request's context variables (route, request ID)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._produce, log, chunks, max_bytes, max_delay),
+                         daemon=True).start()
+        return log
+
+    def _produce(self, log, chunks, max_bytes, max_delay):
+        writes = coalesce(chunks, log.stats, max_bytes, max_delay)
+        try:
+            for text in writes:
+                log.append(text)
+                if log.detached_for() > self.detached_grace:
+                    with self._lock:
+                        self._stats["abandoned"] += 1
+                    break
+        except Exception as e:
+            logging.error(f"Error in resumable stream {log.response_id}: {str(e)}")
+        finally:
+            # Closing the writes closes the chunk generator, cancelling an unfinished turn
+            writes.close()
+            log.finish()
+
+    def resume(self, response_id, session_id):
+        """Return the log of `response_id` if it is still kept and belongs to `session_id`."""
+        with self._lock:
+            self._expire()
+            log = self._logs.get(response_id)
+            if log is None or log.session_id != session_id:
+                return None
+            self._stats["resumed"] += 1
+            return log
+
+    def _expire(self):
+        now = time.monotonic()
+        for response_id, log in list(self._logs.items()):
+            if log.done and now - log.finished_at > self.ttl:
+                del self._logs[response_id]
+                self._stats["expired"] += 1
+        while len(self._logs) > self.max_responses:
+            # Drop the oldest finished log, or the oldest log if none has finished
+            victim = next((rid for rid, log in self._logs.items() if log.done), next(iter(self._logs)))
+            del self._logs[victim]
+            self._stats["expired"] += 1
+
+    def stats(self):
+        with self._lock:
+            active = sum(not log.done for log in self._logs.values())
+            return {**self._stats, "active": active, "kept": len(self._logs)}
@@ -0,0 +1,159 @@
+"""Bounded in-memory store for per-session chat histories."""
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+
+# Rough per-message cost of the message object and its metadata dicts,
+# added on top of the content length when estimating session size.
+MESSAGE_OVERHEAD_BYTES = 256
+
+
+def estimate_message_bytes(message) -> int:
+    content = message.content
+    if isinstance(content, str):
+        size = len(content.encode("utf-8"))
+    else:
+        size = len(str(content).encode("utf-8"))
+    return size + MESSAGE_OVERHEAD_BYTES
+
+
+class _Entry:
+    __slots__ = ("history", "last_access", "size", "counted")
+
+    def __init__(self, history, now):
+        self.history = history
+        self.last_access = now
+        self.size = 0
+        self.counted = 0
+
+
+class SessionStore:
+    """Chat histories keyed by session ID, with LRU and idle-TTL eviction.
+
+    The store keeps at most `max_sessions` sessions and roughly `max_bytes` of
+    message content; past either cap the least recently used sessions are
+    dropped. Sessions untouched for `ttl` seconds are dropped on the next
+    access. A cap of 0 (or None) disables it.
+
+    `on_evict`, if set, is called with the ID of each dropped session (under
+    the store's lock), so state kept alongside a history can go with it.
+    `in_use`, if set, returns True for sessions with a turn in flight; those
+    are never dropped, and go once they are idle again.
+    """
+
+    def __init__(self, max_sessions=10000, max_bytes=256 * 1024 * 1024, ttl=3600,
+                 history_factory=InMemoryChatMessageHistory, on_evict=None, in_use=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.history_factory = history_factory
+        self.on_evict = on_evict
+        self.in_use = in_use
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions_ttl": 0,
+            "evictions_count": 0,
+            "evictions_bytes": 0,
+        }
+
+    def get(self, session_id: str):
+        """Return the history for `session_id`, creating it if needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and self._expired(entry, now) and not self._in_use(session_id):
+                self._evict(session_id, "evictions_ttl")
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                entry = _Entry(self.history_factory(), now)
+                self._sessions[session_id] = entry
+            else:
+                self._stats["hits"] += 1
+                entry.last_access = now
+                self._sessions.move_to_end(session_id)
+            # The history grows after it is handed out, so re-measure it on
+            # each access to pick up the turns appended since the last one.
+            self._measure(entry)
+            self._enforce_limits(session_id, now)
+            return entry.history
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "sessions": len(self._sessions),
+                "bytes": self._total_bytes,
+            }
+
+    def _expired(self, entry, now):
+        return bool(self.ttl) and now - entry.last_access > self.ttl
+
+    def _measure(self, entry):
+        size = getattr(entry.history, "nbytes", None)
+        if size is not None:
+            # Histories that track their own size (CompactChatMessageHistory)
+            self._total_bytes += size - entry.size
+            entry.size = size
+            return
+        messages = entry.history.messages
+        if len(messages) < entry.counted:
+            # History was cleared or rewritten; measure it from scratch
+            self._total_bytes -= entry.size
+            entry.size = 0
+            entry.counted = 0
+        added = sum(estimate_message_bytes(m) for m in messages[entry.counted:])
+        entry.size += added
+        entry.counted = len(messages)
+        self._total_bytes += added
+
+    def _in_use(self, session_id):
+        return self.in_use is not None and self.in_use(session_id)
+
+    def _oldest_evictable(self, current_id):
+        # Least recently used session other than the one being accessed and those in flight
+        for session_id in self._sessions:
+            if session_id != current_id and not self._in_use(session_id):
+                return session_id
+        return None
+
+    def _evict(self, session_id, reason):
+        entry = self._sessions.pop(session_id)
+        self._total_bytes -= entry.size
+        self._stats[reason] += 1
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+
+    def _enforce_limits(self, current_id, now):
+        # Sessions are ordered by last access, so idle ones sit at the front
+        while True:
+            oldest_id = self._oldest_evictable(current_id)
+            if oldest_id is None or not self._expired(self._sessions[oldest_id], now):
+                break
+            self._evict(oldest_id, "evictions_ttl")
+
+        while self.max_sessions and len(self._sessions) > self.max_sessions:
+            oldest_id = self._oldest_evictable(current_id)
+            if oldest_id is None:
+                break
+            self._evict(oldest_id, "evictions_count")
+
+        while self.max_bytes and self._total_bytes > self.max_bytes:
+            oldest_id = self._oldest_evictable(current_id)
+            if oldest_id is None:
+                break
+            self._evict(oldest_id, "evictions_bytes")
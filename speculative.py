@@ -0,0 +1,189 @@
+"""Speculative turn preparation for the command-line chatbots.
+
+The CLIs spend most of their time blocked in `input()`, and only after the
+user presses Enter do they load the history, trim it, render the prompt and,
+after a long pause, reconnect to the API. `TurnPreparer` does that work on a
+background thread while the user is typing:
+
+- builds the model if startup was deferred (STARTUP_MODE=lazy/background);
+- loads the session history and cuts the window the trimmer could keep,
+  counting every message's tokens on the way; at submit the trimmer only
+  runs over that window plus the new message, which keeps exactly what
+  trimming the whole history would;
+- renders the system prompt for the current settings;
+- keeps the upstream connection warm with a cheap `GET /models` every
+  `keepalive` seconds, so the pooled connection does not expire while the
+  user thinks.
+
+At submit, `stream(user_input)` appends the new message to the prepared
+messages and streams from the model directly, then writes the finished turn
+to the history as `RunnableWithMessageHistory` would. If the history changed
+after preparation, the work is redone on the spot.
+
+Run this module directly to compare keystroke-to-first-token latency with
+the standard chain:
+
+    python speculative.py
+"""
+import logging
+import threading
+import time
+
+from langchain_core.messages import HumanMessage
+
+from model_factory import warm_up
+from token_counting import trim_last
+
+
+class _Prepared:
+    __slots__ = ("length", "prefix", "windows")
+
+    def __init__(self, length, prefix, windows):
+        self.length = length  # history length the windows were cut from
+        self.prefix = prefix  # rendered system prompt messages
+        self.windows = windows  # model name -> newest messages within the budget
+
+
+class TurnPreparer:
+    """Prepares the next turn of one CLI session while it waits for input.
+
+    `models` maps model name to (model, token counter); `max_tokens` is the
+    trimmer's budget. The first model is used unless `stream` names another.
+    """
+
+    def __init__(self, get_session_history, session_id, models, max_tokens=65, keepalive=20.0):
+        self.get_session_history = get_session_history
+        self.session_id = session_id
+        self.models = models
+        self.max_tokens = max_tokens
+        self.keepalive = keepalive
+        self._prompt = None
+        self._prepared = None
+        self._stop = threading.Event()
+
+    def prepare(self, prompt):
+        """Start preparing the next turn for `prompt`, a template whose only variable is `messages`."""
+        self._stop.set()
+        self._stop = threading.Event()
+        self._prompt = prompt
+        self._prepared = None
+        threading.Thread(target=self._run, args=(prompt, self._stop), daemon=True).start()
+
+    def stop(self):
+        """Stop keeping the connection warm."""
+        self._stop.set()
+
+    def _run(self, prompt, stop):
+        try:
+            self._prepared = self._prepare(prompt)
+        except Exception as e:
+            logging.error(f"Turn preparation failed: {str(e)}")
+        # Warm every distinct connection pool until the turn is submitted
+        clients = {}
+        for model, _ in self.models.values():
+            clients.setdefault(id(model.http_client), model)
+        while not stop.is_set():
+            for model in clients.values():
+                warm_up(model)
+            stop.wait(self.keepalive)
+
+    def _prepare(self, prompt):
+        history = self.get_session_history(self.session_id).messages
+        prefix = prompt.invoke({"messages": []}).to_messages()
+        # Cut by budget only; the trimmer's start-on-human rule runs at submit.
+        # An empty cut (a summary over budget) falls back to the whole history.
+        windows = {
+            name: trim_last(history, self.max_tokens, token_counter, start_on=None) or list(history)
+            for name, (_, token_counter) in self.models.items()
+        }
+        return _Prepared(len(history), prefix, windows)
+
+    def messages_for(self, message, model_name):
+        """Return the full prompt for the new `message`, using the prepared work if it is current."""
+        self._stop.set()
+        prepared = self._prepared
+        if prepared is None or prepared.length != len(self.get_session_history(self.session_id).messages):
+            prepared = self._prepare(self._prompt)
+        _, token_counter = self.models[model_name]
+        trimmed = trim_last(prepared.windows[model_name] + [message], self.max_tokens, token_counter)
+        return prepared.prefix + trimmed
+
+    def stream(self, user_input, model_name=None):
+        """Stream the reply to `user_input` and record the turn in the session history."""
+        model_name = model_name or next(iter(self.models))
+        message = HumanMessage(content=user_input)
+        model, _ = self.models[model_name]
+        reply = None
+        for chunk in model.stream(self.messages_for(message, model_name)):
+            reply = chunk if reply is None else reply + chunk
+            yield chunk
+        if reply is not None:
+            self.get_session_history(self.session_id).add_messages([message, reply])
+
+
+def _benchmark(turns=6, think_time=1.5, history_turns=500, connect_delay=0.15):
+    from operator import itemgetter
+
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+    from langchain_core.messages import AIMessage
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables import RunnablePassthrough
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+
+    from fake_openai_server import start_server
+    from model_factory import create_http_clients, create_model
+    from token_counting import TokenCounter, trim_last_messages
+
+    server = start_server(connect_delay=connect_delay, first_token_delay=0.05, tokens_per_second=0)
+    print(f"Stub server: {connect_delay * 1000:.0f}ms per new connection; idle connections expire after 1s; "
+          f"{think_time:.1f}s typing per turn; {history_turns} turns of history")
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful assistant. Answer all questions to the best of your ability."),
+        MessagesPlaceholder(variable_name="messages"),
+    ])
+
+    for mode in ("standard", "speculative"):
+        model = create_model("gpt-3.5-turbo", http_clients=create_http_clients(keepalive_expiry=1.0),
+                             base_url=server.base_url, api_key="sk-fake")
+        token_counter = TokenCounter("gpt-3.5-turbo")
+        history = InMemoryChatMessageHistory()
+        for i in range(history_turns):
+            history.add_messages([HumanMessage(content=f"Earlier question {i} about cooking pasta?"),
+                                  AIMessage(content=f"Earlier answer {i}: boil water, add salt, then pasta.")])
+        get_session_history = lambda session_id: history
+        chain = (
+            RunnablePassthrough.assign(messages=itemgetter("messages") | trim_last_messages(65, token_counter))
+            | prompt
+            | model
+        )
+        with_message_history = RunnableWithMessageHistory(chain, get_session_history, input_messages_key="messages")
+        preparer = TurnPreparer(get_session_history, "bench", {"gpt-3.5-turbo": (model, token_counter)},
+                                keepalive=0.5)
+
+        samples = []
+        for turn in range(turns):
+            if mode == "speculative":
+                preparer.prepare(prompt)
+            time.sleep(think_time)  # the user is typing
+            submitted = time.perf_counter()
+            if mode == "speculative":
+                stream = preparer.stream(f"Question {turn}: what goes well with pesto?")
+            else:
+                stream = with_message_history.stream(
+                    {"messages": [HumanMessage(content=f"Question {turn}: what goes well with pesto?")]},
+                    config={"configurable": {"session_id": "bench"}},
+                )
+            first = None
+            for chunk in stream:
+                if first is None and chunk.content:
+                    first = time.perf_counter() - submitted
+            samples.append(first * 1000)
+        preparer.stop()
+        samples.sort()
+        print(f"{mode:>12}: keystroke to first token p50={samples[len(samples) // 2]:.1f}ms "
+              f"max={samples[-1]:.1f}ms  (history now {len(history.messages)} messages)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
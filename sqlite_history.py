@@ -0,0 +1,249 @@
+"""Chat history backend on a local SQLite database in WAL mode.
+
+Turns are appended to a single `messages` table and reads only fetch the
+tail of a session, so the cost of loading history does not grow with the
+length of the conversation. WAL mode lets several worker processes read
+while one writes, and the busy timeout makes concurrent writers wait for
+each other instead of failing. Connections come from a small per-database
+pool shared by all threads, which also creates the schema once.
+
+Run this module directly to benchmark append and tail-read latency:
+
+    python sqlite_history.py --sessions 100000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+"""
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """At most `size` connections to one database, shared by every thread.
+
+    Request, pump and producer threads come and go, so connections are not
+    tied to a thread: each use borrows an idle connection (opening one if
+    fewer than `size` are open, waiting otherwise) and hands it back.
+    """
+
+    def __init__(self, db_path, size=8):
+        self.db_path = db_path
+        self.size = size
+        self._idle = []
+        self._open_count = 1
+        self._cond = threading.Condition()
+        conn = self._open()
+        conn.executescript(SCHEMA)
+        self._idle.append(conn)
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._cond:
+            while not self._idle and self._open_count >= self.size:
+                self._cond.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open_count += 1
+        if conn is None:
+            try:
+                conn = self._open()
+            except BaseException:
+                with self._cond:
+                    self._open_count -= 1
+                    self._cond.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+
+def connection(db_path: str, pool_size=8):
+    """Borrow a connection to `db_path`; the schema is created with the path's pool."""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path, pool_size)
+    return pool.connection()
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Append-only chat history for one session, stored in SQLite.
+
+    `messages` returns at most the last `tail_limit` messages, which is all
+    the trimmer ever keeps, plus a leading system message (the running
+    summary written by `HistoryCompactor`) if the tail no longer reaches it;
+    pass `tail_limit=None` to load everything. `all_messages` always loads
+    everything.
+    """
+
+    def __init__(self, session_id: str, db_path="chat_history.db", tail_limit=20, pool_size=8):
+        self.session_id = session_id
+        self.db_path = db_path
+        self.tail_limit = tail_limit
+        self.pool_size = pool_size
+
+    def _connection(self):
+        return connection(self.db_path, self.pool_size)
+
+    @property
+    def all_messages(self):
+        """Every stored message of the session, regardless of `tail_limit`."""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id",
+                (self.session_id,),
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    @property
+    def messages(self):
+        if self.tail_limit is None:
+            return self.all_messages
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, message FROM ("
+                " SELECT id, message FROM messages WHERE session_id = ?"
+                " ORDER BY id DESC LIMIT ?"
+                ") ORDER BY id",
+                (self.session_id, self.tail_limit),
+            ).fetchall()
+            if rows and len(rows) == self.tail_limit:
+                first = conn.execute(
+                    "SELECT id, message FROM messages WHERE session_id = ? ORDER BY id LIMIT 1",
+                    (self.session_id,),
+                ).fetchone()
+                # Rows with the same text are different rows; only the id tells them apart
+                if first[0] != rows[0][0] and json.loads(first[1])["type"] == "system":
+                    rows.insert(0, first)
+        return messages_from_dict([json.loads(row[1]) for row in rows])
+
+    def add_messages(self, messages) -> None:
+        now = time.time()
+        rows = [
+            (self.session_id, json.dumps(message_to_dict(m)), now)
+            for m in messages
+        ]
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO messages (session_id, message, created_at) VALUES (?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def replace_messages(self, messages) -> None:
+        """Atomically replace the session's stored messages with `messages`."""
+        now = time.time()
+        rows = [
+            (self.session_id, json.dumps(message_to_dict(m)), now)
+            for m in messages
+        ]
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+                conn.executemany(
+                    "INSERT INTO messages (session_id, message, created_at) VALUES (?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def clear(self) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"mean={statistics.mean(samples) * 1000:.3f}ms p50={pick(0.50):.3f}ms p95={pick(0.95):.3f}ms p99={pick(0.99):.3f}ms"
+
+
+def benchmark(sessions, turns, samples, tail_limit, db_path):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    print(f"Seeding {sessions} sessions x {turns} turns into {db_path}...")
+    human = json.dumps(message_to_dict(HumanMessage(content="What is the capital of France?")))
+    ai = json.dumps(message_to_dict(AIMessage(content="The capital of France is Paris.")))
+    now = time.time()
+    with connection(db_path) as conn:
+        conn.execute("BEGIN")
+        for turn in range(turns):
+            conn.executemany(
+                "INSERT INTO messages (session_id, message, created_at) VALUES (?, ?, ?)",
+                ((f"session-{i}", m, now) for i in range(sessions) for m in (human, ai)),
+            )
+        conn.execute("COMMIT")
+
+    turn_messages = [HumanMessage(content="And of Spain?"), AIMessage(content="Madrid.")]
+    append_times = []
+    read_times = []
+    for _ in range(samples):
+        history = SQLiteChatMessageHistory(
+            f"session-{random.randrange(sessions)}", db_path, tail_limit
+        )
+        start = time.perf_counter()
+        history.add_messages(turn_messages)
+        append_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        history.messages
+        read_times.append(time.perf_counter() - start)
+
+    print(f"append (1 turn): {_percentiles(append_times)}")
+    print(f"tail read ({tail_limit} msgs): {_percentiles(read_times)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite history backend")
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--tail-limit", type=int, default=20)
+    parser.add_argument("--db", default=None, help="database file (default: a temporary file)")
+    args = parser.parse_args()
+
+    if args.db:
+        benchmark(args.sessions, args.turns, args.samples, args.tail_limit, args.db)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            benchmark(args.sessions, args.turns, args.samples, args.tail_limit,
+                      os.path.join(tmp, "bench.db"))
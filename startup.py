@@ -0,0 +1,155 @@
+"""Startup modes, deferred construction and startup measurements.
+
+STARTUP_MODE selects when the expensive parts of an entry point (the
+`langchain_openai` import and model, the TTS engine, the keyboard listener)
+are created:
+
+    eager       at import, before the first prompt or request (default)
+    lazy        on first use
+    background  in a background thread right after import; first use waits
+                for it if it has not finished yet
+
+Run this module directly to measure each entry point's startup latency in
+every mode, or to print an `-X importtime` report for one module:
+
+    python startup.py
+    python startup.py --import-time stream
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_MODES = ("eager", "lazy", "background")
+ENTRY_POINTS = ("stream", "stream_custom", "lc_tts", "backend")
+
+
+def startup_mode():
+    mode = os.getenv("STARTUP_MODE", "eager").lower()
+    if mode not in STARTUP_MODES:
+        logging.error(f"Unknown STARTUP_MODE {mode!r}; using eager")
+        return "eager"
+    return mode
+
+
+class LazyValue:
+    """A value built by `factory` at most once, on first `get()` or in the background."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._built = False
+        self._value = None
+
+    @property
+    def ready(self):
+        return self._built
+
+    def get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self._factory()
+                    self._built = True
+        return self._value
+
+    def start_background(self):
+        def build():
+            try:
+                self.get()
+            except Exception as e:
+                # get() raises the error again on first use
+                logging.error(f"Background initialization failed: {str(e)}")
+        threading.Thread(target=build, daemon=True).start()
+        return self
+
+
+def deferred(factory, mode=None):
+    """Wrap `factory` in a `LazyValue` and build it now, later or in the background per `mode`."""
+    value = LazyValue(factory)
+    mode = mode or startup_mode()
+    if mode == "eager":
+        value.get()
+    elif mode == "background":
+        value.start_background()
+    return value
+
+
+def import_time_report(module, top=20):
+    """Run `python -X importtime -c 'import module'` and return the slowest imports.
+
+    Returns (cumulative_us, self_us, name) tuples sorted by cumulative time.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, cwd=workdir, env=_probe_env(),
+        )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+# Imports the entry point, then forces its model; prints both timings in ms
+_PROBE = """
+import os, sys, time
+start = time.perf_counter()
+import {module} as entry
+imported = time.perf_counter()
+entry.model.root_client
+print(round((imported - start) * 1000, 1), round((time.perf_counter() - start) * 1000, 1))
+os._exit(0)
+"""
+
+
+def _probe_env(**overrides):
+    # Entry points run from a scratch directory so their log files stay out of the repo
+    env = dict(os.environ, **overrides)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def _benchmark(runs=3):
+    env = _probe_env(OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "sk-startup-benchmark"))
+    print(f"{'entry point':<14} {'mode':<11} {'ready to serve':>15} {'model ready':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for module in ENTRY_POINTS:
+            for mode in STARTUP_MODES:
+                samples = []
+                for _ in range(runs):
+                    result = subprocess.run(
+                        [sys.executable, "-c", _PROBE.format(module=module)],
+                        capture_output=True, text=True, env=dict(env, STARTUP_MODE=mode), cwd=workdir,
+                    )
+                    if result.returncode != 0:
+                        break
+                    samples.append([float(v) for v in result.stdout.split()[-2:]])
+                if not samples:
+                    error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+                    print(f"{module:<14} {mode:<11} {'unavailable: ' + error}")
+                    continue
+                imported = sum(s[0] for s in samples) / len(samples)
+                ready = sum(s[1] for s in samples) / len(samples)
+                print(f"{module:<14} {mode:<11} {imported:13.1f}ms {ready:10.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup latency and import-time report")
+    parser.add_argument("--import-time", metavar="MODULE", help="print the slowest imports of MODULE")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    if args.import_time:
+        print(f"{'cumulative':>12} {'self':>10}  module")
+        for cumulative_us, self_us, name in import_time_report(args.import_time):
+            print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {name}")
+    else:
+        _benchmark(args.runs)
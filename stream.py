@@ -1,30 +1,36 @@
 import os
 import logging
+import time
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import SystemMessage, trim_messages
+from langchain_core.messages import SystemMessage
 from operator import itemgetter
 from langchain_core.runnables import RunnablePassthrough
-
-# Set up logging
-logging.basicConfig(filename='chatbot_errors.log', level=logging.ERROR, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from log_setup import setup_logging, upstream_log
+from model_factory import create_model_from_env, warm_up_from_env
+from speculative import TurnPreparer
+from token_counting import TokenCounter, trim_last_messages
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the model
+# Set up logging (LOG_MODE=queue writes from a background thread; see log_setup.py)
+setup_logging()
+
+# Initialize the model (deferred unless STARTUP_MODE=eager)
 try:
-    model = ChatOpenAI(model="gpt-3.5-turbo")
+    model = create_model_from_env("gpt-3.5-turbo")
 except Exception as e:
     logging.error(f"Failed to initialize ChatOpenAI model: {str(e)}")
     print("An error occurred while initializing the chatbot. Please check the log file.")
     exit(1)
 
+# Open upstream connections before the first request (OPENAI_WARMUP=n)
+warm_up_from_env(model)
+
 # Create a store for chat histories
 store = {}
 
@@ -39,14 +45,13 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="messages"),
 ])
 
-# Create the message trimmer
-trimmer = trim_messages(
+# Create the message trimmer; token counts are cached per message
+token_counter = TokenCounter(model.model_name)
+trimmer = trim_last_messages(
     max_tokens=65,
-    strategy="last",
-    token_counter=model,
+    token_counter=token_counter,
     include_system=True,
-    allow_partial=False,
-    start_on="human",
+    start_on=HumanMessage,
 )
 
 # Create the chain
@@ -63,14 +68,28 @@ with_message_history = RunnableWithMessageHistory(
     input_messages_key="messages",
 )
 
+# CLI_MODE=speculative prepares each turn while waiting for input (see speculative.py);
+# CLI_LATENCY=1 prints keystroke-to-first-token latency after each answer
+cli_mode = os.getenv('CLI_MODE', 'standard')
+report_latency = os.getenv('CLI_LATENCY', '0') == '1'
+
 def main():
     session_id = "user_session"
     config = {"configurable": {"session_id": session_id}}
 
     print("Welcome to the chatbot! Type 'quit' to exit.")
+
+    # Trim the history, render the prompt and keep the connection warm while the user types
+    preparer = None
+    if cli_mode == 'speculative':
+        preparer = TurnPreparer(get_session_history, session_id, {model.model_name: (model, token_counter)},
+                                max_tokens=65, keepalive=float(os.getenv('CLI_KEEPALIVE_SECONDS', '20')))
     
     while True:
+        if preparer:
+            preparer.prepare(prompt)
         user_input = input("You: ")
+        submitted = time.perf_counter()
         
         if user_input.lower() == 'quit':
             print("Goodbye!")
@@ -79,19 +98,31 @@ def main():
         print("Bot: ", end="", flush=True)
         
         try:
-            for chunk in with_message_history.stream(
-                {
-                    "messages": [HumanMessage(content=user_input)],
-                    "language": "English",
-                },
-                config=config
-            ):
+            if preparer:
+                stream = preparer.stream(user_input)
+            else:
+                stream = with_message_history.stream(
+                    {
+                        "messages": [HumanMessage(content=user_input)],
+                        "language": "English",
+                    },
+                    config=config
+                )
+            first_token = None
+            for chunk in stream:
+                if first_token is None and chunk.content:
+                    first_token = time.perf_counter() - submitted
                 print(chunk.content, end="", flush=True)
             print()  # New line after the complete response
+            if report_latency and first_token is not None:
+                print(f"(first token after {first_token * 1000:.0f} ms)")
         except Exception as e:
-            logging.error(f"Error during chat interaction: {str(e)}")
+            upstream_log.error(f"Error during chat interaction: {str(e)}")
             print("\nI'm sorry, but I encountered an error. Please try again.")
 
+    if preparer:
+        preparer.stop()
+
 if __name__ == "__main__":
     try:
         main()
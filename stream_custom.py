@@ -1,30 +1,43 @@
 import os
 import logging
+import time
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import SystemMessage, trim_messages
+from langchain_core.messages import SystemMessage
 from operator import itemgetter
 from langchain_core.runnables import RunnablePassthrough
-
-# Set up logging
-logging.basicConfig(filename='chatbot_errors.log', level=logging.ERROR, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from log_setup import setup_logging, upstream_log
+from model_factory import create_model_from_env, warm_up_from_env
+from model_router import ModelRouter
+from prompt_cache import ProfileCache
+from resilience import served_model
+from speculative import TurnPreparer
+from token_counting import TokenCounter, trim_last_messages
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the model
+# Set up logging (LOG_MODE=queue writes from a background thread; see log_setup.py)
+setup_logging()
+
+# Models the router picks from per turn; gpt-4o unless MODEL_ROUTING=1
+fast_model_name = os.getenv('ROUTER_FAST_MODEL', 'gpt-3.5-turbo')
+strong_model_name = os.getenv('ROUTER_STRONG_MODEL', 'gpt-4o')
+
+# Initialize the models (deferred unless STARTUP_MODE=eager)
 try:
-    model = ChatOpenAI(model="gpt-4o")
+    models = {name: create_model_from_env(name) for name in (fast_model_name, strong_model_name)}
+    model = models[strong_model_name]
 except Exception as e:
     logging.error(f"Failed to initialize ChatOpenAI model: {str(e)}")
     print("An error occurred while initializing the chatbot. Please check the log file.")
     exit(1)
 
+# Open upstream connections before the first request (OPENAI_WARMUP=n)
+warm_up_from_env(model)
+
 # Create a store for chat histories
 store = {}
 
@@ -33,42 +46,61 @@ def get_session_history(session_id: str):
         store[session_id] = InMemoryChatMessageHistory()
     return store[session_id]
 
-# Create a more customizable prompt template
-prompt = ChatPromptTemplate.from_messages([
-    (
-        "system",
-        "You are a helpful assistant. Answer all questions to the best of your ability "
-        "in {language}. Speak at a {speaking_level} level with a {tone} tone. "
-        "Try to incorporate these words or phrases if relevant: {specific_words}. "
-        "Additional instructions: {additional_instructions}"
-    ),
-    MessagesPlaceholder(variable_name="messages"),
-])
-
-# Create the message trimmer
-trimmer = trim_messages(
-    max_tokens=65,
-    strategy="last",
-    token_counter=model,
-    include_system=True,
-    allow_partial=False,
-    start_on="human",
+# The customizable system prompt, filled in from the user's settings
+system_template = (
+    "You are a helpful assistant. Answer all questions to the best of your ability "
+    "in {language}. Speak at a {speaking_level} level with a {tone} tone. "
+    "Try to incorporate these words or phrases if relevant: {specific_words}. "
+    "Additional instructions: {additional_instructions}"
 )
 
-# Create the chain
-chain = (
-    RunnablePassthrough.assign(messages=itemgetter("messages") | trimmer)
-    | prompt
-    | model
-)
+# Create a message trimmer per model; token counts are cached per message
+token_counters = {name: TokenCounter(name) for name in models}
+trimmers = {
+    name: trim_last_messages(
+        max_tokens=65,
+        token_counter=token_counters[name],
+        include_system=True,
+        start_on=HumanMessage,
+    )
+    for name in models
+}
 
-# Set up the chain with message history
-with_message_history = RunnableWithMessageHistory(
-    chain,
-    get_session_history,
-    input_messages_key="messages",
+def build_chain(profile_prompt, model_name=strong_model_name):
+    # Create the chain around a pre-rendered prompt and set it up with message history
+    chain = (
+        RunnablePassthrough.assign(messages=itemgetter("messages") | trimmers[model_name])
+        | profile_prompt
+        | models[model_name]
+    )
+    return RunnableWithMessageHistory(
+        chain,
+        get_session_history,
+        input_messages_key="messages",
+    )
+
+# Cache the rendered prompt and chain for each settings profile and model
+profiles = ProfileCache(system_template, build_chain, maxsize=16)
+
+# Route trivial turns to the fast model and demanding ones to the strong model
+router = ModelRouter(
+    fast_model_name,
+    strong_model_name,
+    default_model=strong_model_name,
+    enabled=os.getenv('MODEL_ROUTING', '0') == '1',
+    budgets={
+        fast_model_name: float(os.getenv('ROUTER_FAST_BUDGET_MS', '1500')) / 1000,
+        strong_model_name: float(os.getenv('ROUTER_STRONG_BUDGET_MS', '3000')) / 1000,
+    },
+    sample_ttl=float(os.getenv('ROUTER_SAMPLE_TTL_SECONDS', '300')),
+    probe_every=int(os.getenv('ROUTER_PROBE_EVERY', '20')),
 )
 
+# CLI_MODE=speculative prepares each turn while waiting for input (see speculative.py);
+# CLI_LATENCY=1 prints keystroke-to-first-token latency after each answer
+cli_mode = os.getenv('CLI_MODE', 'standard')
+report_latency = os.getenv('CLI_LATENCY', '0') == '1'
+
 def get_user_settings():
     print("\nLet's customize your chatbot experience!")
     settings = {
@@ -88,9 +120,20 @@ def main():
     settings = get_user_settings()
     
     print("\nGreat! Your chatbot is ready. Type 'quit' to exit or 'settings' to update your preferences.")
+
+    # Trim the history for both models, render the settings prompt and keep the
+    # connections warm while the user types; the router still picks the model at submit
+    preparer = None
+    if cli_mode == 'speculative':
+        preparer = TurnPreparer(get_session_history, session_id,
+                                {name: (models[name], token_counters[name]) for name in models},
+                                max_tokens=65, keepalive=float(os.getenv('CLI_KEEPALIVE_SECONDS', '20')))
     
     while True:
+        if preparer:
+            preparer.prepare(profiles.prompt_for(settings))
         user_input = input("You: ")
+        submitted = time.perf_counter()
         
         if user_input.lower() == 'quit':
             print("Goodbye!")
@@ -103,19 +146,33 @@ def main():
         print("Bot: ", end="", flush=True)
         
         try:
-            for chunk in with_message_history.stream(
-                {
-                    "messages": [HumanMessage(content=user_input)],
-                    **settings
-                },
-                config=config
-            ):
+            decision = router.route(user_input, settings, len(get_session_history(session_id).messages))
+            start = time.perf_counter()
+            first = None
+            if preparer:
+                stream = preparer.stream(user_input, decision.model)
+            else:
+                stream = profiles.chain_for(settings, decision.model).stream(
+                    {"messages": [HumanMessage(content=user_input)]},
+                    config=config
+                )
+            served = decision.model
+            for chunk in stream:
+                if first is None and chunk.content:
+                    first = time.perf_counter() - start
+                served = served_model(chunk, served)
                 print(chunk.content, end="", flush=True)
             print()  # New line after the complete response
+            router.record_latency(served, first, time.perf_counter() - start)
+            if report_latency and first is not None:
+                print(f"(first token after {(first + start - submitted) * 1000:.0f} ms)")
         except Exception as e:
-            logging.error(f"Error during chat interaction: {str(e)}")
+            upstream_log.error(f"Error during chat interaction: {str(e)}")
             print("\nI'm sorry, but I encountered an error. Please try again.")
 
+    if preparer:
+        preparer.stop()
+
 if __name__ == "__main__":
     try:
         main()
@@ -0,0 +1,184 @@
+import json
+import re
+import threading
+import time
+
+import pytest
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from cancellation import GUARDED_HISTORY_CONFIG, TurnGuard, guarded_history_factory
+from fake_openai_server import DEFAULT_RESPONSE, start_server
+from model_factory import create_http_clients, create_model
+from request_context import turn_guard_var
+
+MESSAGES = [HumanMessage(content="hello")]
+
+
+@pytest.fixture
+def server():
+    server = start_server(tokens_per_second=0, first_token_delay=0.0)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def clients():
+    clients = create_http_clients()
+    yield clients
+    clients[0].close()
+
+
+def make_model(server, clients):
+    return create_model("gpt-3.5-turbo", http_clients=clients, base_url=server.base_url,
+                        api_key="sk-fake", max_retries=0)
+
+
+def busy_connections(client):
+    # Pooled connections that are neither idle nor closed are still held by a response
+    return [conn for conn in client._transport._pool.connections
+            if not (conn.is_idle() or conn.is_closed())]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_stream_yields_chunks_in_order(server, clients):
+    chunks = [chunk.content for chunk in make_model(server, clients).stream(MESSAGES)]
+    tokens = re.findall(r"\s*\S+", DEFAULT_RESPONSE)
+    assert [chunk for chunk in chunks if chunk] == tokens
+    assert "".join(chunks) == DEFAULT_RESPONSE
+    assert not busy_connections(clients[0])
+
+
+def test_disconnect_mid_stream_closes_the_upstream_response(server, clients):
+    server.tokens_per_second = 20
+    stream = make_model(server, clients).stream(MESSAGES)
+    received = [next(stream).content for _ in range(4)]
+    assert "".join(received)
+    assert len(busy_connections(clients[0])) == 1
+    stream.close()
+
+    assert wait_for(lambda: server.stats["disconnects"] == 1)
+    assert server.stats["tokens_sent"] < len(DEFAULT_RESPONSE.split())
+    assert not busy_connections(clients[0])
+
+    # The pool still serves the next request
+    server.tokens_per_second = 0
+    assert "".join(chunk.content for chunk in make_model(server, clients).stream(MESSAGES)) == DEFAULT_RESPONSE
+
+
+def test_cancelled_turn_is_not_written_to_history(server, clients):
+    server.tokens_per_second = 20
+    store = {}
+
+    def get_session_history(session_id):
+        return store.setdefault(session_id, InMemoryChatMessageHistory())
+
+    prompt = ChatPromptTemplate.from_messages([("system", "Be brief."), MessagesPlaceholder("messages")])
+    chain = RunnableWithMessageHistory(
+        prompt | make_model(server, clients),
+        guarded_history_factory(get_session_history),
+        input_messages_key="messages",
+        history_factory_config=GUARDED_HISTORY_CONFIG,
+    )
+
+    guard = TurnGuard()
+    stream = chain.stream({"messages": MESSAGES},
+                          config={"configurable": {"session_id": "s", "turn_guard": guard}})
+    next(stream)
+    guard.cancelled = True
+    stream.close()
+    assert get_session_history("s").messages == []
+
+    server.tokens_per_second = 0
+    for _ in chain.stream({"messages": MESSAGES},
+                          config={"configurable": {"session_id": "s", "turn_guard": TurnGuard()}}):
+        pass
+    assert len(get_session_history("s").messages) == 2
+
+
+def test_cancel_aborts_a_read_blocked_on_another_thread(server, clients):
+    server.first_token_delay = 10.0
+    guard = TurnGuard()
+    outcome = []
+
+    def read():
+        turn_guard_var.set(guard)
+        try:
+            outcome.extend(chunk.content for chunk in make_model(server, clients).stream(MESSAGES))
+        except Exception as e:
+            outcome.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    assert wait_for(lambda: len(busy_connections(clients[0])) == 1)
+    start = time.monotonic()
+    guard.cancel()
+    reader.join(timeout=2.0)
+
+    assert not reader.is_alive()
+    assert time.monotonic() - start < 1.0
+    assert isinstance(outcome[0], Exception)
+    assert not busy_connections(clients[0])
+
+
+@pytest.fixture(scope="module")
+def backend_app(tmp_path_factory):
+    # backend.py builds its app and models at import, so every test shares one stub server
+    server = start_server(tokens_per_second=20, first_token_delay=0.0)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("backend"))
+        patch.setenv("OPENAI_API_KEY", "sk-fake")
+        patch.setenv("OPENAI_BASE_URL", server.base_url)
+        import backend
+        from model_factory import shared_http_clients
+        yield backend, server, shared_http_clients()[0]
+    server.shutdown()
+
+
+def open_body(backend, path, json, headers=None):
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(method="POST", path=path, json=json, headers=headers).get_environ()
+    return backend.app(environ, lambda status, headers, exc_info=None: None)
+
+
+def test_closing_the_chat_body_during_the_first_token_delay_closes_the_upstream(backend_app, monkeypatch):
+    backend, server, client = backend_app
+    monkeypatch.setattr(server, "first_token_delay", 10.0)
+    monkeypatch.setattr(backend, "sse_heartbeat", 0.05)
+    body = open_body(backend, "/chat", {"message": "hello"},
+                     {"X-Session-ID": "disconnect", "Accept": "text/event-stream"})
+    chunks = iter(body)
+    # Heartbeats flow while the upstream has not sent its first token yet
+    assert next(chunks) == b": heartbeat\n\n"
+    assert len(busy_connections(client)) == 1
+
+    start = time.monotonic()
+    body.close()
+    assert wait_for(lambda: not busy_connections(client) and not backend.admission.is_active("disconnect"))
+    assert time.monotonic() - start < 1.0
+    assert backend.get_session_history("disconnect").messages == []
+
+
+def test_closing_the_batch_body_stops_the_remaining_items(backend_app, monkeypatch):
+    backend, server, client = backend_app
+    monkeypatch.setattr(server, "first_token_delay", 0.2)
+    body = open_body(backend, "/chat/batch",
+                     {"items": [{"message": f"question {i}"} for i in range(20)], "max_concurrency": 2})
+    first = json.loads(next(iter(body)))
+    assert first["response"]
+    body.close()
+
+    assert wait_for(lambda: not busy_connections(client))
+    requests = server.stats["requests"]
+    time.sleep(0.5)
+    assert server.stats["requests"] == requests < 5
+    assert backend.admission.stats()["in_flight"] == 0
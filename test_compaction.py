@@ -0,0 +1,65 @@
+import time
+from contextlib import nullcontext
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from admission import QueueFullError
+from compact_history import CompactChatMessageHistory
+from compaction import HistoryCompactor, split_summary
+from sqlite_history import SQLiteChatMessageHistory
+from token_counting import TokenCounter
+
+
+def keep_user_lines(messages, **kwargs):
+    # Stands in for the model: the summary is every user message seen so far
+    text = messages[-1].content
+    previous = text.split("\n")[1]
+    said = [line[len("User: "):] for line in text.split("\n") if line.startswith("User: ")]
+    return AIMessage(content=" ".join(([] if previous == "(none)" else [previous]) + said))
+
+
+def add_turns(history, turns):
+    for i in range(turns):
+        history.add_messages([HumanMessage(content=f"u{i}"), AIMessage(content=f"a{i}")])
+
+
+def test_messages_outside_the_tail_are_summarized(tmp_path):
+    histories = [
+        SQLiteChatMessageHistory("session", str(tmp_path / "history.db"), tail_limit=4),
+        CompactChatMessageHistory(tail_limit=4, block_size=4),
+    ]
+    for history in histories:
+        add_turns(history, 50)
+        compactor = HistoryCompactor(lambda session_id: history, RunnableLambda(keep_user_lines),
+                                     TokenCounter(), keep_tokens=20, summary_tokens=400)
+        assert compactor.compact("session")
+        compactor.close()
+
+        summary, rest = split_summary(history.all_messages)
+        assert summary.content.split()[-49:] == [f"u{i}" for i in range(49)]
+        assert [message.content for message in rest] == ["u49", "a49"]
+
+
+def test_busy_session_is_compacted_later():
+    attempts = []
+
+    def lock(session_id):
+        attempts.append(session_id)
+        if len(attempts) == 1:
+            raise QueueFullError("admission queue is full", retry_after=0.1)
+        return nullcontext()
+
+    history = CompactChatMessageHistory()
+    add_turns(history, 10)
+    compactor = HistoryCompactor(lambda session_id: history, RunnableLambda(keep_user_lines),
+                                 TokenCounter(), keep_tokens=20, lock=lock)
+    compactor.schedule("session")
+    deadline = time.monotonic() + 5
+    while compactor.stats()["compactions"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    compactor.close()
+
+    stats = compactor.stats()
+    assert (stats["deferred"], stats["compactions"], stats["errors"]) == (1, 1, 0)
+    assert len(attempts) == 2
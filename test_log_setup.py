@@ -0,0 +1,80 @@
+import atexit
+import json
+import logging
+import time
+
+import pytest
+
+from log_setup import JsonFormatter, file_handler_from_env, setup_queue_logging, upstream_log
+from request_context import request_id_var, session_id_var
+
+
+class SlowStream:
+    """Wraps a file stream so every write takes `delay` seconds, like a saturated disk."""
+
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_log_calls_stay_fast_on_a_slow_disk(tmp_path, monkeypatch, root_logger):
+    monkeypatch.setenv("LOG_ROTATE", "size")
+    path = tmp_path / "chatbot_errors.log"
+    handler = file_handler_from_env(str(path))
+    handler.stream = SlowStream(handler.stream, delay=0.2)
+    listener = setup_queue_logging(handler, formatter=JsonFormatter(), sample_burst=0)
+
+    session_id_var.set("session-1")
+    request_id_var.set("request-1")
+    start = time.perf_counter()
+    for i in range(5):
+        logging.error(f"Error during chat interaction: attempt {i}")
+    elapsed = time.perf_counter() - start
+    # Five synchronous writes would take a second
+    assert elapsed < 0.1
+
+    atexit.unregister(listener.stop)
+    listener.stop()
+    handler.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["message"] for record in records] == [
+        f"Error during chat interaction: attempt {i}" for i in range(5)]
+    assert records[0]["session_id"] == "session-1"
+    assert records[0]["request_id"] == "request-1"
+
+
+def test_only_repeated_upstream_errors_are_sampled(tmp_path, root_logger):
+    path = tmp_path / "chatbot_errors.log"
+    handler = logging.FileHandler(path, encoding="utf-8")
+    listener = setup_queue_logging(handler, formatter=JsonFormatter(), sample_burst=2)
+
+    for i in range(5):
+        upstream_log.error(f"Error during chat interaction: upstream returned 500 for attempt {i}")
+        logging.error(f"History compaction failed for session {i}: disk full")
+        logging.getLogger("httpx").error(f"Request {i} failed: connection reset")
+
+    atexit.unregister(listener.stop)
+    listener.stop()
+    handler.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    counts = {name: sum(record["logger"] == name for record in records) for name in ("upstream", "root", "httpx")}
+    assert counts == {"upstream": 2, "root": 5, "httpx": 2}
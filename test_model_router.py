@@ -0,0 +1,46 @@
+import time
+
+from model_router import ModelRouter
+
+SIMPLE = "hi there"
+
+
+def make_router(**options):
+    return ModelRouter("fast", "strong", budgets={"fast": 0.5, "strong": 2.0}, window=20, **options)
+
+
+def slow_fast_model(router):
+    for _ in range(20):
+        router.record_latency("fast", 1.5, 2.0)
+        router.record_latency("strong", 0.4, 1.0)
+
+
+def test_slow_model_is_avoided():
+    router = make_router(probe_every=0)
+    slow_fast_model(router)
+    decision = router.route(SIMPLE, {})
+    assert (decision.model, decision.reason) == ("strong", "over_budget")
+
+
+def test_recovered_model_comes_back_through_probes():
+    router = make_router(probe_every=5)
+    slow_fast_model(router)
+
+    # The provider has recovered: every turn the fast model serves is quick
+    for turn in range(500):
+        decision = router.route(SIMPLE, {})
+        if decision.reason == "simple":
+            break
+        assert decision.reason in ("over_budget", "probe")
+        router.record_latency(decision.model, 0.1, 0.5)
+    else:
+        raise AssertionError("the recovered model never came back")
+    assert router.stats()["decisions"]["fast:probe"] == 20
+
+
+def test_old_samples_expire():
+    router = make_router(probe_every=0, sample_ttl=0.2)
+    slow_fast_model(router)
+    assert router.route(SIMPLE, {}).model == "strong"
+    time.sleep(0.25)
+    assert router.route(SIMPLE, {}).model == "fast"
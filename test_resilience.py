@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from fake_openai_server import start_server
+from model_factory import create_http_clients, create_model
+from resilience import CircuitBreaker, CircuitOpenError, ResilientChatModel, served_model
+
+MESSAGES = [HumanMessage(content="hello")]
+
+
+@pytest.fixture
+def server():
+    server = start_server(tokens_per_second=0, first_token_delay=0.0, fail_models=["gpt-3.5-turbo"])
+    yield server
+    server.shutdown()
+
+
+def resilient(server, breaker):
+    model = create_model("gpt-3.5-turbo", http_clients=create_http_clients(), base_url=server.base_url,
+                         api_key="sk-fake", max_retries=0)
+    return ResilientChatModel(model, breakers={"gpt-3.5-turbo": breaker}, ttft_deadline=5.0,
+                              hedge=False, max_retries=0)
+
+
+def text(model):
+    return "".join(chunk.content for chunk in model.stream(MESSAGES))
+
+
+def test_breaker_trips_fails_fast_and_recovers_through_one_trial(server):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.3)
+    model = resilient(server, breaker)
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            text(model)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+
+    # While open, calls fail without reaching the server
+    requests = server.stats["requests"]
+    start = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        text(model)
+    assert time.monotonic() - start < 0.1
+    assert server.stats["requests"] == requests
+
+    # After the reset timeout exactly one trial is let through, and it closes the breaker
+    server.fail_models.clear()
+    time.sleep(0.35)
+    assert breaker.allow() is CircuitBreaker.TRIAL
+    assert not breaker.allow()
+    breaker.abandon_trial()
+    assert text(model)
+    assert breaker.state == "closed"
+    assert server.stats["requests"] == requests + 1
+
+
+def test_cancelled_trial_does_not_keep_the_breaker_open(server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    model = resilient(server, breaker)
+    with pytest.raises(Exception):
+        text(model)
+    assert breaker.state == "open"
+
+    server.fail_models.clear()
+    server.first_token_delay = 1.0
+    time.sleep(0.15)
+
+    async def cancelled_trial():
+        async def consume():
+            async for _ in model.astream(MESSAGES):
+                pass
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)  # the trial is waiting for its first token
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_trial())
+
+    # The next call becomes the trial and closes the breaker
+    server.first_token_delay = 0.0
+    assert text(model)
+    assert breaker.state == "closed"
+
+
+
+def test_first_chunk_names_the_model_that_served_the_turn(server):
+    primary = create_model("gpt-3.5-turbo", http_clients=create_http_clients(), base_url=server.base_url,
+                           api_key="sk-fake", max_retries=0)
+    fallback = create_model("gpt-4o", http_clients=create_http_clients(), base_url=server.base_url,
+                            api_key="sk-fake", max_retries=0)
+    model = ResilientChatModel(primary, fallback, ttft_deadline=5.0, hedge=False, max_retries=0)
+
+    served = "gpt-3.5-turbo"
+    for chunk in model.stream(MESSAGES):
+        served = served_model(chunk, served)
+    assert served == "gpt-4o"
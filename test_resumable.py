@@ -0,0 +1,23 @@
+from resumable import RESUME_ERROR_MARKER, ResponseLog, plain_body
+
+
+def test_plain_reader_that_falls_behind_gets_an_error_marker():
+    log = ResponseLog("response", "session", max_chunks=2)
+    log.append("Hello")
+    body = plain_body(log)
+    assert next(body) == "Hello"
+
+    for text in (",", " world", "!", " Bye."):
+        log.append(text)
+    log.finish()
+    rest = "".join(body)
+    assert rest.startswith(RESUME_ERROR_MARKER)
+    assert "event 2 is no longer available" in rest
+
+
+def test_plain_reader_that_keeps_up_gets_no_marker():
+    log = ResponseLog("response", "session", max_chunks=2)
+    for text in ("Hello", ",", " world"):
+        log.append(text)
+    log.finish()
+    assert "".join(plain_body(log, seq=2)) == ", world"
@@ -0,0 +1,29 @@
+import time
+
+from langchain_core.messages import HumanMessage
+
+from admission import AdmissionController
+from session_store import SessionStore
+
+
+def test_sessions_with_a_turn_in_flight_are_not_evicted():
+    admission = AdmissionController()
+    store = SessionStore(max_sessions=2, ttl=0.05, in_use=admission.is_active)
+    history = store.get("busy")
+
+    with admission.acquire("busy"):
+        store.get("a")
+        store.get("b")
+        assert "busy" in store
+        time.sleep(0.1)
+        store.get("c")
+        # The turn still appends to the history the store hands out
+        history.add_messages([HumanMessage(content="Hello")])
+        assert store.get("busy") is history
+
+    # Once idle it is evicted like any other session
+    store.get("d")
+    time.sleep(0.1)
+    store.get("e")
+    assert "busy" not in store
+    assert store.stats()["evictions_ttl"] >= 1
@@ -0,0 +1,40 @@
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import sqlite_history
+from sqlite_history import SQLiteChatMessageHistory
+
+
+def test_threads_share_a_bounded_pool(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    errors = []
+
+    def turn(i):
+        try:
+            history = SQLiteChatMessageHistory(f"session-{i % 4}", db_path, pool_size=2)
+            history.add_messages([HumanMessage(content=f"q{i}"), AIMessage(content=f"a{i}")])
+            assert history.messages
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=turn, args=(i,)) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    pool = sqlite_history._pools[db_path]
+    assert pool._open_count <= 2
+    assert sum(len(SQLiteChatMessageHistory(f"session-{i}", db_path).all_messages) for i in range(4)) == 80
+
+
+def test_tail_row_with_the_summary_text_is_not_taken_for_the_summary(tmp_path):
+    history = SQLiteChatMessageHistory("session", str(tmp_path / "history.db"), tail_limit=2)
+    summary = SystemMessage(content="Summary of the earlier conversation: none")
+    history.add_messages([summary, HumanMessage(content="q"), AIMessage(content="a")])
+    assert [m.content for m in history.messages] == [summary.content, "q", "a"]
+
+    # A tail that starts with a copy of the summary's text still gets the real summary in front
+    history.replace_messages([summary, HumanMessage(content="q"), summary, AIMessage(content="a")])
+    assert [m.type for m in history.messages] == ["system", "system", "ai"]
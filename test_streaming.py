@@ -0,0 +1,68 @@
+import threading
+import time
+
+from langchain_core.messages import AIMessageChunk
+
+from streaming import plain_stream
+
+
+def test_buffer_is_flushed_while_the_upstream_is_quiet():
+    def upstream():
+        yield AIMessageChunk(content="Hello")
+        yield AIMessageChunk(content=",")
+        yield AIMessageChunk(content=" world")
+        time.sleep(0.5)
+        yield AIMessageChunk(content="!")
+
+    start = time.monotonic()
+    writes = []
+    for text in plain_stream(upstream(), max_bytes=256, max_delay=0.02):
+        writes.append((text, time.monotonic() - start))
+    assert [text for text, _ in writes] == ["Hello", ", world", "!"]
+    # The second write does not wait for the chunk after the pause
+    assert writes[1][1] < 0.2
+
+
+def test_closing_the_body_stops_reading_upstream():
+    pulled = []
+    closed = threading.Event()
+
+    def upstream():
+        try:
+            for i in range(1000):
+                pulled.append(i)
+                time.sleep(0.01)
+                yield AIMessageChunk(content=f" tok{i}")
+        finally:
+            closed.set()
+
+    body = plain_stream(upstream())
+    next(body)
+    body.close()
+    assert closed.wait(1.0)
+    count = len(pulled)
+    time.sleep(0.1)
+    assert len(pulled) == count < 10
+
+
+def test_closing_the_body_early_calls_on_cancel():
+    released = threading.Event()
+    cancels = []
+
+    def upstream():
+        yield AIMessageChunk(content="Hello")
+        # Stands in for a read blocked on the provider until the hook aborts it
+        released.wait(5.0)
+        yield AIMessageChunk(content=" world")
+
+    def on_cancel():
+        cancels.append(time.monotonic())
+        released.set()
+
+    body = plain_stream(upstream(), on_cancel=on_cancel)
+    assert next(body) == "Hello"
+    body.close()
+    assert len(cancels) == 1
+
+    finished = list(plain_stream(iter([AIMessageChunk(content="Hi")]), on_cancel=on_cancel))
+    assert finished == ["Hi"] and len(cancels) == 1
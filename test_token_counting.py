@@ -0,0 +1,16 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from token_counting import TokenCounter
+
+
+def test_memo_keeps_recently_used_messages():
+    counter = TokenCounter(max_entries=2, encoder=lambda text: len(text.split()))
+    system = SystemMessage(content="You are a helpful assistant.")
+    counter.count_message(system)
+    for i in range(5):
+        counter.count_message(HumanMessage(content=f"message {i}"))
+        # The system message is counted on every turn, so it is never the oldest entry
+        counter.count_message(system)
+    assert counter.misses == 6
+    assert counter.hits == 5
+
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from tts_pipeline import SpeechWorker, _SimulatedEngine
+
+
+class RecordingEngine(_SimulatedEngine):
+    def __init__(self):
+        super().__init__(chars_per_second=100)
+        self.spoken = []
+        self.stop_threads = []
+
+    def say(self, text):
+        self.spoken.append(text)
+        super().say(text)
+
+    def stop(self):
+        self.stop_threads.append(threading.current_thread())
+        super().stop()
+
+
+def test_cancel_stops_the_engine_on_the_worker_thread():
+    engines = []
+    worker = SpeechWorker(lambda: engines.append(RecordingEngine()) or engines[0])
+    worker.start_turn()
+    worker.speak("This sentence is long enough to take a couple of seconds to speak aloud, "
+                 "word after word after word after word after word after word.")
+    while worker.turn_time_to_first_audio() is None:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    worker.cancel()
+    worker.speak("Next turn.")
+    deadline = time.monotonic() + 2
+    while len(engines[0].spoken) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert time.monotonic() - start < 0.5
+    assert engines[0].spoken[1] == "Next turn."
+    assert engines[0].stop_threads == [worker._thread]
+    worker.close()
+
+
+def test_speak_never_blocks_and_merges_past_max_queue():
+    engines = []
+    worker = SpeechWorker(lambda: engines.append(RecordingEngine()) or engines[0], max_queue=2)
+    worker.start_turn()
+    worker.speak("This first sentence keeps the engine busy for a while, word after word.")
+    while worker.turn_time_to_first_audio() is None:
+        time.sleep(0.01)
+
+    start = time.monotonic()
+    for i in range(50):
+        worker.speak(f"Sentence {i}.")
+    assert time.monotonic() - start < 0.1
+    assert len(worker._pending) == 2
+    assert worker._pending[-1][1].startswith("Sentence 1. Sentence 2.")
+    worker.close()
+
+
+def test_time_to_first_audio_is_taken_at_the_first_word():
+    class SlowStartEngine(_SimulatedEngine):
+        def runAndWait(self):
+            time.sleep(0.3)  # engine start-up before any audio
+            super().runAndWait()
+
+    worker = SpeechWorker(SlowStartEngine)
+    worker.start_turn()
+    worker.speak("Hello there.")
+    while worker.turn_time_to_first_audio() is None:
+        time.sleep(0.01)
+    assert worker.turn_time_to_first_audio() >= 0.3
+    worker.close()
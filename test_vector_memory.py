@@ -0,0 +1,25 @@
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from session_store import SessionStore
+from token_counting import TokenCounter
+from vector_memory import RECALL_HEADER, VectorMemory
+
+
+def test_reused_session_id_does_not_recall_an_evicted_conversation():
+    memory = VectorMemory(TokenCounter(), keep_tokens=10)
+    store = SessionStore(ttl=0.05, on_evict=memory.drop)
+    get_history = memory.history_factory(store.get)
+
+    history = get_history("session")
+    for i in range(6):
+        history.add_messages([HumanMessage(content=f"My bank PIN is {i}{i}{i}{i}, remember it."),
+                              AIMessage(content="Noted.")])
+    question = [HumanMessage(content="What is my bank PIN?")]
+    assert memory.recall("session", question)[0].content.startswith(RECALL_HEADER)
+
+    time.sleep(0.1)
+    history = get_history("session")
+    assert history.messages == []
+    assert memory.recall("session", question) == question
@@ -0,0 +1,194 @@
+"""Cached token counting and a tail trimmer for chat histories.
+
+`trim_messages(token_counter=model)` re-tokenizes the whole history for
+every candidate cut, so trimming gets slower as a conversation grows even
+though only the last few messages survive. `TokenCounter` tokenizes each
+message once and memoizes the count by message content, and
+`trim_last_messages` walks back from the newest message with a running sum,
+so a trim only touches the messages it keeps (plus the one that overflows).
+
+Run this module directly for a micro-benchmark against `trim_messages`:
+
+    python token_counting.py
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import HumanMessage, SystemMessage, trim_messages
+from langchain_core.runnables import RunnableLambda
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken ships with langchain_openai
+    tiktoken = None
+
+# Same accounting as ChatOpenAI.get_num_tokens_from_messages: every message
+# is wrapped in a few formatting tokens and every reply is primed with
+# <im_start>assistant.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+
+ROLES = {"human": "user", "ai": "assistant", "system": "system", "tool": "tool"}
+
+_APPROX_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def approximate_token_count(text: str) -> int:
+    """Rough BPE-like count used when no tiktoken encoding is available."""
+    return len(_APPROX_TOKEN_RE.findall(text))
+
+
+def load_encoder(model_name: str):
+    """Return a local `text -> token count` function for `model_name`."""
+    if tiktoken is not None:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text))
+        except Exception:
+            # The encoding files are downloaded on first use; fall back to the
+            # approximation when that is not possible (e.g. offline).
+            pass
+    return approximate_token_count
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+    )
+
+
+class TokenCounter:
+    """Per-message token counts, memoized by message role and content.
+
+    Usable anywhere a `token_counter` callable is accepted. `str` caches its
+    own hash, so looking up a message that was counted before is O(1) no
+    matter how long its content is. The memo is a thread-safe LRU, so hot
+    system and summary messages stay cached.
+    """
+
+    def __init__(self, model_name="gpt-3.5-turbo", max_entries=100_000, encoder=None):
+        self.count_text = encoder or load_encoder(model_name)
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count_message(self, message) -> int:
+        content = message.content
+        key = (message.type, content if isinstance(content, str) else repr(content),
+               getattr(message, "name", None))
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        # Encoding runs outside the lock; two threads may count the same message once each
+        count = self.count_message_uncached(message)
+        with self._lock:
+            self._cache[key] = count
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return count
+
+    def count_message_uncached(self, message) -> int:
+        count = TOKENS_PER_MESSAGE
+        count += self.count_text(ROLES.get(message.type, message.type))
+        count += self.count_text(_content_text(message.content))
+        name = getattr(message, "name", None)
+        if name:
+            count += self.count_text(name) + TOKENS_PER_NAME
+        return count
+
+    def __call__(self, messages) -> int:
+        return sum(self.count_message(m) for m in messages) + REPLY_PRIMING_TOKENS
+
+
+def trim_last(messages, max_tokens, token_counter, include_system=True, start_on=HumanMessage):
+    """Keep the newest messages that fit in `max_tokens`.
+
+    Matches `trim_messages(strategy="last", allow_partial=False)`: a leading
+    system message is kept when `include_system` is set, and the kept window
+    is cut so it starts on a `start_on` message.
+    """
+    budget = max_tokens - REPLY_PRIMING_TOKENS
+    first = 0
+    if include_system and messages and isinstance(messages[0], SystemMessage):
+        first = 1
+        budget -= token_counter.count_message(messages[0])
+
+    start = len(messages)
+    while start > first:
+        cost = token_counter.count_message(messages[start - 1])
+        if cost > budget:
+            break
+        budget -= cost
+        start -= 1
+
+    if budget < 0:
+        return []
+    if start_on is not None:
+        while start < len(messages) and not isinstance(messages[start], start_on):
+            start += 1
+        if start == len(messages):
+            return []
+    return list(messages[:first]) + list(messages[start:])
+
+
+def trim_last_messages(max_tokens, token_counter, include_system=True, start_on=HumanMessage):
+    """Runnable version of `trim_last`, a drop-in for the `trim_messages` trimmer."""
+    return RunnableLambda(
+        lambda messages: trim_last(messages, max_tokens, token_counter,
+                                   include_system=include_system, start_on=start_on)
+    )
+
+
+def _benchmark():
+    from langchain_core.messages import AIMessage
+
+    counter = TokenCounter()
+    uncached = lambda messages: (
+        sum(counter.count_message_uncached(m) for m in messages) + REPLY_PRIMING_TOKENS
+    )
+    print(f"{'history':>8} {'trim_messages':>14} {'trim_last':>10} {'kept':>5}")
+    for length in (10, 100, 500, 2000, 10000):
+        history = []
+        for i in range(length // 2):
+            history.append(HumanMessage(content=f"Question number {i}: what should I cook tonight?"))
+            history.append(AIMessage(content=f"Answer {i}: how about a simple pasta with garlic and olive oil?"))
+
+        # Warm the cache the way a live session does: one new turn per request
+        for i in range(0, len(history), 2):
+            counter.count_message(history[i])
+            counter.count_message(history[i + 1])
+
+        start = time.perf_counter()
+        kept = trim_last(history, 65, counter)
+        fast = time.perf_counter() - start
+        assert counter(kept) <= 65
+
+        if length <= 500:
+            start = time.perf_counter()
+            expected = trim_messages(history, max_tokens=65, strategy="last",
+                                     token_counter=uncached, include_system=True,
+                                     allow_partial=False, start_on="human")
+            slow = f"{(time.perf_counter() - start) * 1000:12.3f}ms"
+            assert expected == kept
+        else:
+            slow = f"{'(skipped)':>14}"
+        print(f"{length:>8} {slow} {fast * 1000:8.3f}ms {len(kept):>5}")
+
+
+if __name__ == "__main__":
+    _benchmark()
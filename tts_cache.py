@@ -0,0 +1,215 @@
+"""On-disk cache of synthesized speech.
+
+Speech is rendered to audio files through the engine's `save_to_file` path
+and kept in `cache_dir` under a hash of the text and the voice settings
+(voice, rate, volume), so replaying an answer or a sentence the assistant
+has said before plays the stored file instead of synthesizing it again.
+The directory is bounded by `max_bytes`; least recently played files are
+removed first, using file mtimes as the LRU timestamps.
+
+Run this module directly to compare time-to-audio of a cold synthesis with
+a cache hit, using a simulated engine:
+
+    python tts_cache.py
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+VOICE_PROPERTIES = ("voice", "rate", "volume")
+
+
+def voice_settings(engine) -> dict:
+    """The engine properties that change how a text sounds."""
+    return {name: engine.getProperty(name) for name in VOICE_PROPERTIES}
+
+
+def audio_key(text, settings) -> str:
+    payload = {"text": text, "voice": settings}
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def player_command():
+    """Command prefix that plays an audio file and exits, or None if there is none."""
+    if sys.platform == "darwin":
+        return ["afplay"]
+    for player in (["aplay", "-q"], ["paplay"], ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet"]):
+        if shutil.which(player[0]):
+            return player
+    return None
+
+
+class AudioPlayer:
+    """Plays cached files one at a time; `stop()` interrupts the current one."""
+
+    def __init__(self):
+        self.command = player_command()
+        self._process = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.command is not None or sys.platform == "win32"
+
+    def play(self, path, current=None):
+        """Play `path` to the end; `current()`, if given, is checked under the lock first."""
+        if sys.platform == "win32":
+            import winsound
+            if current is None or current():
+                winsound.PlaySound(path, winsound.SND_FILENAME)
+            return
+        with self._lock:
+            if current is not None and not current():
+                return
+            self._process = subprocess.Popen(
+                self.command + [path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        self._process.wait()
+
+    def stop(self):
+        if sys.platform == "win32":
+            import winsound
+            winsound.PlaySound(None, winsound.SND_PURGE)
+            return
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+
+
+class AudioCache:
+    """Size-bounded LRU directory of synthesized audio files."""
+
+    def __init__(self, cache_dir=".tts_cache", max_bytes=256 * 1024 * 1024, extension=".wav"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._bytes = sum(
+            entry.stat().st_size for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith(extension)
+        )
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def get(self, key):
+        """Path of the cached audio for `key`, or None on a miss."""
+        path = self._path(key)
+        try:
+            os.utime(path)  # mtime doubles as the LRU timestamp
+        except FileNotFoundError:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return path
+
+    def synthesize(self, key, render):
+        """Render audio for `key` with `render(path)` and store it; returns the cached path.
+
+        `render` must write a complete file at the path it is given.
+        """
+        path = self._path(key)
+        tmp_path = f"{path[:-len(self.extension)]}.{threading.get_ident()}.tmp{self.extension}"
+        render(tmp_path)
+        if not os.path.exists(tmp_path):
+            raise RuntimeError("speech engine did not write an audio file")
+        with self._lock:
+            # Re-synthesizing a key replaces its old file's bytes
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self._bytes += os.path.getsize(path) - old_size
+            if self._bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        entries = sorted(
+            (e for e in os.scandir(self.cache_dir) if e.name.endswith(self.extension) and ".tmp" not in e.name),
+            key=lambda e: e.stat().st_mtime,
+        )
+        self._bytes = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self._bytes -= size
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class _SimulatedEngine:
+    # Stands in for pyttsx3: synthesizes to a file 10x faster than real time
+    def __init__(self, chars_per_second=150):
+        self.chars_per_second = chars_per_second
+        self._jobs = []
+
+    def getProperty(self, name):
+        return {"voice": "simulated", "rate": 200, "volume": 1.0}[name]
+
+    def save_to_file(self, text, path):
+        self._jobs.append((text, path))
+
+    def runAndWait(self):
+        for text, path in self._jobs:
+            time.sleep(len(text) / self.chars_per_second)
+            with open(path, "wb") as f:
+                f.write(b"\0" * 32 * len(text))
+        self._jobs = []
+
+    def stop(self):
+        pass
+
+
+def _benchmark(runs=5):
+    engine = _SimulatedEngine()
+    text = "Great question! Here is a short answer that the assistant says quite often."
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = AudioCache(cache_dir)
+
+        def time_to_audio():
+            start = time.perf_counter()
+            key = audio_key(text, voice_settings(engine))
+            if cache.get(key) is None:
+                def render(path):
+                    engine.save_to_file(text, path)
+                    engine.runAndWait()
+                cache.synthesize(key, render)
+            return (time.perf_counter() - start) * 1000
+
+        cold = time_to_audio()
+        warm = [time_to_audio() for _ in range(runs)]
+        print(f"     synthesized: audio ready after {cold:7.2f}ms")
+        print(f"       cache hit: audio ready after {sum(warm) / runs:7.2f}ms (mean of {runs})")
+        print(f"stats: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,278 @@
+"""Sentence-pipelined text-to-speech for streamed answers.
+
+Instead of waiting for the whole answer, `SentenceSplitter` cuts the stream
+of chunks into sentences as they complete and each sentence is queued for
+speech while generation continues. All speech goes through one long-lived
+`SpeechWorker` thread that owns the pyttsx3 engine, so calls never race on
+the engine's `runAndWait`. Queueing never blocks; `cancel()` drops queued
+sentences and stops the one being spoken (barge-in). The engine is only
+ever touched on the worker thread: a cancel moves the worker to a new
+epoch, and the worker stops the engine from its own word callback. With an
+`AudioCache` the worker renders each sentence to a file and plays it, so
+sentences it has spoken before play back without synthesis.
+
+Run this module directly to compare time-to-first-audio of speaking the
+full answer against the pipelined version, using the local stub server and
+a simulated engine:
+
+    python tts_pipeline.py
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from tts_cache import AudioPlayer, audio_key, voice_settings
+
+# A sentence ends at ., ! or ? followed by whitespace, or at a line break
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and returns sentences as they complete.
+
+    Pieces shorter than `min_chars` are held back and joined with the next
+    sentence, so abbreviations and list markers are not spoken on their own.
+    """
+
+    def __init__(self, min_chars=12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.start()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class SpeechWorker:
+    """Speaks queued sentences one at a time on a single background thread.
+
+    `engine_factory` is called on the worker thread to create the engine
+    (pyttsx3 engines must be driven from the thread that created them).
+    Each turn gets an epoch number; `cancel()` moves to a new epoch, so
+    sentences queued for an older turn are skipped, the epoch is checked
+    again right before a sentence is spoken or played, and a sentence
+    already being spoken is stopped at its next word. When `cache` is given
+    and an audio player is available, speech goes through the cache.
+    """
+
+    def __init__(self, engine_factory, max_queue=32, cache=None):
+        self.max_queue = max_queue
+        self._pending = deque()  # (epoch, text), at most `max_queue` entries
+        self._closed = False
+        self._engine_factory = engine_factory
+        self._engine = None
+        self._speaking = None  # epoch of the sentence the engine is speaking
+        self._word_events = False
+        self.cache = cache
+        self._player = AudioPlayer() if cache is not None else None
+        if self._player is not None and not self._player.available:
+            logging.error("No audio player found; speaking without the TTS cache")
+            self.cache = self._player = None
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._epoch = 0
+        self._turn_started = None
+        self._first_audio = None
+        self.time_to_first_audio = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def start_turn(self):
+        """Cancel any speech in progress and start timing a new turn."""
+        self.cancel()
+        with self._lock:
+            self._turn_started = time.perf_counter()
+
+    def speak(self, text):
+        """Queue `text` for the current turn without blocking.
+
+        Once `max_queue` sentences are waiting, new text is appended to the
+        last one, so the streamed answer never waits for speech to catch up.
+        """
+        with self._ready:
+            if len(self._pending) >= self.max_queue and self._pending[-1][0] == self._epoch:
+                epoch, queued = self._pending[-1]
+                self._pending[-1] = (epoch, f"{queued} {text}")
+            else:
+                self._pending.append((self._epoch, text))
+            self._ready.notify()
+
+    def cancel(self):
+        """Barge-in: drop queued sentences and stop the current one."""
+        with self._lock:
+            self._epoch += 1
+            self._turn_started = None
+            self._first_audio = None
+            self._pending.clear()
+        # The engine is stopped by the worker itself (see `_on_word`); the
+        # player is a separate process and can be stopped from here
+        if self._player is not None:
+            self._player.stop()
+
+    def turn_time_to_first_audio(self):
+        """Seconds from `start_turn` until the turn's audio started, or None if it has not yet."""
+        with self._lock:
+            return self._first_audio
+
+    def close(self):
+        self.cancel()
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        try:
+            self._engine = self._engine_factory()
+        except Exception as e:
+            logging.error(f"Failed to initialize TTS engine: {str(e)}")
+            return
+        connect = getattr(self._engine, "connect", None)
+        if connect is not None:
+            connect("started-word", self._on_word)
+            self._word_events = True
+        while True:
+            with self._ready:
+                while not self._pending and not self._closed:
+                    self._ready.wait()
+                if self._closed:
+                    break
+                epoch, text = self._pending.popleft()
+            try:
+                self._say(epoch, text)
+            except Exception as e:
+                logging.error(f"Error during speech: {str(e)}")
+
+    def _current(self, epoch):
+        with self._lock:
+            return epoch == self._epoch
+
+    def _audio_started(self, epoch):
+        # Records the turn's time to first audio; False if `epoch` was cancelled
+        with self._lock:
+            if epoch != self._epoch:
+                return False
+            if self._turn_started is not None and self._first_audio is None:
+                self._first_audio = time.perf_counter() - self._turn_started
+                self.time_to_first_audio.append(self._first_audio)
+            return True
+
+    def _on_word(self, name, location, length):
+        # Called by the engine on the worker thread, so stopping here is safe
+        if self._speaking is not None and not self._audio_started(self._speaking):
+            self._engine.stop()
+
+    def _say(self, epoch, text):
+        if self.cache is None:
+            if not self._current(epoch):
+                return
+            if not self._word_events:
+                # Without word callbacks, audio is taken to start with `say`
+                self._audio_started(epoch)
+            self._speaking = epoch
+            try:
+                self._engine.say(text)
+                self._engine.runAndWait()
+            finally:
+                self._speaking = None
+            return
+        key = audio_key(text, voice_settings(self._engine))
+        path = self.cache.get(key)
+        if path is None:
+            def render(out_path):
+                self._engine.save_to_file(text, out_path)
+                self._engine.runAndWait()
+            path = self.cache.synthesize(key, render)
+        # Checked under the player's lock, so a cancel either skips or stops this sentence
+        self._player.play(path, current=lambda: self._audio_started(epoch))
+
+
+def speak_stream(chunks, worker, splitter=None):
+    """Yield `chunks` unchanged while queueing their sentences on `worker`."""
+    splitter = splitter or SentenceSplitter()
+    for chunk in chunks:
+        for sentence in splitter.feed(chunk.content):
+            worker.speak(sentence)
+        yield chunk
+    for sentence in splitter.flush():
+        worker.speak(sentence)
+
+
+class _SimulatedEngine:
+    # Stands in for pyttsx3: "speaks" at a fixed number of characters per second
+    def __init__(self, chars_per_second=15):
+        self.chars_per_second = chars_per_second
+        self._pending = []
+        self._callbacks = []
+        self._stopped = False
+
+    def connect(self, topic, callback):
+        if topic == "started-word":
+            self._callbacks.append(callback)
+
+    def say(self, text):
+        self._pending.append(text)
+
+    def runAndWait(self):
+        self._stopped = False
+        for text in self._pending:
+            for match in re.finditer(r"\S+", text):
+                for callback in self._callbacks:
+                    callback(None, match.start(), len(match.group()))
+                if self._stopped:
+                    break
+                time.sleep((len(match.group()) + 1) / self.chars_per_second)
+            if self._stopped:
+                break
+        self._pending = []
+
+    def stop(self):
+        self._stopped = True
+
+
+def _benchmark(runs=3):
+    from langchain_core.messages import HumanMessage
+    from fake_openai_server import make_response_text, start_server
+    from model_factory import create_http_clients, create_model
+
+    server = start_server(response_text=make_response_text(120), tokens_per_second=40,
+                          first_token_delay=0.3)
+    model = create_model("gpt-3.5-turbo", http_clients=create_http_clients(),
+                         base_url=server.base_url, api_key="sk-fake")
+    worker = SpeechWorker(_SimulatedEngine)
+    messages = [HumanMessage(content="Tell me a story.")]
+
+    for pipelined in (False, True):
+        samples = []
+        for _ in range(runs):
+            worker.start_turn()
+            if pipelined:
+                for _ in speak_stream(model.stream(messages), worker):
+                    pass
+            else:
+                worker.speak("".join(chunk.content for chunk in model.stream(messages)))
+            while worker.turn_time_to_first_audio() is None:
+                time.sleep(0.01)
+            samples.append(worker.turn_time_to_first_audio() * 1000)
+        label = "sentence-pipelined" if pipelined else "full response"
+        print(f"{label:>18}: first audio after {sum(samples) / runs:7.1f}ms (mean of {runs})")
+    worker.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,341 @@
+"""Per-session vector memory over past turns, recalled by relevance.
+
+The trimmer keeps the newest turns; `VectorMemory` adds back the older turns
+that matter to the new message. Every finished turn (a user message and the
+reply) is embedded and appended to its session's `MemoryIndex`, a NumPy
+matrix grown by doubling, so indexing is incremental and a search is one
+matrix product over all past turns:
+
+    scores = queries @ vectors.T        (one row per query)
+
+The recall stage runs ahead of the trimmer. It searches with the new message
+and the previous exchange as a batch of two queries, skips turns the trimmer
+will keep anyway, and packs the best matches above `min_score` into the
+leading system message (after the compaction summary, if any), which the
+trimmer always keeps. Recalled text is capped at `max_tokens`.
+
+Embeddings come from `HashingEmbedder` by default, which hashes words and
+word pairs into a fixed number of dimensions and needs no model or network;
+any `texts -> (n, dim) array` callable can be passed instead.
+
+Run this module directly for add/query latency and memory at 10k+ turns:
+
+    python vector_memory.py --turns 10000 50000
+"""
+import argparse
+import re
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict, deque
+
+import numpy as np
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+
+from compaction import SPEAKERS, split_summary
+from token_counting import trim_last
+
+RECALL_HEADER = "Relevant earlier messages:"
+
+TOKEN_RE = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can could do does for from had has have how i if in is it its "
+    "me of on or so that the their them then there these they this to was we were what when "
+    "which who why will with would you your".split()
+)
+
+
+class HashingEmbedder:
+    """Offline text embedding: signed feature hashing of words and word pairs, L2-normalized."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def __call__(self, texts):
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            words = [w for w in TOKEN_RE.findall(text.lower()) if w not in STOP_WORDS]
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h >> 31 else -1.0)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (rows, cols), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+def turn_text(turn) -> str:
+    return "\n".join(f"{SPEAKERS.get(m.type, m.type)}: {m.content}" for m in turn)
+
+
+class MemoryIndex:
+    """Unit vectors of one session's past turns, in order, with the turns themselves."""
+
+    def __init__(self, dim, capacity=64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.turns = []
+        self.pending = []  # messages of a turn whose reply has not been appended yet
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.turns)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes
+
+    def add(self, turns, vectors):
+        needed = len(self.turns) + len(turns)
+        if needed > len(self.vectors):
+            capacity = len(self.vectors)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.turns)] = self.vectors[:len(self.turns)]
+            self.vectors = grown
+        self.vectors[len(self.turns):needed] = vectors
+        self.turns.extend(turns)
+
+    def search(self, queries, k, exclude_last=0):
+        """Top-`k` turns for each row of `queries`, skipping the newest `exclude_last` turns.
+
+        Returns (indices, scores), both shaped (len(queries), k), best first.
+        """
+        n = len(self.turns) - exclude_last
+        k = min(k, n)
+        if k <= 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.intp), empty
+        # (n, dim) @ (dim, q) walks the matrix in row order, about 2x faster than queries @ vectors.T
+        scores = (self.vectors[:n] @ queries.T).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class IndexedHistory(BaseChatMessageHistory):
+    """A session history that also appends its new turns to the session's `MemoryIndex`."""
+
+    def __init__(self, history, memory, index):
+        self.history = history
+        self.memory = memory
+        self.index = index
+
+    @property
+    def messages(self):
+        return self.history.messages
+
+    def add_messages(self, messages) -> None:
+        self.history.add_messages(messages)
+        self.memory.add_messages(self.index, messages)
+
+    def clear(self) -> None:
+        self.history.clear()
+        self.memory.forget(self.index)
+
+
+class VectorMemory:
+    """Per-session `MemoryIndex`es, kept for at most `max_sessions` sessions (LRU).
+
+    Pass `drop` as the session store's `on_evict`, so a session ID reused
+    after its history was evicted starts with an empty index.
+
+    `keep_tokens` must match the history budget the trimmer leaves for
+    recent messages, so turns it keeps are not recalled twice.
+    """
+
+    def __init__(self, token_counter, embed=None, dim=256, k=4, min_score=0.2,
+                 max_tokens=120, keep_tokens=65, max_sessions=10000):
+        self.token_counter = token_counter
+        self.embed = embed or HashingEmbedder(dim)
+        self.dim = dim
+        self.k = k
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.keep_tokens = keep_tokens
+        self.max_sessions = max_sessions
+        self.recall_stage = RunnableLambda(self._recall)
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._recall_times = deque(maxlen=1024)
+        self._stats = {"recalls": 0, "recalled_turns": 0, "evictions": 0}
+
+    @property
+    def budget(self):
+        """Tokens the recalled turns can add to the prompt, framing included."""
+        return self.max_tokens + self.token_counter.count_message(SystemMessage(content=RECALL_HEADER))
+
+    def index_for(self, session_id, history=None):
+        """Return the index of `session_id`, building it from `history` if it is new."""
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is not None:
+                self._indexes.move_to_end(session_id)
+                return index
+            index = self._indexes[session_id] = MemoryIndex(self.dim)
+            while self.max_sessions and len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
+                self._stats["evictions"] += 1
+        if history is not None:
+            self.add_messages(index, history.messages)
+        return index
+
+    def history_factory(self, get_session_history):
+        """Wrap a session history factory so appended turns are indexed."""
+        def get_history(session_id: str):
+            history = get_session_history(session_id)
+            return IndexedHistory(history, self, self.index_for(session_id, history))
+        return get_history
+
+    def add_messages(self, index, messages):
+        # A turn is a user message and everything after it up to the next one
+        with index.lock:
+            turns = []
+            pending = index.pending
+            for message in messages:
+                if isinstance(message, SystemMessage):
+                    continue
+                if isinstance(message, HumanMessage) and pending:
+                    turns.append(pending)
+                    pending = []
+                pending.append(message)
+            if pending and not isinstance(pending[-1], HumanMessage):
+                turns.append(pending)
+                pending = []
+            index.pending = pending
+            if turns:
+                index.add(turns, self.embed([turn_text(turn) for turn in turns]))
+
+    def drop(self, session_id):
+        """Discard the index of `session_id`; the next turn rebuilds it from the history."""
+        with self._lock:
+            self._indexes.pop(session_id, None)
+
+    def forget(self, index):
+        with index.lock:
+            index.vectors = np.zeros((64, self.dim), dtype=np.float32)
+            index.turns = []
+            index.pending = []
+
+    def recall(self, session_id, messages):
+        """Return `messages` with relevant older turns added to the leading system message."""
+        if not messages:
+            return messages
+        start = time.perf_counter()
+        summary, body = split_summary(messages)
+        index = self.index_for(session_id)
+        # Turns the trimmer keeps are already in the prompt; the new message is not indexed yet
+        kept = trim_last(body, self.keep_tokens, self.token_counter, include_system=False)
+        recent = sum(isinstance(m, HumanMessage) for m in kept[:-1])
+
+        queries = [body[-1].content]
+        previous = body[max(0, len(body) - 3):-1]
+        if previous:
+            queries.append(turn_text(previous))
+        with index.lock:
+            indices, scores = index.search(self.embed(queries), self.k, exclude_last=recent)
+            best = {}
+            for i, score in zip(indices.ravel().tolist(), scores.ravel().tolist()):
+                if score >= self.min_score and score > best.get(i, -1.0):
+                    best[i] = score
+            chosen, tokens = [], 0
+            for i in sorted(best, key=best.get, reverse=True):
+                text = turn_text(index.turns[i])
+                cost = self.token_counter.count_text(text)
+                if tokens + cost > self.max_tokens:
+                    continue
+                chosen.append((i, text))
+                tokens += cost
+
+        with self._lock:
+            self._stats["recalls"] += 1
+            self._stats["recalled_turns"] += len(chosen)
+            self._recall_times.append(time.perf_counter() - start)
+        if not chosen:
+            return messages
+        recalled = RECALL_HEADER + "\n" + "\n".join(text for _, text in sorted(chosen))
+        content = recalled if summary is None else f"{summary.content}\n\n{recalled}"
+        return [SystemMessage(content=content)] + body
+
+    def _recall(self, messages, config):
+        return self.recall(config["configurable"]["session_id"], messages)
+
+    def stats(self):
+        with self._lock:
+            indexes = list(self._indexes.values())
+            times = sorted(self._recall_times)
+            pick = lambda q: round(times[min(len(times) - 1, int(q * len(times)))] * 1000, 2) if times else None
+            return {
+                **self._stats,
+                "sessions": len(indexes),
+                "turns": sum(len(index) for index in indexes),
+                "vector_bytes": sum(index.nbytes for index in indexes),
+                "recall_ms_p50": pick(0.50),
+                "recall_ms_p95": pick(0.95),
+            }
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"p50={pick(0.50):.3f}ms p95={pick(0.95):.3f}ms"
+
+
+def _benchmark(turn_counts, queries=200, batch=32):
+    from langchain_core.messages import AIMessage
+
+    from token_counting import TokenCounter
+
+    topics = ["pasta", "trains", "the weather", "chess", "python", "gardening", "jazz", "taxes"]
+    for turns in turn_counts:
+        memory = VectorMemory(TokenCounter())
+        tracemalloc.start()
+        index = memory.index_for("bench")
+        add_times = []
+        for i in range(turns):
+            topic = topics[i % len(topics)]
+            messages = [HumanMessage(content=f"Question {i}: tell me something about {topic} number {i}."),
+                        AIMessage(content=f"Here is fact {i} about {topic}: it is interesting in its own way.")]
+            start = time.perf_counter()
+            memory.add_messages(index, messages)
+            add_times.append(time.perf_counter() - start)
+        _, traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        history = [m for turn in index.turns[-4:] for m in turn]
+        single, batched, recall = [], [], []
+        for q in range(queries):
+            vector = memory.embed([f"what did you say about {topics[q % len(topics)]} number {q * 7}?"])
+            start = time.perf_counter()
+            index.search(vector, memory.k)
+            single.append(time.perf_counter() - start)
+            vectors = memory.embed([f"{topics[(q + j) % len(topics)]} number {j}" for j in range(batch)])
+            start = time.perf_counter()
+            index.search(vectors, memory.k)
+            batched.append((time.perf_counter() - start) / batch)
+            message = HumanMessage(content=f"Remind me about {topics[q % len(topics)]} number {q * 7}?")
+            start = time.perf_counter()
+            memory.recall("bench", history + [message])
+            recall.append(time.perf_counter() - start)
+
+        print(f"{turns} turns: vectors {index.nbytes / 2**20:.1f}MiB "
+              f"({len(index) * memory.dim * 4 / 2**20:.1f}MiB used), traced peak {traced / 2**20:.1f}MiB")
+        print(f"  add one turn        {_percentiles(add_times)}")
+        print(f"  top-{memory.k} search        {_percentiles(single)}")
+        print(f"  batched, per query  {_percentiles(batched)} ({batch} queries per call)")
+        print(f"  recall stage        {_percentiles(recall)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector memory latency and memory benchmark")
+    parser.add_argument("--turns", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    _benchmark(args.turns, args.queries)